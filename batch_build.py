@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Batch Build
+-----------------------------------------------------------------------
+Builds one material per texture folder for large numbers of folders
+without freezing Maya. Worker threads scan, classify and probe the
+folders and queue the materials ready to be built; the main thread,
+the only one allowed to call maya.cmds, builds them from the queue in
+short time slices scheduled with executeDeferred, so that the UI keeps
+responding between slices.
+-----------------------------------------------------------------------
+'''
+
+import threading
+import time
+import maya.cmds as my
+import maya.utils
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import material_creator
+from . import material_library
+from . import texture_info
+
+
+WINDOW = "materialCreatorBatchBuild"
+PROGRESS_FIELD = "batchBuildProgressBar"
+STATUS_FIELD = "batchBuildStatus"
+PAUSE_BUTTON = "batchBuildPauseButton"
+
+WORKERS = 4
+## Main thread time spent building before giving control back to Maya
+CHUNK_TIME = 0.05
+POLL_TIME = 0.01
+## Wait before the next slice when no job was ready, so the main thread doesn't spin on the queue
+IDLE_TIME = 0.1
+
+
+class BuildJob():
+
+    def __init__(self, name, directory, texture_set):
+        self.name = name
+        self.directory = directory
+        self.texture_set = texture_set
+        self.unreadable = []
+        self.memory = 0
+
+    def isEmpty(self):
+        return not any(tmap.exists() for tmap in self.texture_set.set)
+
+
+def prepareJob(folder, classify=False):
+    '''
+    This function scans, classifies and probes a texture folder and returns its BuildJob.
+    Files whose header can't be read are removed from the texture set. Maya is not used.
+    '''
+
+    texture_set = material_creator.TextureSet(None)
+    texture_set.loadTextures(folder, classify=classify, verbose=False)
+
+    job = BuildJob(material_library.getMaterialName(folder), folder, texture_set)
+
+    for tmap in texture_set.set:
+        for path in list(tmap.set):
+            info = texture_info.readTextureInfo(path)
+            if info is None:
+                tmap.set.remove(path)
+                job.unreadable.append(path)
+            else:
+                job.memory += info.getMemory()
+
+    return job
+
+
+class BuildProducer(threading.Thread):
+    '''
+    Takes folders from a queue and puts a BuildJob for each into the jobs queue,
+    or None when a folder can't be read.
+    '''
+
+    def __init__(self, folders, jobs, cancelled, classify=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.folders = folders
+        self.jobs = jobs
+        self.cancelled = cancelled
+        self.classify = classify
+
+    def run(self):
+        while not self.cancelled.is_set():
+            try:
+                folder = self.folders.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                job = prepareJob(folder, classify=self.classify)
+            except Exception:
+                job = None
+            self.jobs.put(job)
+
+
+class BatchBuilder():
+    '''
+    Builds a material for each folder on the main thread, from the jobs queued by
+    the producers, showing the progress and the throughput in a window.
+    '''
+
+    def __init__(self, folders, engine=material_creator.ARNOLD, maps=None, classify=False, workers=WORKERS, undo=None, **options):
+        self.folders = list(folders)
+        self.engine = engine
+        self.maps = maps
+        self.classify = classify
+        self.workers = workers
+
+        ## Headless builds are never undone, so undo is not recorded by default
+        if undo is None:
+            undo = material_creator.UNDO_OFF if my.about(batch=True) else material_creator.UNDO_MATERIAL
+        self.undo = undo
+
+        self.options = dict(material_library.DEFAULT_OPTIONS)
+        self.options.update(options)
+
+        self.jobs = queue.Queue()
+        self.cancelled = threading.Event()
+        self.paused = False
+        ## A drain is scheduled and hasn't run yet
+        self.scheduled = False
+
+        self.total = len(self.folders)
+        self.processed = 0
+        self.built = 0
+        self.skipped = 0
+        self.failed = 0
+        self.materials = []
+        self.start_time = None
+        self.build_time = 0.0
+
+    def start(self, blocking=None):
+        '''
+        This function starts the producers and builds the materials, in time slices unless
+        blocking is True, which is the default in batch mode and when the whole batch is
+        undone in one step.
+        '''
+
+        folder_queue = queue.Queue()
+        for folder in self.folders:
+            folder_queue.put(folder)
+
+        self.start_time = time.time()
+        for index in range(min(self.workers, max(self.total, 1))):
+            BuildProducer(folder_queue, self.jobs, self.cancelled, classify=self.classify).start()
+
+        ## Without the UI there is nothing to keep responsive, and a batch chunk can't stay
+        ## open while the user works between the slices
+        if blocking is None:
+            blocking = my.about(batch=True) or self.undo == material_creator.UNDO_BATCH
+        if blocking:
+            chunk = self.openUndoChunk()
+            try:
+                while self.processed < self.total and not self.cancelled.is_set():
+                    self.buildChunk(None)
+            finally:
+                self.closeUndoChunk(chunk)
+            self.finish()
+            return
+
+        self.makeWindow()
+        self.schedule()
+
+    def openUndoChunk(self):
+        '''
+        This function opens the batch chunk, or turns undo off, for the build of a slice or of
+        the whole batch. Returns None when each material is recorded in its own chunk.
+        '''
+
+        if self.undo == material_creator.UNDO_MATERIAL:
+            return None
+
+        chunk = material_creator.UndoChunk("Batch Build", record=self.undo == material_creator.UNDO_BATCH)
+        chunk.open()
+        return chunk
+
+    def closeUndoChunk(self, chunk):
+        if chunk is not None:
+            chunk.close()
+
+    def schedule(self, delay=None):
+        '''
+        This function schedules the next slice on the main thread, after delay seconds if given,
+        unless a slice is already scheduled.
+        '''
+
+        if self.scheduled:
+            return
+        self.scheduled = True
+
+        if delay is None:
+            maya.utils.executeDeferred(self.drain)
+        else:
+            timer = threading.Timer(delay, maya.utils.executeDeferred, [self.drain])
+            timer.daemon = True
+            timer.start()
+
+    def pause(self, *args):
+        self.paused = not self.paused
+        if my.button(PAUSE_BUTTON, exists=True):
+            my.button(PAUSE_BUTTON, edit=True, label="Resume" if self.paused else "Pause")
+        if not self.paused:
+            self.schedule()
+
+    def cancel(self, *args):
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        ## drain won't be scheduled again while paused, so the build is closed here
+        if self.paused and not self.scheduled:
+            self.finish()
+
+    def drain(self):
+        self.scheduled = False
+        if self.cancelled.is_set():
+            self.finish()
+            return
+        if self.paused:
+            return
+
+        ## Undo is turned off for the slice only, so the user edits between slices are recorded
+        chunk = self.openUndoChunk()
+        try:
+            processed = self.buildChunk(CHUNK_TIME)
+        finally:
+            self.closeUndoChunk(chunk)
+        self.updateWindow()
+
+        if self.processed >= self.total:
+            self.finish()
+        elif processed == 0:
+            ## The producers haven't queued anything yet
+            self.schedule(IDLE_TIME)
+        else:
+            self.schedule()
+
+    def buildChunk(self, chunk_time):
+        '''
+        This function builds the queued materials until chunk_time seconds have passed,
+        or until the next job is ready if chunk_time is None. Returns the number of jobs processed.
+        '''
+
+        processed = self.processed
+        deadline = time.time() + (chunk_time or 0.0)
+        while self.processed < self.total and not self.cancelled.is_set():
+            try:
+                job = self.jobs.get(timeout=POLL_TIME)
+            except queue.Empty:
+                break
+
+            self.buildJob(job)
+            if chunk_time is None or time.time() >= deadline:
+                break
+
+        return self.processed - processed
+
+    def buildJob(self, job):
+        self.processed += 1
+
+        if job is None or job.isEmpty():
+            self.skipped += 1
+            return
+
+        for path in job.unreadable:
+            my.warning("Cannot read texture %s." % path.replace("\\", "/"))
+
+        job.texture_set.selectTier(self.options["tier"])
+
+        maps = self.maps
+        if maps is None:
+            maps = [tmap.field for tmap in job.texture_set.set if tmap.exists()]
+
+        start = time.time()
+        try:
+            if self.undo == material_creator.UNDO_MATERIAL:
+                with material_creator.UndoChunk("Build %s" % job.name):
+                    mats = material_library.buildNetwork(job.name, job.directory, job.texture_set, self.engine, maps, self.options)
+            else:
+                mats = material_library.buildNetwork(job.name, job.directory, job.texture_set, self.engine, maps, self.options)
+        except Exception as e:
+            my.warning("Cannot build material %s: %s" % (job.name, e))
+            self.failed += 1
+            return
+        finally:
+            self.build_time += time.time() - start
+
+        self.built += 1
+        self.materials.extend(mat.mat_node for mat in mats)
+
+    def getRate(self):
+        elapsed = time.time() - self.start_time
+        if elapsed <= 0.0:
+            return 0.0
+        return self.built / elapsed
+
+    def getStatus(self):
+        return "%s / %s folders, %s built, %s skipped, %s failed - %.1f materials/s" % (
+            self.processed, self.total, self.built, self.skipped, self.failed, self.getRate())
+
+    def makeWindow(self):
+        if my.window(WINDOW, query=True, exists=True):
+            my.deleteUI(WINDOW)
+
+        window = my.window(WINDOW, title="Batch Build", width=420)
+        my.columnLayout(adjustableColumn=True, rowSpacing=6)
+        my.text(STATUS_FIELD, label=self.getStatus(), align='left')
+        my.progressBar(PROGRESS_FIELD, maxValue=max(self.total, 1), height=12)
+        my.rowLayout(numberOfColumns=2)
+        my.button(PAUSE_BUTTON, label="Pause", width=100, command=self.pause)
+        my.button(label="Cancel", width=100, command=self.cancel)
+        my.setParent('..')
+        my.showWindow(window)
+
+        ## Closing the window cancels the build
+        my.scriptJob(uiDeleted=[WINDOW, self.cancel], runOnce=True)
+
+    def updateWindow(self):
+        if not my.window(WINDOW, query=True, exists=True):
+            return
+
+        my.text(STATUS_FIELD, edit=True, label=self.getStatus())
+        my.progressBar(PROGRESS_FIELD, edit=True, progress=self.processed)
+
+    def finish(self):
+        if self.start_time is None:
+            return
+
+        elapsed = time.time() - self.start_time
+        self.start_time = None
+        self.cancelled.set()
+
+        state = "cancelled" if self.processed < self.total else "done"
+        line = "Batch build %s: %s materials built, %s skipped, %s failed in %.1f s (%.1f materials/s, %.1f s building)." % (
+            state, self.built, self.skipped, self.failed, elapsed, self.built / elapsed if elapsed > 0.0 else 0.0, self.build_time)
+        material_creator.printLine(line)
+
+        if my.window(WINDOW, query=True, exists=True):
+            my.deleteUI(WINDOW)
+
+
+def buildFolders(root, engine=material_creator.ARNOLD, **kwargs):
+    '''
+    This function starts a batch build of a material for each subfolder of root
+    and returns the BatchBuilder.
+    '''
+
+    builder = BatchBuilder(material_library.getTextureFolders(root), engine=engine, **kwargs)
+    builder.start()
+    return builder
+
+
+def benchmarkUndo(root, engine=material_creator.ARNOLD, modes=material_creator.UNDO_MODES, **kwargs):
+    '''
+    This function builds the subfolders of root once per undo mode, each time in a new scene
+    (unsaved changes are lost), and prints the build time and the Maya heap memory used.
+    Returns a dictionary from mode to (seconds, megabytes).
+    '''
+
+    folders = material_library.getTextureFolders(root)
+    results = {}
+    for mode in modes:
+        my.file(new=True, force=True)
+        my.flushUndo()
+        memory = my.memory(heapMemory=True, megaByte=True)
+
+        start = time.time()
+        BatchBuilder(folders, engine=engine, undo=mode, **kwargs).start(blocking=True)
+        elapsed = time.time() - start
+
+        results[mode] = (elapsed, my.memory(heapMemory=True, megaByte=True) - memory)
+        line = "Undo %s: %s folders built in %.2f s, %.1f MB of heap memory used." % (mode, len(folders), results[mode][0], results[mode][1])
+        material_creator.printLine(line)
+
+    return results
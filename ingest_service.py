@@ -0,0 +1,571 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Ingest Service
+-----------------------------------------------------------------------
+Watches a hot folder where texture folders are dropped and builds the
+material of each drop into a material library, without anybody opening
+Maya. A drop is queued once its files stop changing; the queue is kept
+on disk, so that jobs survive a restart of the service. Jobs are built
+by a limited number of headless mayapy workers and retried when they
+fail. The service itself runs in any Python, only the workers need
+Maya: a stand-in worker writing placeholder files can replace them to
+test the service.
+
+    python -m MaterialCreator.ingest_service watch HOT_FOLDER LIBRARY
+    python -m MaterialCreator.ingest_service status HOT_FOLDER
+-----------------------------------------------------------------------
+'''
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+## Run with python -m, where __name__ is __main__
+MODULE = (__package__ or "MaterialCreator") + ".ingest_service"
+
+STATE_FOLDER = ".ingest"
+QUEUE_FILE = "queue.json"
+LOG_FILE = "ingest.log"
+## A drop containing this file is complete without waiting for its files to settle
+READY_MARKER = "_READY"
+## A drop containing this file makes the stand-in worker fail
+STAND_IN_FAIL = "_FAIL"
+
+SETTLE_TIME = 30.0
+POLL_TIME = 5.0
+WORKER_POLL_TIME = 0.5
+WORKERS = 2
+RETRIES = 2
+RETRY_DELAY = 60.0
+## A worker running longer than this is stopped and its attempt counts as failed
+JOB_TIMEOUT = 3600.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+EMPTY = "empty"
+
+PARTIAL_SUFFIXES = (".tmp", ".part", ".partial", ".crdownload", ".filepart")
+TEXTURE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".exr", ".tga", ".hdr", ".tx")
+
+
+def getDropSignature(folder):
+    '''
+    This function returns the number of files, total size and latest modification time of the
+    files of a drop folder, or None while a file is still being copied under a temporary name.
+    '''
+
+    count = 0
+    size = 0
+    latest = 0.0
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return None
+
+    for f in names:
+        path = os.path.join(folder, f)
+        if f.startswith(".") or not os.path.isfile(path):
+            continue
+        if f.lower().endswith(PARTIAL_SUFFIXES):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        count += 1
+        size += stat.st_size
+        latest = max(latest, stat.st_mtime)
+
+    return [count, size, round(latest, 3)]
+
+
+def writeJson(path, data):
+    temp = path + ".tmp"
+    with open(temp, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+class FolderWatcher():
+    '''
+    Wakes the service when files change in the watched folders, with inotify when it is
+    available, or when the poll time has passed.
+    '''
+
+    def __init__(self, folder):
+        self.inotify = None
+        self.watched = set()
+
+        if inotify_simple is not None:
+            flags = inotify_simple.flags
+            self.mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+            try:
+                self.inotify = inotify_simple.INotify()
+            except OSError:
+                self.inotify = None
+        self.watch(folder)
+
+    def watch(self, folder):
+        if self.inotify is None or folder in self.watched:
+            return
+        try:
+            self.inotify.add_watch(folder, self.mask)
+            self.watched.add(folder)
+        except OSError:
+            pass
+
+    def getMode(self):
+        return "polling" if self.inotify is None else "inotify"
+
+    def wait(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+        self.inotify.read(timeout=int(timeout * 1000))
+
+
+class IngestQueue():
+    '''
+    Jobs of the service by drop folder name, saved to a JSON file after every change.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.jobs = json.load(f)
+
+        ## Jobs running when the service stopped are run again
+        for job in self.jobs.values():
+            if job["state"] == RUNNING:
+                job["state"] = QUEUED
+
+    def save(self):
+        writeJson(self.path, self.jobs)
+
+    def add(self, name, folder, signature):
+        self.jobs[name] = {"name": name,
+                           "folder": folder,
+                           "signature": signature,
+                           "state": QUEUED,
+                           "attempts": 0,
+                           "error": None,
+                           "file": None,
+                           "queued": time.time(),
+                           "not_before": 0.0}
+        self.save()
+
+    def getReady(self, now):
+        jobs = [job for job in self.jobs.values() if job["state"] == QUEUED and job["not_before"] <= now]
+        return sorted(jobs, key=lambda job: job["queued"])
+
+    def getCounts(self):
+        counts = dict((state, 0) for state in [QUEUED, RUNNING, DONE, FAILED, EMPTY])
+        for job in self.jobs.values():
+            counts[job["state"]] += 1
+        return counts
+
+
+class MayapyWorker():
+    '''
+    Builds the jobs in headless Maya sessions, with the material library of the package.
+    '''
+
+    def __init__(self, executable):
+        self.executable = executable
+
+    def getCommand(self, spec_path):
+        return [self.executable, "-m", MODULE, "worker", spec_path]
+
+
+class StandInWorker():
+    '''
+    Runs the stand-in worker with the Python of the service, to test it without Maya.
+    The module file is run as a script, so it works whatever the name of the package folder.
+    '''
+
+    def getCommand(self, spec_path):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        return [sys.executable, script, "stand-in", spec_path]
+
+
+def findMayapy(executable=None):
+    '''
+    This function returns the mayapy executable given, in MAYA_LOCATION or on the PATH, or None.
+    '''
+
+    if executable is not None:
+        return executable if os.path.isfile(executable) else None
+
+    name = "mayapy.exe" if sys.platform.startswith("win") else "mayapy"
+    folders = [os.path.join(os.environ["MAYA_LOCATION"], "bin")] if "MAYA_LOCATION" in os.environ else []
+    folders += os.environ.get("PATH", "").split(os.pathsep)
+    for folder in folders:
+        candidate = os.path.join(folder, name)
+        if os.path.isfile(candidate):
+            return candidate
+
+    return None
+
+
+class IngestService():
+    '''
+    Queues the complete drops of the hot folder and builds them with a pool of worker processes.
+    A drop is complete when its files haven't changed for settle_time seconds, or when it
+    contains the ready marker file. A drop whose files change after it was built is built again.
+    Workers running longer than job_timeout seconds are stopped, so that a hung mayapy doesn't
+    hold its worker slot forever.
+    '''
+
+    def __init__(self, hot_folder, library, worker, engine="Arnold", workers=WORKERS, retries=RETRIES,
+                 settle_time=SETTLE_TIME, poll_time=POLL_TIME, retry_delay=RETRY_DELAY, job_timeout=JOB_TIMEOUT,
+                 options=None):
+        self.hot_folder = os.path.abspath(hot_folder)
+        self.library = os.path.abspath(library)
+        self.worker = worker
+        self.engine = engine
+        self.workers = workers
+        self.retries = retries
+        self.settle_time = settle_time
+        self.poll_time = poll_time
+        self.retry_delay = retry_delay
+        self.job_timeout = job_timeout
+        self.options = options or {}
+
+        self.state_dir = os.path.join(self.hot_folder, STATE_FOLDER)
+        self.jobs_dir = os.path.join(self.state_dir, "jobs")
+        for folder in [self.library, self.jobs_dir]:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+        self.queue = IngestQueue(os.path.join(self.state_dir, QUEUE_FILE))
+        self.watcher = FolderWatcher(self.hot_folder)
+        ## Drops not complete yet: name -> [signature, time since the signature is unchanged]
+        self.pending = {}
+        ## Jobs being built: name -> (process, log file, result path)
+        self.running = {}
+
+    def log(self, message):
+        line = "%s %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), message)
+        with open(os.path.join(self.state_dir, LOG_FILE), 'a') as f:
+            f.write(line + "\n")
+        print(line)
+        sys.stdout.flush()
+
+    def scan(self, now):
+        '''
+        This function checks the drop folders and queues the complete ones not built yet
+        or whose files changed since they were built.
+        '''
+
+        for name in sorted(os.listdir(self.hot_folder)):
+            folder = os.path.join(self.hot_folder, name)
+            if name.startswith(".") or not os.path.isdir(folder):
+                continue
+
+            signature = getDropSignature(folder)
+            if signature is None or signature[0] == 0:
+                self.pending.pop(name, None)
+                continue
+
+            job = self.queue.jobs.get(name)
+            if job is not None and (job["signature"] == signature or job["state"] == RUNNING):
+                continue
+
+            ready = os.path.isfile(os.path.join(folder, READY_MARKER))
+            previous = self.pending.get(name)
+            if previous is None or previous[0] != signature:
+                self.watcher.watch(folder)
+                self.pending[name] = [signature, now]
+                if not ready:
+                    continue
+            elif not ready and now - previous[1] < self.settle_time:
+                continue
+
+            del self.pending[name]
+            self.queue.add(name, folder, signature)
+            if job is None:
+                self.log("Queued %s (%s files)." % (name, signature[0]))
+            else:
+                self.log("Queued %s again, its files changed." % name)
+
+    def startJob(self, job, now):
+        job["attempts"] += 1
+        base = os.path.join(self.jobs_dir, "%s_%s" % (job["name"], job["attempts"]))
+        spec_path = base + ".json"
+        result_path = base + "_result.json"
+
+        if os.path.isfile(result_path):
+            os.remove(result_path)
+        writeJson(spec_path, {"folder": job["folder"], "library": self.library, "engine": self.engine,
+                              "options": self.options, "result": result_path})
+
+        ## The package is run as a module, so its parent folder has to be on the path
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(package_dir)] + [p for p in [env.get("PYTHONPATH")] if p])
+
+        log = open(base + ".log", 'w')
+        try:
+            process = subprocess.Popen(self.worker.getCommand(spec_path), stdout=log, stderr=subprocess.STDOUT, env=env)
+        except OSError as e:
+            log.close()
+            self.finishJob(job, None, base + ".log", now, str(e))
+            return
+
+        job["state"] = RUNNING
+        job["started"] = now
+        self.queue.save()
+        self.running[job["name"]] = (process, log, result_path)
+        self.log("Started %s, attempt %s." % (job["name"], job["attempts"]))
+
+    def finishJob(self, job, result, log_path, now, error):
+        if result is not None and result.get("file") is None:
+            job["state"] = EMPTY
+            job["error"] = None
+            self.log("Skipped %s, no textures found." % job["name"])
+        elif result is not None:
+            job["state"] = DONE
+            job["error"] = None
+            job["file"] = result["file"]
+            state = "Built" if result.get("built") else "Up to date"
+            self.log("%s %s: %s in %.1f s." % (state, job["name"], result["file"], now - job.get("started", now)))
+        else:
+            job["error"] = "%s, see %s" % (error, log_path)
+            if job["attempts"] > self.retries:
+                job["state"] = FAILED
+                self.log("Failed %s after %s attempts: %s." % (job["name"], job["attempts"], job["error"]))
+            else:
+                job["state"] = QUEUED
+                job["not_before"] = now + self.retry_delay * job["attempts"]
+                self.log("Attempt %s of %s failed: %s. Retrying in %.0f s." % (job["attempts"], job["name"], job["error"], job["not_before"] - now))
+
+        job["finished"] = now
+        self.queue.save()
+
+    def poll(self, now):
+        for name, (process, log, result_path) in list(self.running.items()):
+            job = self.queue.jobs[name]
+            if process.poll() is None:
+                if now - job["started"] <= self.job_timeout:
+                    continue
+                ## A worker waiting for a licence or a modal error never exits by itself
+                process.kill()
+                process.wait()
+                error = "timed out after %.0f s" % (now - job["started"])
+            else:
+                error = "exit code %s" % process.returncode
+
+            log.close()
+            del self.running[name]
+
+            result = None
+            if process.returncode == 0 and os.path.isfile(result_path):
+                with open(result_path, 'r') as f:
+                    result = json.load(f)
+            self.finishJob(job, result, log.name, now, error)
+
+    def dispatch(self, now):
+        for job in self.queue.getReady(now):
+            if len(self.running) >= self.workers:
+                break
+            self.startJob(job, now)
+
+    def step(self):
+        now = time.time()
+        self.scan(now)
+        self.poll(now)
+        self.dispatch(now)
+
+    def isIdle(self):
+        return len(self.pending) == 0 and len(self.running) == 0 and len(self.queue.getReady(float('inf'))) == 0
+
+    def run(self, duration=None, until_idle=False):
+        '''
+        This function runs the service until it is interrupted, for duration seconds or, if
+        until_idle is True, until no drop is pending, queued or running. Running workers are
+        stopped with the service and their jobs are run again at the next start.
+        '''
+
+        self.log("Watching %s (%s), building %s materials into %s with %s workers." % (
+            self.hot_folder, self.watcher.getMode(), self.engine, self.library, self.workers))
+
+        end = None if duration is None else time.time() + duration
+        try:
+            while end is None or time.time() < end:
+                self.step()
+                if until_idle and self.isIdle():
+                    break
+                ## Running workers are checked often, the folders when they change or every poll_time
+                self.watcher.wait(WORKER_POLL_TIME if len(self.running) > 0 else min(self.poll_time, self.settle_time))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for name, (process, log, result_path) in list(self.running.items()):
+            process.terminate()
+            process.wait()
+            log.close()
+            job = self.queue.jobs[name]
+            job["state"] = QUEUED
+            ## An interrupted attempt doesn't count
+            job["attempts"] -= 1
+        self.running = {}
+        self.queue.save()
+
+        counts = self.queue.getCounts()
+        self.log("Stopped: %s done, %s failed, %s empty, %s queued." % (counts[DONE], counts[FAILED], counts[EMPTY], counts[QUEUED]))
+
+
+def printStatus(hot_folder):
+    queue = IngestQueue(os.path.join(hot_folder, STATE_FOLDER, QUEUE_FILE))
+    counts = queue.getCounts()
+    print(", ".join("%s %s" % (count, state) for state, count in sorted(counts.items())))
+
+    for job in sorted(queue.jobs.values(), key=lambda job: job["queued"]):
+        line = "%s: %s" % (job["name"], job["state"])
+        if job["state"] == DONE:
+            line += " -> %s" % job["file"]
+        elif job["error"] is not None:
+            line += " (%s attempts, %s)" % (job["attempts"], job["error"])
+        print(line)
+
+
+## WORKERS ###############################################
+
+
+def runWorker(spec_path):
+    '''
+    This function builds the material of a drop folder into the library in a standalone
+    Maya session and writes the result file.
+    '''
+
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+
+    import maya.cmds as my
+    from . import material_library
+    from . import shard_build
+
+    ## Nothing is ever undone in a worker
+    my.undoInfo(state=False)
+
+    with open(spec_path, 'r') as f:
+        spec = json.load(f)
+
+    for plugin in shard_build.ENGINE_PLUGINS.get(spec["engine"], []):
+        my.loadPlugin(plugin, quiet=True)
+    my.file(new=True, force=True)
+
+    name = material_library.getMaterialName(spec["folder"])
+    path, built = material_library.ensureMaterial(spec["library"], name, spec["folder"], engine=spec["engine"], **spec["options"])
+
+    writeJson(spec["result"], {"name": name, "file": path, "built": built})
+
+
+def runStandInWorker(spec_path):
+    '''
+    This function stands in for the Maya worker, to test the service: it writes a placeholder
+    library file listing the textures of the drop folder. Fails if the drop has a _FAIL file.
+    '''
+
+    with open(spec_path, 'r') as f:
+        spec = json.load(f)
+
+    folder = spec["folder"]
+    if os.path.isfile(os.path.join(folder, STAND_IN_FAIL)):
+        raise RuntimeError("Stand-in failure requested by %s." % STAND_IN_FAIL)
+
+    name = re.sub(r'\W', "_", os.path.basename(os.path.normpath(folder)))
+    textures = sorted(f for f in os.listdir(folder) if f.lower().endswith(TEXTURE_EXTENSIONS))
+    if len(textures) == 0:
+        writeJson(spec["result"], {"name": name, "file": None, "built": False})
+        return
+
+    path = os.path.join(spec["library"], name + ".ma")
+    with open(path, 'w') as f:
+        f.write("//Maya ASCII stand-in for %s, %s material\n" % (name, spec["engine"]))
+        for texture in textures:
+            f.write("// %s\n" % texture)
+
+    writeJson(spec["result"], {"name": name, "file": path, "built": True})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m " + MODULE, description="Builds the texture folders dropped in a hot folder into a material library.")
+    commands = parser.add_subparsers(dest="command")
+
+    watch = commands.add_parser("watch", help="Watch a hot folder and build its drops.")
+    watch.add_argument("hot_folder")
+    watch.add_argument("library")
+    watch.add_argument("--engine", default="Arnold", choices=["Arnold", "VRay", "Octane", "ArnoldVRay"])
+    watch.add_argument("--workers", type=int, default=WORKERS)
+    watch.add_argument("--retries", type=int, default=RETRIES)
+    watch.add_argument("--settle-time", type=float, default=SETTLE_TIME)
+    watch.add_argument("--poll-time", type=float, default=POLL_TIME)
+    watch.add_argument("--retry-delay", type=float, default=RETRY_DELAY)
+    watch.add_argument("--job-timeout", type=float, default=JOB_TIMEOUT, help="Seconds after which a worker is stopped")
+    watch.add_argument("--mayapy", help="mayapy executable, found in MAYA_LOCATION or on the PATH by default")
+    watch.add_argument("--stand-in", action="store_true", help="Build placeholder files without Maya, for testing")
+    watch.add_argument("--until-idle", action="store_true", help="Stop once all the drops are built")
+    watch.add_argument("--ai-image", action="store_true")
+    watch.add_argument("--shared-placement", action="store_true")
+    watch.add_argument("--analyze", action="store_true")
+    watch.add_argument("--bake", action="store_true")
+    watch.add_argument("--tier", default=None)
+
+    status = commands.add_parser("status", help="Print the state of the jobs of a hot folder.")
+    status.add_argument("hot_folder")
+
+    for command in ["worker", "stand-in"]:
+        commands.add_parser(command).add_argument("spec")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        runWorker(args.spec)
+    elif args.command == "stand-in":
+        runStandInWorker(args.spec)
+    elif args.command == "status":
+        printStatus(args.hot_folder)
+    elif args.command == "watch":
+        if args.stand_in:
+            worker = StandInWorker()
+        else:
+            executable = findMayapy(args.mayapy)
+            if executable is None:
+                parser.error("Cannot find the mayapy executable, use --mayapy or set MAYA_LOCATION.")
+            worker = MayapyWorker(executable)
+
+        options = {"ai_image": args.ai_image, "shared_placement": args.shared_placement,
+                   "analyze": args.analyze, "bake": args.bake, "tier": args.tier}
+        service = IngestService(args.hot_folder, args.library, worker, engine=args.engine, workers=args.workers,
+                                retries=args.retries, settle_time=args.settle_time, poll_time=args.poll_time,
+                                retry_delay=args.retry_delay, job_timeout=args.job_timeout, options=options)
+        service.run(until_idle=args.until_idle)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
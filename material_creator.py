@@ -14,10 +14,13 @@ Tested on Maya: 2019, 2020, 2022
 import platform
 import maya.cmds as my
 import os
-import maya.mel as mel
 import re
-import sys
+import maya.mel as mel
+import maya.utils
+import threading
+import time
 import webbrowser
+from functools import partial
 
 if platform.python_version().startswith('2'):  
     from urllib2 import urlopen
@@ -39,6 +42,13 @@ WINDOW = "mat_creator"
 ARNOLD = "Arnold"
 VRAY = "VRay"
 OCTANE = "Octane"
+ARNOLD_VRAY = "ArnoldVRay"
+
+MULTI_ENGINES = [ARNOLD, VRAY]
+
+SHARED_TEXTURE_NODE = "materialCreator_2dTexture"
+PLACE2D_ATTRIBUTES = ["coverage", "translateFrame", "rotateFrame", "mirrorU", "mirrorV", "stagger", "wrapU", "wrapV",
+                      "repeatUV", "offset", "rotateUV", "noiseUV", "vertexUvOne", "vertexUvTwo", "vertexUvThree", "vertexCameraOne"]
 
 PREFIX = "prefix"
 SUFFIX = "suffix"
@@ -48,11 +58,53 @@ NAME_FIELD = 'nameField'
 FOLDER_FIELD = 'folderField'
 ENGINE_FIELD = 'engineSelection'
 ASSIGN_FIELD = 'assignCheckbox'
+AIIMAGE_FIELD = 'aiImageCheckbox'
+SHARED_PLACE_FIELD = 'sharedPlacementCheckbox'
+ANALYZE_FIELD = 'analyzeCheckbox'
+CLASSIFY_FIELD = 'classifyCheckbox'
+BAKE_FIELD = 'bakeCheckbox'
+TIER_FIELD = 'tierMenu'
+HIGHEST_TIER = "Highest"
+TIERS = ["1K", "2K", "4K", "8K"]
 PREFSUF_FIELD = "prefixSuffixField"
 PREFSUF_SEL = "prefixSuffixSelection"
+PROGRESS_FIELD = "scanProgressBar"
+CANCEL_BUTTON = "scanCancelButton"
+
+SCAN_BATCH = 64
+CLASSIFY_CONFIDENCE = 0.5
+THUMBNAIL_SIZE = 32
 
 MAT_SUFFIX = "_MAT"
 
+## Undo recording of bulk builds: one undo step per material, one for the whole batch, or none
+UNDO_MATERIAL = "material"
+UNDO_BATCH = "batch"
+UNDO_OFF = "off"
+UNDO_MODES = [UNDO_MATERIAL, UNDO_BATCH, UNDO_OFF]
+UNDO_LABELS = {"Each Material": UNDO_MATERIAL, "Whole Batch": UNDO_BATCH, "Off": UNDO_OFF}
+
+## Shader attributes changed by the variant parameters
+VARIANT_ATTRIBUTES = {ARNOLD: {"color": "baseColor", "roughness": "specularRoughness", "metalness": "metalness"},
+                      VRAY: {"color": "color", "roughness": "reflectionGlossiness", "metalness": "metalness"}}
+
+## Folder of Help.txt, Changelog.txt and the icons, resolved once from the module location
+SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+UPDATE_TIMEOUT = 5
+
+## Window kept hidden between launches, and shown again by the shelf button
+window_instance = None
+update_checked = False
+
+
+def printLine(line):
+    '''
+    This function prints a line in the Script Editor, escaping the characters that
+    would end the MEL string, such as the quotes of a path.
+    '''
+
+    mel.eval('print "%s"' % line.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+
 
 class RepositoryParser(HTMLParser):
     
@@ -70,6 +122,51 @@ class Map():
 
     def __init__(self):
         self.set = []
+        self.tiers = {}
+        ## Frames of animated textures by <f> pattern, set holds their first frame only
+        self.sequences = {}
+
+    def addFile(self, path):
+        '''
+        This function adds a file to the map. The frames of an animated texture are added
+        to the sequence of their tile and only the first frame is kept in set.
+        '''
+
+        from . import texture_info
+
+        pattern, padding = texture_info.getFramePattern(path)
+        if pattern is None:
+            self.set.append(path)
+            return
+
+        sequence = self.sequences.get(pattern)
+        if sequence is None:
+            sequence = texture_info.FileSequence(pattern, padding)
+            self.sequences[pattern] = sequence
+            self.set.append(path)
+
+        first = sequence.path
+        sequence.add(texture_info.getFrameNumber(path), path)
+        if first is not None and sequence.path != first and first in self.set:
+            self.set[self.set.index(first)] = sequence.path
+
+    def getSequence(self, path):
+        from . import texture_info
+
+        pattern = texture_info.getFramePattern(path)[0]
+        if pattern is None:
+            return None
+        return self.sequences.get(pattern)
+
+    def isSequence(self):
+        sequences = [self.getSequence(s) for s in self.set]
+        return any(sequence is not None and sequence.getFrameCount() > 1 for sequence in sequences)
+
+    def getFrameRanges(self):
+        sequence = self.getSequence(self.getFirstUdim())
+        if sequence is None:
+            return ""
+        return sequence.formatRanges()
         
     def isTiled(self):
         return len(self.set) > 1
@@ -78,19 +175,27 @@ class Map():
         return len(self.set)
 
     def getFirstUdim(self):
+        from . import texture_info
+
         for s in self.set:
-            if "1001" in s:
+            if texture_info.getUdimNumber(s) == "1001":
                 return s
         
         return self.set[0]
 
+    def getUdimPattern(self):
+        from . import texture_info
+
+        return texture_info.getUdimPattern(self.getFirstUdim())
+
     def getUVGridSize(self):
+        from . import texture_info
+
         u = 0
         v = 0
         for s in self.set:
-            match = re.match(r'.*(\d{4}).*', s)
-            if match is not None:
-                udim_number = match.group(1)
+            udim_number = texture_info.getUdimNumber(s)
+            if udim_number is not None:
                 if int(udim_number[-1]) > u:
                     u = int(udim_number[-1])
                 if int(udim_number[-2]) > v:
@@ -102,6 +207,59 @@ class Map():
     def exists(self):
         return not len(self.set) == 0
 
+    def groupTiers(self, header_tiers=None):
+        '''
+        This function groups the files by resolution tier when the same tile is found more than once,
+        reading the tier from a token like 2K in the file name or from the file header. header_tiers,
+        if given, holds the tiers already read from the headers by file path.
+        '''
+
+        from . import texture_info
+
+        files = list(self.set)
+        for paths in self.tiers.values():
+            files.extend(p for p in paths if p not in files)
+
+        self.tiers = {}
+        if len(set(texture_info.getUdimNumber(f) for f in files)) == len(files):
+            return
+
+        tiers = {}
+        for f in files:
+            if header_tiers is not None:
+                tier = texture_info.getTier(f) or header_tiers.get(f)
+            else:
+                tier = texture_info.getTier(f) or texture_info.getTierFromHeader(f)
+            tiers.setdefault(tier, []).append(f)
+
+        if len(tiers) > 1:
+            self.tiers = tiers
+
+    def selectTier(self, tier=None):
+        from . import texture_info
+
+        if len(self.tiers) > 0:
+            self.set = list(self.tiers[texture_info.selectTier(self.tiers.keys(), tier)])
+
+    def getTier(self):
+        for tier, paths in self.tiers.items():
+            if paths == self.set:
+                return tier
+        return None
+
+    def getTierValues(self, value):
+        '''
+        This function returns the value of a texture attribute for each tier, as returned
+        by value for a map holding the files of that tier.
+        '''
+
+        values = {}
+        for tier, paths in self.tiers.items():
+            tier_map = Map()
+            tier_map.set = paths
+            values[tier] = value(tier_map)
+        return values
+
 
 class MapColor(Map):
 
@@ -229,12 +387,17 @@ class TextureSet():
         self.emissive = MapEmissive()
 
         self.gui = gui
+        self.unresolved = []
         
         self.classes = [MapColor, MapNormal, MapBump, MapRoughness, MapGlossiness, MapMetalness, MapDisplacement, MapAO, MapOpacity, MapEmissive, MapSpecular]
         self.set = [self.color, self.normal, self.bump, self.roughness, self.glossiness, self.metalness, self.displacement, self.ao, self.opacity, self.emissive, self.specular]
+        self.tier = None
+
+        ## Order in which the tags are checked, the first match wins
+        self.priority = [self.color, self.normal, self.bump, self.roughness, self.glossiness, self.displacement, self.ao, self.specular, self.opacity, self.emissive, self.metalness]
 
 
-    def loadTextures(self, path):
+    def loadTextures(self, path, classify=False, verbose=True):
 
         self.path = path
 
@@ -242,40 +405,82 @@ class TextureSet():
         
         for f in os.listdir(self.path):
 
-            if not f.startswith("."):
-                full_path = os.path.join(self.path, f)
-
-                if os.path.isfile(full_path) and not full_path.split(".")[-1] == "tx":
-                    if any(tag in f.lower() for tag in MapColor.tags):
-                        self.color.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapNormal.tags):
-                        self.normal.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapBump.tags):
-                        self.bump.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapRoughness.tags):
-                        self.roughness.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapGlossiness.tags):
-                        self.glossiness.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapDisplacement.tags):
-                        self.displacement.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapAO.tags):
-                        self.ao.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapSpecular.tags):
-                        self.specular.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapOpacity.tags):
-                        self.opacity.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapEmissive.tags):
-                        self.emissive.set.append(full_path)
-                    elif any(tag in f.lower() for tag in MapMetalness.tags):
-                        self.metalness.set.append(full_path)
-
-        self.printSet()
+            full_path = os.path.join(self.path, f)
+            tmap = self.getMapForFile(f)
+
+            if tmap is not None and os.path.isfile(full_path):
+                tmap.addFile(full_path)
+            elif tmap is None and self.isUnresolved(f) and os.path.isfile(full_path):
+                self.unresolved.append(full_path)
+
+        self.groupTiers()
+
+        if classify and len(self.unresolved) > 0:
+            from . import texture_analysis
+            self.addSuggestions(texture_analysis.classifyFiles(self.unresolved))
+
+        if verbose:
+            self.printSet()
+
+    def isUnresolved(self, file_name):
+        from . import texture_info
+
+        ## Only image files are worth reading, .tx files are converted copies of other maps
+        return not file_name.startswith(".") and file_name.split(".")[-1].lower() in texture_info.TEXTURE_EXTENSIONS
+
+    def addSuggestions(self, suggestions):
+        '''
+        This function adds the files classified from their content to the maps
+        that no file name matched, taking the most confident suggestion for each map.
+        Returns the list of (map, path, confidence) added.
+        '''
+
+        added = []
+        for path, field, confidence in sorted(suggestions, key=lambda s: -s[2]):
+            tmap = self.getMapInstanceFromString(field)
+            if confidence < CLASSIFY_CONFIDENCE or tmap is None or tmap.exists():
+                continue
+            tmap.set.append(path)
+            added.append((tmap, path, confidence))
+
+            line = "%s classified as %s map from its content (confidence %.2f)." % (os.path.split(path)[1], tmap.label, confidence)
+            printLine(line)
+
+        return added
+
+    def getMapForFile(self, file_name):
+        if file_name.startswith(".") or file_name.split(".")[-1] == "tx":
+            return None
+
+        for tmap in self.priority:
+            if any(tag in file_name.lower() for tag in tmap.tags):
+                return tmap
+
+        return None
+
+    def groupTiers(self, header_tiers=None):
+        for tmap in self.set:
+            tmap.groupTiers(header_tiers)
+        self.selectTier(self.tier)
+
+    def selectTier(self, tier=None):
+        '''
+        This function selects the resolution tier of all the maps, the highest if tier is None.
+        '''
+
+        self.tier = tier
+        for tmap in self.set:
+            tmap.selectTier(tier)
 
     def reset(self):
         for s in self.set:
             s.set = []
+            s.tiers = {}
+            s.sequences = {}
+        self.unresolved = []
         
-        self.gui.resetGUI(name=False, path=False)
+        if self.gui is not None:
+            self.gui.resetGUI(name=False, path=False)
             # if my.textField(s.field, exists=1):
             #     my.textField(s.field, edit=True, text="")
             # if my.checkBox(s.field + "_checkbox", exists=1):
@@ -286,6 +491,8 @@ class TextureSet():
         
         for s in self.set:
             print(s.set)
+            for sequence in s.sequences.values():
+                print(sequence)
             # print(s.getUVGridSize())
 
 
@@ -301,6 +508,9 @@ class MatCreatorWindow():
     def __init__(self):
         self.map_set = MapSET()
         self.texture_set = TextureSet(self)
+        self.scanner = None
+        self.scan_id = 0
+        self.thumbnails = None
         self.makeWindow()
 
     def makeWindow(self):
@@ -308,9 +518,11 @@ class MatCreatorWindow():
         h = 140
         button_w = 168
 
+        ## A window left by a previous instance of the module is rebuilt
         if my.window(WINDOW, query=True, exists=True):
-            self.closeWindow()
-        window = my.window(WINDOW, title="Material Creator %s" % VERSION, width=w)
+            my.deleteUI(WINDOW)
+        ## Closing the window hides it, so that the next launch only shows it again
+        window = my.window(WINDOW, title="Material Creator %s" % VERSION, width=w, retain=True, closeCommand=self.stopWork)
         
         menuLayout = my.menuBarLayout(width=w)
         my.menu(label="Help", helpMenu=True)
@@ -318,6 +530,8 @@ class MatCreatorWindow():
         my.menuItem(label="Changelog", command=changelog)
         my.menuItem(label="Help", command=helpmenu)
         my.menuItem(label="Online Guide", command=onlineGuide)
+        ## The Tools menu is filled the first time it is opened
+        self.tools_menu = my.menu(label="Tools", postMenuCommand=self.buildToolsMenu, postMenuCommandOnce=True)
 
         mainColLayout = my.columnLayout(width=w)
 
@@ -369,15 +583,17 @@ class MatCreatorWindow():
         my.textField(FOLDER_FIELD)
         my.iconTextButton(style='iconOnly', image='fileOpen.png', command=self.selectFolder)
         # my.button(label="Browse", w=100, command=self.selectFolder) 
+        my.progressBar(PROGRESS_FIELD, width=384, height=14)
+        my.button(CANCEL_BUTTON, label="Cancel", w=100, enable=False, command=self.cancelScan)
 
-        my.rowColumnLayout(parent=mainColLayout, numberOfColumns=4, 
-                        cal=[(1,'left'), (2, 'left'), (3, 'left'), (4, 'left')], 
-                        columnSpacing=[(1, 10), (4, 6)],
-                        columnWidth=[(1, 20), (2, 84), (3, 280), (4, 100)])
+        my.rowColumnLayout(parent=mainColLayout, numberOfColumns=5, 
+                        cal=[(1,'left'), (2, 'left'), (3, 'left'), (4, 'left'), (5, 'left')], 
+                        columnSpacing=[(1, 10), (5, 6)],
+                        columnWidth=[(1, 20), (2, THUMBNAIL_SIZE + 6), (3, 84), (4, 242), (5, 100)])
 
         self.map_rows = []
         for s in self.map_set.all[:-1]:
-            msg = MapSelectorGUI(label=s.label, field=s.field, texture_set=self.texture_set)
+            msg = MapSelectorGUI(label=s.label, field=s.field, texture_set=self.texture_set, window=self)
             self.map_rows.append(msg)
 
         SeparatorGUI(parent=mainColLayout, width=w)
@@ -398,7 +614,21 @@ class MatCreatorWindow():
         my.radioButton(ARNOLD, label='Arnold', select=True)
         my.radioButton(VRAY, label='VRay')
         my.radioButton(OCTANE, label='Octane')
-        my.text(label="")
+        my.radioButton(ARNOLD_VRAY, label='Arnold + VRay')
+
+        my.rowColumnLayout(parent=mainColLayout, numberOfColumns=2,
+                        cal=[(1,'left'), (2, 'left')],
+                        columnSpacing=[(1, 10)],
+                        columnWidth=[(1, 280), (2, 210)],
+                        rowOffset=[(1, 'bottom', 10)])
+        my.checkBox(AIIMAGE_FIELD, label="Use aiImage nodes (Arnold only)")
+        my.checkBox(SHARED_PLACE_FIELD, label="Share placement node")
+        my.checkBox(ANALYZE_FIELD, label="Analyze displacement and normal maps")
+        my.checkBox(CLASSIFY_FIELD, label="Classify unnamed files by content")
+        my.checkBox(BAKE_FIELD, label="Bake glossiness and AO (Arnold only)")
+        my.optionMenu(TIER_FIELD, label="Resolution", changeCommand=self.selectTier)
+        for tier in [HIGHEST_TIER] + TIERS:
+            my.menuItem(label=tier)
 
         SeparatorGUI(parent=mainColLayout, width=w)
         
@@ -424,37 +654,161 @@ class MatCreatorWindow():
         my.setParent( '..' )
         my.showWindow( window )
 
+    def buildToolsMenu(self, *args):
+        my.setParent(self.tools_menu, menu=True)
+        my.menuItem(label="Texture Audit...", command=textureAudit)
+        my.menuItem(label="Repath Textures...", command=textureRepath)
+        my.menuItem(label="Cache Textures Locally", command=textureCache)
+        my.menuItem(label="Restore Cached Texture Paths", command=textureRestore)
+        my.menuItem(label="Reduce Data Maps", command=textureReduce)
+        my.menuItem(label="Consolidate Duplicate Materials", command=materialConsolidate)
+        my.menuItem(label="Switch Resolution Tier", subMenu=True)
+        for tier in [HIGHEST_TIER] + TIERS:
+            my.menuItem(label=tier, command=partial(textureTier, tier))
+        my.setParent('..', menu=True)
+        my.menuItem(divider=True)
+        my.menuItem(label="Build Material Library...", command=libraryBuild)
+        my.menuItem(label="Reference Library Materials...", command=libraryReference)
+        my.menuItem(divider=True)
+        my.menuItem(label="Create Material Variants...", command=materialVariants)
+        my.menuItem(label="Batch Build Materials...", command=batchBuild)
+        my.menuItem(label="Parallel Build Materials...", command=shardBuild)
+
     def createCommand(self, *args):
         self.applyCommand()
         self.closeWindow()
 
     def applyCommand(self, *args):
+        if self.scanner is not None:
+            my.warning("The texture folder is still being scanned. Please wait or cancel the scan.")
+            return
         my.refreshEditorTemplates()
         if validateName() and validateFolder():
-            createMaterial(self.texture_set)
+            ## The whole network is undone in one step
+            with UndoChunk("MaterialCreator %s" % composeFullName()):
+                createMaterial(self.texture_set)
             self.texture_set.reset()
             self.resetGUI()
 
+    def exists(self):
+        return my.window(WINDOW, query=True, exists=True)
+
+    def show(self):
+        '''
+        This function shows the hidden window again, cleared of the previous material.
+        '''
+
+        self.texture_set.reset()
+        self.resetGUI()
+        my.showWindow(WINDOW)
+
+    def stopWork(self, *args):
+        self.cancelScan()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+            self.thumbnails = None
+
     def closeWindow(self, *args):
-        my.deleteUI(WINDOW)
+        self.stopWork()
+        my.window(WINDOW, edit=True, visible=False)
 
     def selectFolder(self, *args):
         path = my.fileDialog2(fileMode=2)[0]
         my.textField(FOLDER_FIELD, edit=True, text=path)
 
         if validateFolder():
-            
-            self.texture_set.loadTextures(path)
-
-            for ts in self.texture_set.set:
-                if ts.exists():
-                    text = ts.getFirstUdim()
-                    ## Display file name only, not full path
-                    text = os.path.split(text)[1]
-                    if ts.isTiled():
-                        text = text + " (%s UDIM)" % ts.getUdimNumber()
-                    my.textField(ts.field, edit=True, text=text)
-                    my.checkBox(ts.field + "_checkbox", edit=True, value=1)
+            self.startScan(path)
+
+    def startScan(self, path):
+        ## Results of a scan still running for the previous folder are discarded
+        self.cancelScan()
+        self.scan_id += 1
+
+        self.texture_set.path = path
+        self.texture_set.reset()
+
+        my.progressBar(PROGRESS_FIELD, edit=True, progress=0, maxValue=1)
+        my.button(CANCEL_BUTTON, edit=True, enable=True)
+
+        classify = my.checkBox(CLASSIFY_FIELD, query=True, value=True)
+
+        self.scanner = FolderScanner(self.scan_id, path, self.texture_set, self, classify=classify)
+        self.scanner.start()
+
+    def cancelScan(self, *args):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.scanner = None
+            self.scan_id += 1
+            self.finishScan(self.scan_id)
+
+    def setScanSize(self, scan_id, size):
+        if scan_id != self.scan_id or not my.window(WINDOW, query=True, exists=True):
+            return
+
+        my.progressBar(PROGRESS_FIELD, edit=True, maxValue=max(size, 1))
+
+    def addScanResults(self, scan_id, results, progress):
+        if scan_id != self.scan_id or not my.window(WINDOW, query=True, exists=True):
+            return
+
+        for field, full_path in results:
+            ts = self.texture_set.getMapInstanceFromString(field)
+            ts.addFile(full_path)
+            self.updateMapField(ts)
+
+        my.progressBar(PROGRESS_FIELD, edit=True, progress=progress)
+
+    def addScanSuggestions(self, scan_id, suggestions):
+        if scan_id != self.scan_id or not my.window(WINDOW, query=True, exists=True):
+            return
+
+        for tmap, path, confidence in self.texture_set.addSuggestions(suggestions):
+            self.updateMapField(tmap)
+
+    def finishScan(self, scan_id, header_tiers=None):
+        if scan_id != self.scan_id or not my.window(WINDOW, query=True, exists=True):
+            return
+
+        self.scanner = None
+        my.progressBar(PROGRESS_FIELD, edit=True, progress=0)
+        my.button(CANCEL_BUTTON, edit=True, enable=False)
+
+        ## Resolution variants can only be told apart once all the files are known
+        self.texture_set.groupTiers(header_tiers)
+        self.selectTier()
+        self.texture_set.printSet()
+
+    def selectTier(self, *args):
+        self.texture_set.selectTier(getSelectedTier())
+        for tmap in self.texture_set.set:
+            if len(tmap.tiers) > 0:
+                self.updateMapField(tmap)
+
+    def updateMapField(self, ts):
+        text = ts.getFirstUdim()
+        ## Display file name only, not full path
+        text = os.path.split(text)[1]
+        if ts.isTiled():
+            text = text + " (%s UDIM)" % ts.getUdimNumber()
+        if ts.isSequence():
+            text = text + " (frames %s)" % ts.getFrameRanges()
+        if len(ts.tiers) > 1:
+            text = text + " [%s of %s]" % (ts.getTier(), "/".join(str(t) for t in sorted(ts.tiers, key=lambda t: int(t[:-1]) if t else 0)))
+        my.textField(ts.field, edit=True, text=text)
+        my.checkBox(ts.field + "_checkbox", edit=True, value=1)
+        self.requestThumbnail(ts.field, ts.getFirstUdim())
+
+    def requestThumbnail(self, field, path):
+        if self.thumbnails is None:
+            from . import thumbnails
+            cache_dir = os.path.join(my.internalVar(userAppDir=True), "MaterialCreator", "thumbnails")
+            self.thumbnails = thumbnails.ThumbnailLoader(thumbnails.ThumbnailCache(cache_dir, THUMBNAIL_SIZE))
+
+        for row in self.map_rows:
+            if row.field == field:
+                row.thumbnail_path = path
+                self.thumbnails.request(path, row.postThumbnail)
 
     def resetGUI(self, name=True, path=True):
         if name:
@@ -468,17 +822,128 @@ class MatCreatorWindow():
             if my.checkBox(s.field + "_checkbox", exists=1):
                 my.checkBox(s.field + "_checkbox", edit=True, value=0)
 
+        for row in self.map_rows:
+            row.showThumbnail(None, None)
+
+
+class FolderScanner(threading.Thread):
+    '''
+    Lists and classifies the files of a folder in a worker thread.
+    Results are posted to the window with executeDeferred, since the UI
+    can be edited from the main thread only.
+    '''
+
+    def __init__(self, scan_id, path, texture_set, window, classify=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.scan_id = scan_id
+        self.path = path
+        self.texture_set = texture_set
+        self.window = window
+        self.classify = classify
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        ## The window waits for finishScan before it creates or scans again, so it is always posted
+        header_tiers = {}
+        try:
+            header_tiers = self.scan()
+        except Exception as e:
+            maya.utils.executeDeferred(my.warning, "Scan of %s stopped: %s" % (self.path.replace("\\", "/"), e))
+        finally:
+            maya.utils.executeDeferred(self.window.finishScan, self.scan_id, header_tiers)
+
+    def scan(self):
+        '''
+        This function lists and classifies the files, posting the results to the window,
+        and returns the resolution tiers read from the headers of the files of the maps
+        found more than once per tile, or None if the scan is cancelled.
+        '''
+
+        try:
+            files = sorted(os.listdir(self.path))
+        except OSError:
+            files = []
+
+        maya.utils.executeDeferred(self.window.setScanSize, self.scan_id, len(files))
+
+        results = []
+        unresolved = []
+        found = set()
+        map_files = {}
+        for index, f in enumerate(files):
+            if self.cancelled.is_set():
+                return None
+
+            full_path = os.path.join(self.path, f)
+            tmap = self.texture_set.getMapForFile(f)
+
+            if tmap is None and self.classify and self.texture_set.isUnresolved(f) and os.path.isfile(full_path):
+                unresolved.append(full_path)
+
+            if tmap is not None and os.path.isfile(full_path):
+                results.append((tmap.field, full_path))
+                map_files.setdefault(tmap.field, []).append(full_path)
+
+                ## A map type found for the first time is shown immediately
+                if tmap.field not in found or len(results) >= SCAN_BATCH:
+                    found.add(tmap.field)
+                    maya.utils.executeDeferred(self.window.addScanResults, self.scan_id, results, index + 1)
+                    results = []
+
+        if self.cancelled.is_set():
+            return None
+
+        maya.utils.executeDeferred(self.window.addScanResults, self.scan_id, results, len(files))
+
+        if len(unresolved) > 0:
+            from . import texture_analysis
+            suggestions = texture_analysis.classifyFiles(unresolved)
+            if self.cancelled.is_set():
+                return None
+            maya.utils.executeDeferred(self.window.addScanSuggestions, self.scan_id, suggestions)
+
+        return self.readHeaderTiers(map_files)
+
+    def readHeaderTiers(self, map_files):
+        '''
+        This function reads the tier of the files without a tier token of the maps having more
+        than one file per tile, so that the headers are not opened on the main thread.
+        '''
+
+        from . import texture_info
+
+        header_tiers = {}
+        for paths in map_files.values():
+            if len(set(texture_info.getUdimNumber(f) for f in paths)) == len(paths):
+                continue
+            for f in paths:
+                if self.cancelled.is_set():
+                    return None
+                if texture_info.getTier(f) is None:
+                    header_tiers[f] = texture_info.getTierFromHeader(f)
+
+        return header_tiers
+
 
 class MapSelectorGUI():
 
-    def __init__(self, label, field, texture_set):
+    def __init__(self, label, field, texture_set, window=None):
         self.label = label
         self.field = field
         self.texture_set = texture_set
+        self.window = window
         self.check_label = self.field + "_checkbox"
         self.button = self.field + "_button"
+        self.thumbnail = self.field + "_thumbnail"
+        self.thumbnail_path = None
 
         my.checkBox(self.check_label, label="")
+        my.image(self.thumbnail, width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE, visible=False)
         my.text(label=self.label)
         my.textField(self.field)  
         my.button(self.button, label="Change", w=100, command=self.selectFile)
@@ -492,7 +957,10 @@ class MapSelectorGUI():
 
         ts = self.texture_set.getMapInstanceFromString(self.field)
 
+        ## Tiers of the scanned folder would replace the chosen file when the material is created
         ts.set = []
+        ts.tiers = {}
+        ts.sequences = {}
 
         if "1001" in file_name:
             string_parts = file_name.split("1001")
@@ -500,19 +968,29 @@ class MapSelectorGUI():
             for f in os.listdir(dir):
 
                 if string_parts[0] in f and string_parts[1] in f:
-                    ts.set.append(os.path.join(dir, f))
+                    ts.addFile(os.path.join(dir, f))
         else:
-            ts.set.append(path)
+            ts.addFile(path)
 
-        text = ts.getFirstUdim()
-        text = os.path.split(text)[1]
-        if ts.isTiled():
-            text = text + " (%s UDIM)" % ts.getUdimNumber()
-
-        my.textField(self.field, edit=True, text=text)
-        my.checkBox(self.field + "_checkbox", edit=True, value=1)
+        ts.groupTiers()
+        ts.selectTier(getSelectedTier())
 
+        self.window.updateMapField(ts)
         self.texture_set.printSet()
+
+    def postThumbnail(self, path, thumbnail):
+        ## Called from a thumbnail thread
+        maya.utils.executeDeferred(self.showThumbnail, path, thumbnail)
+
+    def showThumbnail(self, path, thumbnail):
+        ## Previews of a file no longer selected for this map are ignored
+        if not my.image(self.thumbnail, exists=True) or path != self.thumbnail_path:
+            return
+
+        if thumbnail is None:
+            my.image(self.thumbnail, edit=True, visible=False)
+        else:
+            my.image(self.thumbnail, edit=True, image=thumbnail, visible=True)
         
 
     def enable(self):
@@ -585,6 +1063,15 @@ def validateFolder():
     return True
 
 
+def getSelectedTier():
+    if not my.optionMenu(TIER_FIELD, exists=True):
+        return None
+    tier = my.optionMenu(TIER_FIELD, query=True, value=True)
+    if tier == HIGHEST_TIER:
+        return None
+    return tier
+
+
 def createMaterial(texture_set):
 
     sel = my.ls(selection=True)
@@ -595,34 +1082,387 @@ def createMaterial(texture_set):
     directory = my.textField(FOLDER_FIELD, query=True, text=True)
     engine = my.radioCollection(ENGINE_FIELD, query=True, select=True)
     assign = my.checkBox(ASSIGN_FIELD, query=True, value=True)
+    ai_image = my.checkBox(AIIMAGE_FIELD, query=True, value=True)
+    shared_placement = my.checkBox(SHARED_PLACE_FIELD, query=True, value=True)
+    analyze = my.checkBox(ANALYZE_FIELD, query=True, value=True)
+    bake = my.checkBox(BAKE_FIELD, query=True, value=True)
+
+    texture_set.selectTier(getSelectedTier())
+    analyze, bake = checkOptions(analyze, bake)
 
     if engine == ARNOLD:
-        mat = ArnoldMat(name=mat_name, directory=directory, textureset=texture_set)
+        graph = TextureGraph(mat_name, shared_placement=shared_placement)
+        mat = ArnoldMat(name=mat_name, directory=directory, textureset=texture_set, graph=graph, ai_image=ai_image, analyze=analyze, bake=bake)
+        if ai_image or shared_placement:
+            logNetworkStats(mat)
     elif engine == VRAY:
-        mat = VrayMat(name=mat_name, directory=directory, textureset=texture_set)
+        mat = VrayMat(name=mat_name, directory=directory, textureset=texture_set, analyze=analyze)
     elif engine == OCTANE:
-        mat = OctaneMat(name=mat_name, directory=directory, textureset=texture_set)
+        mat = OctaneMat(name=mat_name, directory=directory, textureset=texture_set, analyze=analyze)
+    elif engine == ARNOLD_VRAY:
+        mats = createMultiEngineMaterial(name=mat_name, directory=directory, textureset=texture_set, shared_placement=shared_placement, analyze=analyze, bake=bake)
+        mat = getCurrentEngineMat(mats)
     else:
         return
     
     if assign:
         my.select(sel)
-        my.hyperShade(assign=mat.full_name)
+        my.hyperShade(assign=mat.mat_node)
+
+
+def checkOptions(analyze, bake):
+    '''
+    This function turns off the map analysis and the bake if their modules can't run.
+    '''
+
+    if analyze:
+        from . import texture_analysis
+        if not texture_analysis.isAvailable():
+            my.warning("NumPy is not available in this Maya Python environment, displacement and normal maps will not be analyzed.")
+            analyze = False
+
+    if bake:
+        from . import texture_bake
+        if not texture_bake.isAvailable():
+            my.warning("NumPy and Pillow or OpenImageIO are needed to bake textures, glossiness and AO will not be baked.")
+            bake = False
+
+    return analyze, bake
+
+
+def createMultiEngineMaterial(name, directory, textureset, engines=MULTI_ENGINES, shared_placement=False, full_name=None, **kwargs):
+    '''
+    This function creates one material per engine in engines, all connected to
+    the same file and place2dTexture nodes. Each material gets its own shading
+    group and the engine name is appended to the material name.
+    '''
+
+    if full_name is None:
+        full_name = composeFullName()
+    graph = TextureGraph(name, shared_placement=shared_placement)
+
+    mats = []
+    for engine in engines:
+        engine_name = "%s_%s" % (full_name, engine)
+        if engine == ARNOLD:
+            mats.append(ArnoldMat(name=name, directory=directory, textureset=textureset, full_name=engine_name, graph=graph, **kwargs))
+        elif engine == VRAY:
+            mats.append(VrayMat(name=name, directory=directory, textureset=textureset, full_name=engine_name, graph=graph, **kwargs))
+
+    return mats
+
+
+def createMaterialVariants(name, directory, textureset, variants, engine=ARNOLD, full_name=None, shared_placement=False, ai_image=False, **kwargs):
+    '''
+    This function creates a material and one variant of it for each row of the variants table.
+    The texture network is built once: each variant only adds a shader and a shading group
+    connected to it. Returns the list of the base materials followed by the list of the variants.
+    '''
+
+    if full_name is None:
+        full_name = composeFullName()
+
+    if engine == ARNOLD:
+        graph = TextureGraph(name, shared_placement=shared_placement)
+        bases = [ArnoldMat(name=name, directory=directory, textureset=textureset, full_name=full_name, graph=graph, ai_image=ai_image, **kwargs)]
+    elif engine == VRAY:
+        graph = TextureGraph(name, shared_placement=shared_placement)
+        bases = [VrayMat(name=name, directory=directory, textureset=textureset, full_name=full_name, graph=graph, **kwargs)]
+    elif engine == ARNOLD_VRAY:
+        bases = createMultiEngineMaterial(name=name, directory=directory, textureset=textureset, shared_placement=shared_placement, full_name=full_name, **kwargs)
+    else:
+        my.warning("Material variants are not available for %s." % engine)
+        return [], []
+
+    mats = []
+    for base in bases:
+        for parameters in variants:
+            mats.append(MatVariant(base, "%s_%s" % (base.full_name, parameters["name"]), parameters))
+
+    line = "%s variants of %s created on one texture network." % (len(mats), full_name)
+    printLine(line)
+
+    return bases, mats
+
+
+def loadVariantTable(path):
+    '''
+    This function reads a JSON list of variants, each a dictionary with a name and the
+    parameters of the variant.
+    '''
+
+    import json
+
+    with open(path, 'r') as f:
+        variants = json.load(f)
+
+    return [v for v in variants if "name" in v]
+
+
+def getCurrentEngineMat(mats):
+    '''
+    This function returns the material matching the current renderer,
+    or the first one if the current renderer is not among them.
+    '''
+
+    renderer = my.getAttr("defaultRenderGlobals.currentRenderer")
+
+    for mat in mats:
+        if mat.engine.lower() == renderer:
+            return mat
+
+    return mats[0]
+
+
+def getNetworkStats(mat):
+    '''
+    This function returns the number of nodes and of incoming connections
+    in the shading network of a material.
+    '''
+
+    nodes = my.listHistory(mat.sg) or []
+    connections = 0
+    for node in nodes:
+        connections += len(my.listConnections(node, source=True, destination=False, plugs=True) or [])
+
+    return len(nodes), connections
+
+
+def logNetworkStats(mat):
+    '''
+    This function prints the node and connection count of a material and
+    the count the same material would have with file nodes and its own
+    place2dTexture node, from the texture and placement nodes found in its network.
+    '''
+
+    nodes, connections = getNetworkStats(mat)
+
+    history = my.listHistory(mat.sg) or []
+    ## aiImage nodes, and file nodes used for sequences in aiImage mode, replace classic file nodes one to one
+    texture_count = len([node for node in history if my.nodeType(node) in ('file', 'aiImage')])
+    placement_nodes = set(node for node in history if my.nodeType(node) == 'place2dTexture')
+
+    placement_connections = 0
+    for node in history:
+        for plug in my.listConnections(node, source=True, destination=False, plugs=True) or []:
+            if plug.split(".")[0] in placement_nodes:
+                placement_connections += 1
+
+    classic_nodes = nodes - len(placement_nodes) + (1 if texture_count > 0 else 0)
+    classic_connections = connections - placement_connections + texture_count * (len(PLACE2D_ATTRIBUTES) + 2)
+
+    line = "Material %s: %s nodes, %s connections (classic network: %s nodes, %s connections)." % (mat.full_name, nodes, connections, classic_nodes, classic_connections)
+    printLine(line)
 
 ##############################################################
 
+class MatVariant():
+    '''
+    Shader and shading group of a variant of a material, connected to the texture network
+    of the base material. Parameters of the table:
+    tint: color multiplying the base color,
+    roughness_scale: factor of the roughness (of 1 - glossiness for VRay materials using glossiness),
+    metalness: value replacing the metalness map,
+    any other key: shader attribute set to the value.
+    '''
+
+    def __init__(self, base, full_name, parameters):
+        self.base = base
+        self.name = base.name
+        ## Variant names come from the table and may contain spaces or punctuation
+        self.full_name = re.sub(r'\W', "_", full_name)
+        self.engine = base.engine
+        self.parameters = parameters
+        self.create()
+
+    def create(self):
+        ## The duplicate keeps the attribute values and the input connections of the base shader
+        self.mat_node = my.duplicate(self.base.mat_node, name=self.full_name, inputConnections=True)[0]
+        self.sg = my.sets(name="%sSG" % self.full_name, empty=True, renderable=True, noSurfaceShader=True)
+        my.connectAttr("%s.outColor" % self.mat_node, "%s.surfaceShader" % self.sg)
+
+        for source in my.listConnections(self.base.sg + '.displacementShader', source=True, destination=False, plugs=True) or []:
+            my.connectAttr(source, self.sg + '.displacementShader')
+
+        attributes = VARIANT_ATTRIBUTES[self.engine]
+        for key, value in self.parameters.items():
+            if key == "name":
+                continue
+            elif key == "tint":
+                self.scaleAttribute(attributes["color"], value)
+            elif key == "roughness_scale":
+                self.scaleRoughness(value)
+            elif key == "metalness":
+                self.setAttribute(attributes["metalness"], value)
+            else:
+                self.setAttribute(key, value)
+
+    def getInput(self, attribute):
+        inputs = my.listConnections(self.mat_node + '.' + attribute, source=True, destination=False, plugs=True) or []
+        if len(inputs) == 0:
+            return None
+        return inputs[0]
+
+    def setAttribute(self, attribute, value):
+        source = self.getInput(attribute)
+        if source is not None:
+            my.disconnectAttr(source, self.mat_node + '.' + attribute)
+
+        if isinstance(value, (list, tuple)):
+            my.setAttr(self.mat_node + '.' + attribute, *value)
+        else:
+            my.setAttr(self.mat_node + '.' + attribute, value)
+
+    def scaleAttribute(self, attribute, factors):
+        '''
+        This function multiplies a color (three factors) or scalar (one factor) attribute.
+        A multiplyDivide node is added only if the attribute is driven by a texture.
+        '''
+
+        plug = self.mat_node + '.' + attribute
+        source = self.getInput(attribute)
+
+        if source is None:
+            value = my.getAttr(plug)
+            if len(factors) == 3:
+                value = [c * f for c, f in zip(value[0], factors)]
+                my.setAttr(plug, *value)
+            else:
+                my.setAttr(plug, value * factors[0])
+            return
+
+        multiply_node = my.shadingNode('multiplyDivide', n=self.full_name + '_' + attribute + 'Scale', asUtility=True)
+        if len(factors) == 3:
+            my.connectAttr(source, multiply_node + '.input1')
+            my.setAttr(multiply_node + '.input2', *factors)
+            my.connectAttr(multiply_node + '.output', plug, force=True)
+        else:
+            my.connectAttr(source, multiply_node + '.input1X')
+            my.setAttr(multiply_node + '.input2X', factors[0])
+            my.connectAttr(multiply_node + '.outputX', plug, force=True)
+
+    def scaleRoughness(self, factor):
+        '''
+        This function multiplies the roughness. VRay materials not using roughness hold a
+        glossiness instead, which becomes 1 - (1 - glossiness) * factor, clamped to 0-1.
+        '''
+
+        attribute = VARIANT_ATTRIBUTES[self.engine]["roughness"]
+        plug = self.mat_node + '.' + attribute
+        source = self.getInput(attribute)
+        glossiness = self.engine == VRAY and not my.getAttr(self.mat_node + '.useRoughness')
+
+        if source is None:
+            value = my.getAttr(plug)
+            value = 1.0 - (1.0 - value) * factor if glossiness else value * factor
+            my.setAttr(plug, min(1.0, max(0.0, value)))
+            return
+
+        if not glossiness:
+            self.scaleAttribute(attribute, [factor])
+            return
+
+        ## The glossiness is linear in the source: 1 stays 1, and it reaches 0 at 1 - 1 / factor.
+        ## setRange clamps the source to the old range, so the result stays in 0-1
+        range_node = my.shadingNode('setRange', n=self.full_name + '_' + attribute + 'Scale', asUtility=True)
+        if factor > 1.0:
+            my.setAttr(range_node + '.oldMinX', 1.0 - 1.0 / factor)
+            my.setAttr(range_node + '.minX', 0.0)
+        else:
+            my.setAttr(range_node + '.oldMinX', 0.0)
+            my.setAttr(range_node + '.minX', 1.0 - max(0.0, factor))
+        my.setAttr(range_node + '.oldMaxX', 1.0)
+        my.setAttr(range_node + '.maxX', 1.0)
+        my.connectAttr(source, range_node + '.valueX')
+        my.connectAttr(range_node + '.outValueX', plug, force=True)
+
+
+class UndoChunk():
+    '''
+    Records the Maya commands run between open and close as one named undo step,
+    or doesn't record them at all if record is False. Can be used as a context manager.
+    '''
+
+    def __init__(self, name, record=True):
+        self.name = name
+        self.record = record
+        self.state = None
+
+    def open(self):
+        if self.record:
+            my.undoInfo(openChunk=True, chunkName=self.name)
+        else:
+            ## The undo queue is kept, only the commands of the chunk are not recorded
+            self.state = my.undoInfo(query=True, stateWithoutFlush=True)
+            my.undoInfo(stateWithoutFlush=False)
+
+    def close(self):
+        if self.record:
+            my.undoInfo(closeChunk=True)
+        else:
+            my.undoInfo(stateWithoutFlush=self.state)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class TextureGraph():
+
+    def __init__(self, name, shared_placement=False):
+        self.name = name
+        self.shared_placement = shared_placement
+        self.texture_node = None
+        self.file_nodes = {}
+        ## Analysis results by kind and files, read once for all the materials sharing the graph
+        self.analysis = {}
+
+    def getTextureNode(self):
+        if self.texture_node is None:
+            if not self.shared_placement:
+                self.texture_node = my.shadingNode('place2dTexture', n=self.name + "_2dTexture", asUtility=True)
+            elif my.objExists(SHARED_TEXTURE_NODE):
+                self.texture_node = SHARED_TEXTURE_NODE
+            else:
+                self.texture_node = my.shadingNode('place2dTexture', n=SHARED_TEXTURE_NODE, asUtility=True)
+        return self.texture_node
+
+    def getFileNode(self, node_name):
+        return self.file_nodes.get(node_name)
+
+    def addFileNode(self, node_name, file_node):
+        self.file_nodes[node_name] = file_node
+
+    def removeFileNode(self, node_name):
+        self.file_nodes.pop(node_name, None)
+
+
 class Mat():
 
-    def __init__(self, name, directory, textureset):
+    def __init__(self, name, directory, textureset, full_name=None, graph=None, analyze=False, bake=False, maps=None):
         
         self.name = name
         #if not self.name.endswith(MAT_SUFFIX):
         #    self.name = self.name + MAT_SUFFIX
 
-        self.full_name = composeFullName()
+        if full_name is None:
+            full_name = composeFullName()
+        self.full_name = full_name
+
+        if graph is None:
+            graph = TextureGraph(name)
+        self.graph = graph
 
         self.directory = directory
         self.engine = None
+        self.use_ai_image = False
+        self.analyze = analyze
+        self.bake = bake
+        self.maps = maps
         self.texture_set = textureset
 
         self.base_color_file = self.name + "_baseColorFile"
@@ -633,6 +1473,8 @@ class Mat():
         self.metalness_file = self.name + "_metalnessFile"
         self.displacement_file = self.name + "_displacementFile"
         self.ao_file = self.name + "_aoFile"
+        self.base_color_ao_file = self.name + "_baseColorAOFile"
+        self.glossiness_baked_file = self.name + "_glossinessBakedFile"
         self.specular_file = self.name + "_specularFile"
         self.opacity_file = self.name + "_opacityFile"
         self.emissive_file = self.name + "_emissiveFile"
@@ -642,7 +1484,108 @@ class Mat():
         command = 'print "%s"' % line
         mel.eval(command)
 
+    def analyzeDisplacement(self, tmap):
+        '''
+        This function returns the range and mid-level of a displacement map,
+        or None if maps are not analyzed or the map can't be read.
+        '''
+
+        if not self.analyze:
+            return None
+
+        key = ("displacement", tuple(tmap.set))
+        if key in self.graph.analysis:
+            return self.graph.analysis[key]
+
+        from . import texture_analysis
+        stats = texture_analysis.analyzeDisplacement(tmap.set)
+        self.graph.analysis[key] = stats
+
+        if stats is not None:
+            line = "Displacement map of %s: min %.4f, max %.4f, mid-level %.4f." % (self.name, stats["min"], stats["max"], stats["mid"])
+            printLine(line)
+
+        return stats
+
+    def isDirectXNormal(self, tmap):
+        '''
+        This function tells whether a normal map uses the DirectX convention
+        and so needs its green channel flipped.
+        '''
+
+        if not self.analyze:
+            return False
+
+        key = ("normal", tuple(tmap.set))
+        if key in self.graph.analysis:
+            return self.graph.analysis[key]
+
+        from . import texture_analysis
+        convention, confidence = texture_analysis.detectNormalConvention(tmap.getFirstUdim())
+        self.graph.analysis[key] = convention == texture_analysis.DIRECTX
+
+        if convention is not None:
+            line = "Normal map of %s: %s convention (confidence %.2f)." % (self.name, convention, confidence)
+            printLine(line)
+
+        return self.graph.analysis[key]
+
+    def bakeMap(self, bake_function, *maps):
+        '''
+        This function bakes the tiles of maps with a texture_bake function and returns
+        a Map of the baked files, or None if maps are not baked or the bake fails.
+        '''
+
+        if not self.bake or not all(tmap.exists() for tmap in maps):
+            return None
+
+        if any(tmap.isSequence() for tmap in maps):
+            my.warning("Cannot bake the image sequence %s, it is connected unbaked." % maps[0].getFirstUdim().replace("\\", "/"))
+            return None
+
+        try:
+            paths = bake_function(*[tmap.set for tmap in maps])
+        except Exception as e:
+            my.warning("Cannot bake %s: %s" % (maps[0].getFirstUdim().replace("\\", "/"), e))
+            return None
+
+        line = "Baked %s tiles for %s." % (len(paths), self.name)
+        printLine(line)
+
+        baked_map = Map()
+        baked_map.set = paths
+        return baked_map
+
+    def flipGreen(self, file_node):
+        '''
+        This function flips the green channel of a file node as 1 - G.
+        Changes are made on the file node, so that materials sharing it
+        for other engines get the same result. Returns False for other node types.
+        '''
+
+        if my.nodeType(file_node) != 'file':
+            return False
+
+        my.setAttr(file_node + '.colorGainG', -1)
+        my.setAttr(file_node + '.colorOffsetG', 1)
+        return True
+
+    def setMidLevel(self, file_node, mid):
+        '''
+        This function moves the mid-level of a displacement map to zero on its file node.
+        Returns False for other node types.
+        '''
+
+        if my.nodeType(file_node) != 'file':
+            return False
+
+        my.setAttr(file_node + '.alphaOffset', -mid)
+        return True
+
     def isMapSelected(self, map):
+        ## Without the window, maps are selected by field name
+        if self.maps is not None:
+            return map.field in self.maps and map.exists()
         if my.checkBox(map.field + "_checkbox", exists=1):
             return my.checkBox(map.field + "_checkbox", query=True, value=True)
         else:
@@ -674,28 +1617,39 @@ class Mat():
 
     def connect2DTextureNode(self, texture_node, file_node):
 
-        my.connectAttr(texture_node + ".coverage", file_node + ".coverage", force=True)
-        my.connectAttr(texture_node + ".translateFrame", file_node + ".translateFrame", force=True)
-        my.connectAttr(texture_node + ".rotateFrame", file_node + ".rotateFrame", force=True)
-        my.connectAttr(texture_node + ".mirrorU", file_node + ".mirrorU", force=True)
-        my.connectAttr(texture_node + ".mirrorV", file_node + ".mirrorV", force=True)
-        my.connectAttr(texture_node + ".stagger", file_node + ".stagger", force=True)
-        my.connectAttr(texture_node + ".wrapU", file_node + ".wrapU", force=True)
-        my.connectAttr(texture_node + ".wrapV", file_node + ".wrapV", force=True)
-        my.connectAttr(texture_node + ".repeatUV", file_node + ".repeatUV", force=True)
-        my.connectAttr(texture_node + ".offset", file_node + ".offset", force=True)
-        my.connectAttr(texture_node + ".rotateUV", file_node + ".rotateUV", force=True)
-        my.connectAttr(texture_node + ".noiseUV", file_node + ".noiseUV", force=True)
-        my.connectAttr(texture_node + ".vertexUvOne", file_node + ".vertexUvOne", force=True)
-        my.connectAttr(texture_node + ".vertexUvTwo", file_node + ".vertexUvTwo", force=True)
-        my.connectAttr(texture_node + ".vertexUvThree", file_node + ".vertexUvThree", force=True)
-        my.connectAttr(texture_node + ".vertexCameraOne", file_node + ".vertexCameraOne", force=True)
+        if not self.graph.shared_placement:
+            for attribute in PLACE2D_ATTRIBUTES:
+                my.connectAttr(texture_node + "." + attribute, file_node + "." + attribute, force=True)
         my.connectAttr(texture_node + ".outUV", file_node + ".uv")
         my.connectAttr(texture_node + ".outUvFilterSize", file_node + ".uvFilterSize")
 
+    def setAlphaIsLuminance(self, file_node):
+        if my.nodeType(file_node) == 'file':
+            my.setAttr(file_node + '.alphaIsLuminance', True)
+
+    def getAlphaOutput(self, file_node):
+        ## aiImage nodes read the real alpha channel, so the red channel is used instead
+        if my.nodeType(file_node) == 'aiImage':
+            return file_node + '.outColorR'
+        return file_node + '.outAlpha'
+
+    def getFileNode(self, node_name):
+        file_node = self.graph.getFileNode(node_name)
+        if file_node is None:
+            return node_name
+        return file_node
+
     def addFileNode(self, engine, tmap, node_name):
 
+        ## File nodes already created for another engine are reused
+        file_node = self.graph.getFileNode(node_name)
+        if file_node is not None:
+            return file_node
+
         if engine == OCTANE:
+            if tmap.isSequence():
+                my.warning("Octane image nodes read the first frame of %s only." % tmap.getFirstUdim().replace("\\", "/"))
+
             if not tmap.isTiled():
                 file_path = tmap.getFirstUdim()
                 file_node = my.shadingNode('octaneImageTexture', name=node_name, asTexture=True)
@@ -711,6 +1665,15 @@ class Mat():
                     my.setAttr(file_node + '.GridSize0', grid_size[0])
                     my.setAttr(file_node + '.GridSize1', grid_size[1])
 
+        ## Image sequences are read by file nodes, driven by the frame extension
+        elif engine == ARNOLD and self.use_ai_image and not tmap.isSequence():
+
+            file_path = tmap.getFirstUdim()
+            if tmap.isTiled():
+                file_path = tmap.getUdimPattern()
+            file_node = my.shadingNode('aiImage', name=node_name, asTexture=True)
+            my.setAttr(file_node + '.filename', file_path, type='string')
+
         else:
 
             file_path = tmap.getFirstUdim()
@@ -719,25 +1682,65 @@ class Mat():
 
             if tmap.isTiled():
                 my.setAttr(file_node + '.uvTilingMode', 3)
+            if tmap.isSequence():
+                self.setFrameExtension(file_node)
+
+            self.connect2DTextureNode(self.graph.getTextureNode(), file_node)
 
-            self.connect2DTextureNode(self.texture_node, file_node)
+        self.graph.addFileNode(node_name, file_node)
+
+        if len(tmap.tiers) > 1:
+            self.storeTiers(engine, tmap, file_node)
 
         return file_node
 
+    def setFrameExtension(self, file_node):
+        '''
+        This function makes a file node read the frame of its image sequence matching the
+        current frame, as Use Image Sequence does. The node reads a single <UDIM>/<f>
+        pattern, whatever the length of the sequence.
+        '''
+
+        my.setAttr(file_node + '.useFrameExtension', True)
+        my.expression(string="%s.frameExtension=frame" % file_node, object=file_node, alwaysEvaluate=True, unitConversion='all')
+
+    def storeTiers(self, engine, tmap, file_node):
+        '''
+        This function stores on the texture node the path of each resolution tier of its map,
+        so that the tier can be switched later across the scene.
+        '''
+
+        from . import scene_tools
+
+        if my.nodeType(file_node) == 'octaneImageTilesTexture':
+            return
+        elif my.nodeType(file_node) == 'aiImage':
+            tiers = tmap.getTierValues(lambda m: m.getUdimPattern() if m.isTiled() else m.getFirstUdim())
+        else:
+            tiers = tmap.getTierValues(lambda m: m.getFirstUdim())
+
+        ## Files whose tier is unknown can't be switched to
+        tiers.pop(None, None)
+
+        plug = scene_tools.getTexturePlugs(file_node)[0]
+        scene_tools.setTierPaths(file_node, {plug: tiers})
+
 
 class ArnoldMat(Mat):
     
-    def __init__(self, name, directory, textureset):
-        Mat.__init__(self, name, directory, textureset)
+    def __init__(self, name, directory, textureset, ai_image=False, **kwargs):
+        Mat.__init__(self, name, directory, textureset, **kwargs)
         self.engine = ARNOLD
+        self.use_ai_image = ai_image
         self.create()
         self.logCreation()
 
     def create(self):
         self.mat_node = my.shadingNode('aiStandardSurface', name=self.full_name, asShader=True)
         self.sg = my.sets(name="%sSG" % self.full_name, empty=True, renderable=True, noSurfaceShader=True)
-        my.connectAttr("%s.outColor" % self.full_name, "%s.surfaceShader" % self.sg)
-        self.texture_node = my.shadingNode('place2dTexture', n=self.name + "_2dTexture", asUtility=True)
+        my.connectAttr("%s.outColor" % self.mat_node, "%s.surfaceShader" % self.sg)
+        if not self.use_ai_image:
+            self.texture_node = self.graph.getTextureNode()
         self.createSelected()
 
     def createColor(self):
@@ -750,6 +1753,8 @@ class ArnoldMat(Mat):
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
         normal_map_node = my.shadingNode('aiNormalMap', n=self.name + '_normalMap', asShader=True)       
+        if self.isDirectXNormal(self.texture_set.normal) and not self.flipGreen(file_node):
+            my.setAttr(normal_map_node + '.invertY', True)
        
         my.connectAttr(file_node + '.outColor', normal_map_node + '.input')
         my.connectAttr(normal_map_node + '.outValue', self.mat_node + '.normalCamera') 
@@ -761,22 +1766,32 @@ class ArnoldMat(Mat):
         normalBump = my.shadingNode('bump2d', n=self.name + '_normalBump', asUtility=True )
         my.setAttr(normalBump + '.aiFlipR', True)
         my.setAttr(normalBump + '.aiFlipG', True)
-        my.connectAttr(file_node + '.outAlpha', normalBump + '.bumpValue')
+        my.connectAttr(self.getAlphaOutput(file_node), normalBump + '.bumpValue')
         my.connectAttr(normalBump + '.outNormal', self.mat_node + '.normalCamera')   
         
     def createRoughness(self):
         file_node = self.addFileNode(self.engine, self.texture_set.roughness, self.roughness_file)     
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
-        my.setAttr(file_node + '.alphaIsLuminance', True)
+        self.setAlphaIsLuminance(file_node)
 
-        my.connectAttr(file_node + '.outAlpha', self.mat_node + '.specularRoughness')  
+        my.connectAttr(self.getAlphaOutput(file_node), self.mat_node + '.specularRoughness')  
 
     def createGlossiness(self):
+        from . import texture_bake
+        baked_map = self.bakeMap(texture_bake.bakeGlossinessToRoughness, self.texture_set.glossiness)
+        if baked_map is not None:
+            ## The baked map is a roughness map, no invert node is needed
+            file_node = self.addFileNode(self.engine, baked_map, self.glossiness_baked_file)
+            my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
+            self.setAlphaIsLuminance(file_node)
+            my.connectAttr(self.getAlphaOutput(file_node), self.mat_node + '.specularRoughness')
+            return
+
         file_node = self.addFileNode(self.engine, self.texture_set.glossiness, self.glossiness_file)     
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
-        my.setAttr(file_node + '.alphaIsLuminance', True)
+        self.setAlphaIsLuminance(file_node)
         invert_node = my.shadingNode('aiColorCorrect', n=self.name + "_glossInvert", asUtility=True)
         my.connectAttr(file_node + '.outColor', invert_node + '.input')
         my.setAttr(invert_node + '.invert', 1)
@@ -786,26 +1801,53 @@ class ArnoldMat(Mat):
         file_node = self.addFileNode(self.engine, self.texture_set.metalness, self.metalness_file)    
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
-        my.setAttr(file_node + '.alphaIsLuminance', True)
+        self.setAlphaIsLuminance(file_node)
 
-        my.connectAttr(file_node + '.outAlpha', self.mat_node + '.metalness')
+        my.connectAttr(self.getAlphaOutput(file_node), self.mat_node + '.metalness')
 
     def createDisplacement(self):
         file_node = self.addFileNode(self.engine, self.texture_set.displacement, self.displacement_file)   
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
-        my.setAttr(file_node + '.alphaIsLuminance', True)
+        self.setAlphaIsLuminance(file_node)
 
         disp_shader_node = my.shadingNode('displacementShader', n=self.name + '_dispShader', asShader=True)
-        my.connectAttr(file_node + '.outAlpha', disp_shader_node + '.displacement')
+        my.connectAttr(self.getAlphaOutput(file_node), disp_shader_node + '.displacement')
         my.connectAttr(disp_shader_node + '.displacement', self.sg + '.displacementShader')  
 
+        stats = self.analyzeDisplacement(self.texture_set.displacement)
+        if stats is not None:
+            if not self.setMidLevel(file_node, stats["mid"]):
+                my.setAttr(disp_shader_node + '.aiDisplacementZeroValue', stats["mid"])
+            ## The padding has to contain the largest displacement from the mid-level
+            scale = my.getAttr(disp_shader_node + '.scale')
+            my.setAttr(disp_shader_node + '.aiDisplacementPadding', max(stats["max"] - stats["mid"], stats["mid"] - stats["min"]) * scale)
+
     def createAO(self):
+        from . import texture_bake
+
+        ## Without a base color node (color unticked or missing) there is nothing to multiply
+        color_node = self.graph.getFileNode(self.base_color_file)
+        if color_node is None:
+            self.addFileNode(self.engine, self.texture_set.ao, self.ao_file)
+            return
+
+        baked_map = self.bakeMap(texture_bake.bakeColorAO, self.texture_set.color, self.texture_set.ao)
+        if baked_map is not None:
+            file_node = self.addFileNode(self.engine, baked_map, self.base_color_ao_file)
+            my.connectAttr(file_node + '.outColor', self.mat_node + '.baseColor', force=True)
+
+            ## The base color node is kept only if a material for another engine uses it
+            if not my.listConnections(color_node + '.outColor', source=False, destination=True):
+                my.delete(color_node)
+                self.graph.removeFileNode(self.base_color_file)
+            return
+
         file_node = self.addFileNode(self.engine, self.texture_set.ao, self.ao_file)     
 
         colorcomp_node = my.shadingNode('colorComposite', n=self.name + '_colorComp', asShader=True)  
         my.connectAttr(file_node + '.outColor', colorcomp_node + '.colorB')
-        my.connectAttr(self.base_color_file + '.outColor', colorcomp_node + '.colorA')
+        my.connectAttr(color_node + '.outColor', colorcomp_node + '.colorA')
 
         my.setAttr(colorcomp_node + '.operation', 3)
 
@@ -818,21 +1860,21 @@ class ArnoldMat(Mat):
         file_node = self.addFileNode(self.engine, self.texture_set.opacity, self.opacity_file)   
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
-        my.setAttr(file_node + '.alphaIsLuminance', True)
+        self.setAlphaIsLuminance(file_node)
         my.connectAttr(file_node + '.outColor', self.mat_node + '.opacity')      
 
     def createEmissive(self):
         file_node = self.addFileNode(self.engine, self.texture_set.emissive, self.emissive_file)   
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
-        my.setAttr(file_node + '.alphaIsLuminance', True)
-        my.connectAttr(file_node + '.outAlpha', self.mat_node + '.emission')
+        self.setAlphaIsLuminance(file_node)
+        my.connectAttr(self.getAlphaOutput(file_node), self.mat_node + '.emission')
 
 
 class VrayMat(Mat):
 
-    def __init__(self, name, directory, textureset):
-        Mat.__init__(self, name, directory, textureset)
+    def __init__(self, name, directory, textureset, **kwargs):
+        Mat.__init__(self, name, directory, textureset, **kwargs)
         self.engine = VRAY
         self.create()
         self.logCreation()
@@ -840,8 +1882,8 @@ class VrayMat(Mat):
     def create(self):
         self.mat_node = my.shadingNode('VRayMtl', name=self.full_name, asShader=True)
         self.sg = my.sets(name="%sSG" % self.full_name, empty=True, renderable=True, noSurfaceShader=True)
-        my.connectAttr("%s.outColor" % self.full_name, "%s.surfaceShader" % self.sg)
-        self.texture_node = my.shadingNode('place2dTexture', n=self.name + "_2dTexture", asUtility=True)
+        my.connectAttr("%s.outColor" % self.mat_node, "%s.surfaceShader" % self.sg)
+        self.texture_node = self.graph.getTextureNode()
         self.createSelected()
     
     def createColor(self):
@@ -853,6 +1895,8 @@ class VrayMat(Mat):
         file_node = self.addFileNode(self.engine, self.texture_set.normal, self.normal_file)
 
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
+        if self.isDirectXNormal(self.texture_set.normal):
+            self.flipGreen(file_node)
         my.connectAttr(file_node + ".outColor", self.mat_node + ".bumpMap")
         my.setAttr(self.mat_node + '.bumpMapType', 1) ## corresponds to: Normal map in tangent space 
 
@@ -901,6 +1945,10 @@ class VrayMat(Mat):
         my.setAttr(file_node + '.colorSpace', 'Raw', type='string')
         my.setAttr(file_node + '.alphaIsLuminance', True)
 
+        stats = self.analyzeDisplacement(self.texture_set.displacement)
+        if stats is not None:
+            self.setMidLevel(file_node, stats["mid"])
+
         disp_shader_node = my.shadingNode('displacementShader', n=self.name + '_dispShader', asShader=True)
         my.connectAttr(file_node + '.outAlpha', disp_shader_node + '.displacement')
         my.connectAttr(disp_shader_node + '.displacement', self.sg + '.displacementShader')
@@ -927,8 +1975,8 @@ class VrayMat(Mat):
 
 class OctaneMat(Mat):
 
-    def __init__(self, name, directory, textureset):
-        Mat.__init__(self, name, directory, textureset)
+    def __init__(self, name, directory, textureset, **kwargs):
+        Mat.__init__(self, name, directory, textureset, **kwargs)
         self.engine = OCTANE
         self.create()
         self.logCreation()
@@ -936,7 +1984,7 @@ class OctaneMat(Mat):
     def create(self):
         self.mat_node = my.shadingNode('octaneUniversalMaterial', name=self.full_name, asShader=True)
         self.sg = my.sets(name="%sSG" % self.full_name, empty=True, renderable=True, noSurfaceShader=True)
-        my.connectAttr("%s.outColor" % self.full_name, "%s.surfaceShader" % self.sg)
+        my.connectAttr("%s.outColor" % self.mat_node, "%s.surfaceShader" % self.sg)
 
         self.createSelected()
     
@@ -1016,22 +2064,7 @@ def about(*args):
 
 
 def getScriptPath():
-
-    pathList = sys.path
-    rootpath = None
-
-    ## Look for icons folder
-    for path in pathList:
-        try:
-            dir = os.listdir(path)
-            for subdir in dir:
-                if "MaterialCreator" in subdir:
-                    rootpath = path
-                    break
-        except:
-            pass
-
-    return os.path.join(rootpath, "MaterialCreator")
+    return SCRIPT_PATH
 
 
 def helpmenu(*args):
@@ -1106,6 +2139,217 @@ def changelog(*args):
     my.showWindow( window )
 
 
+def textureAudit(*args):
+    '''
+    This function writes a CSV or JSON report of the texture memory used by the scene materials.
+    '''
+
+    from . import scene_tools
+
+    path = my.fileDialog2(fileMode=0, caption="Save Texture Audit", fileFilter="JSON (*.json);;CSV (*.csv)")
+    if path:
+        scene_tools.auditScene(path[0])
+
+
+def textureRepath(*args):
+    '''
+    This function points the scene textures to the files with the same name under a new root folder.
+    '''
+
+    from . import scene_tools
+
+    path = my.fileDialog2(fileMode=3, caption="Select New Texture Root")
+    if path:
+        scene_tools.repathScene(path[0])
+
+
+def textureCache(*args):
+    '''
+    This function copies the scene textures to the local cache and points the texture nodes to the copies.
+    '''
+
+    from . import scene_tools
+
+    scene_tools.cacheSceneTextures()
+
+
+def textureRestore(*args):
+    '''
+    This function points the texture nodes back to the original paths of the cached textures.
+    '''
+
+    from . import scene_tools
+
+    scene_tools.restoreSceneTextures()
+
+
+def textureReduce(*args):
+    '''
+    This function rewrites the grayscale data maps of the scene as single channel files.
+    '''
+
+    from . import scene_tools
+    from . import texture_reduce
+
+    if not texture_reduce.isAvailable():
+        my.warning("NumPy and Pillow or OpenImageIO are needed to reduce data maps.")
+        return
+
+    scene_tools.reduceDataMaps()
+
+
+def textureTier(tier, *args):
+    '''
+    This function points all the texture nodes of the scene to the files of a resolution tier.
+    '''
+
+    from . import scene_tools
+
+    scene_tools.switchResolutionTier(None if tier == HIGHEST_TIER else tier)
+
+
+def materialConsolidate(*args):
+    '''
+    This function merges the identical materials of the scene into one.
+    '''
+
+    from . import scene_tools
+
+    scene_tools.consolidateMaterials()
+
+
+def materialVariants(*args):
+    '''
+    This function creates the material set up in the window and the variants listed in a
+    JSON table, all connected to the same texture network.
+    '''
+
+    if window_instance is None or window_instance.scanner is not None:
+        my.warning("Please select a texture folder and wait for the scan to finish.")
+        return
+    if not (validateName() and validateFolder()):
+        return
+
+    path = my.fileDialog2(fileMode=1, caption="Select Variant Table", fileFilter="JSON (*.json)")
+    if not path:
+        return
+
+    texture_set = window_instance.texture_set
+    texture_set.selectTier(getSelectedTier())
+    analyze, bake = checkOptions(my.checkBox(ANALYZE_FIELD, query=True, value=True), my.checkBox(BAKE_FIELD, query=True, value=True))
+
+    full_name = composeFullName()
+    with UndoChunk("MaterialCreator variants %s" % full_name):
+        createMaterialVariants(name=my.textField(NAME_FIELD, query=True, text=True),
+                               directory=my.textField(FOLDER_FIELD, query=True, text=True),
+                               textureset=texture_set,
+                               variants=loadVariantTable(path[0]),
+                               engine=my.radioCollection(ENGINE_FIELD, query=True, select=True),
+                               full_name=full_name,
+                               shared_placement=my.checkBox(SHARED_PLACE_FIELD, query=True, value=True),
+                               ai_image=my.checkBox(AIIMAGE_FIELD, query=True, value=True),
+                               analyze=analyze, bake=bake)
+
+
+def libraryBuild(*args):
+    '''
+    This function builds a library material for each texture folder under a root folder,
+    with the render engine selected in the window.
+    '''
+
+    from . import material_library
+
+    root = my.fileDialog2(fileMode=3, caption="Select Texture Root")
+    if not root:
+        return
+    library = my.fileDialog2(fileMode=3, caption="Select Material Library Folder")
+    if not library:
+        return
+
+    engine = ARNOLD
+    if my.radioCollection(ENGINE_FIELD, exists=True):
+        engine = my.radioCollection(ENGINE_FIELD, query=True, select=True)
+
+    material_library.buildLibrary(library[0], root[0], engine=engine, tier=getSelectedTier())
+
+
+def libraryReference(*args):
+    '''
+    This function references the selected library materials into the scene.
+    '''
+
+    from . import material_library
+
+    paths = my.fileDialog2(fileMode=4, caption="Select Library Materials", fileFilter="Maya ASCII (*.ma)")
+    for path in paths or []:
+        material_library.loadMaterial(os.path.dirname(path), os.path.splitext(os.path.basename(path))[0])
+
+
+def batchBuild(*args):
+    '''
+    This function builds a material for each texture folder under a root folder,
+    with the render engine and options selected in the window, keeping Maya responsive.
+    '''
+
+    from . import batch_build
+
+    root = my.fileDialog2(fileMode=3, caption="Select Texture Root")
+    if not root:
+        return
+
+    undo = my.confirmDialog(title="Batch Build", message="Undo step recorded for:",
+                            button=["Each Material", "Whole Batch", "Off", "Cancel"],
+                            defaultButton="Each Material", cancelButton="Cancel", dismissString="Cancel")
+    if undo not in UNDO_LABELS:
+        return
+
+    engine = my.radioCollection(ENGINE_FIELD, query=True, select=True)
+    batch_build.buildFolders(root[0], engine=engine, undo=UNDO_LABELS[undo],
+                             classify=my.checkBox(CLASSIFY_FIELD, query=True, value=True),
+                             ai_image=my.checkBox(AIIMAGE_FIELD, query=True, value=True),
+                             shared_placement=my.checkBox(SHARED_PLACE_FIELD, query=True, value=True),
+                             analyze=my.checkBox(ANALYZE_FIELD, query=True, value=True),
+                             bake=my.checkBox(BAKE_FIELD, query=True, value=True),
+                             tier=getSelectedTier())
+
+
+def shardBuild(*args):
+    '''
+    This function builds the materials of the texture folders under a root folder in
+    parallel mayapy processes and references the resulting scenes when they are done.
+    '''
+
+    from . import shard_build
+
+    root = my.fileDialog2(fileMode=3, caption="Select Texture Root")
+    if not root:
+        return
+    output = my.fileDialog2(fileMode=3, caption="Select Output Folder")
+    if not output:
+        return
+
+    engine = my.radioCollection(ENGINE_FIELD, query=True, select=True)
+    options = {"ai_image": my.checkBox(AIIMAGE_FIELD, query=True, value=True),
+               "shared_placement": my.checkBox(SHARED_PLACE_FIELD, query=True, value=True),
+               "analyze": my.checkBox(ANALYZE_FIELD, query=True, value=True),
+               "bake": my.checkBox(BAKE_FIELD, query=True, value=True),
+               "tier": getSelectedTier()}
+
+    def build():
+        try:
+            jobs = shard_build.buildShards(root[0], output[0], engine=engine, **options)
+        except Exception as e:
+            maya.utils.executeDeferred(my.warning, "Parallel build failed: %s" % e)
+            return
+        maya.utils.executeDeferred(shard_build.assembleShards, jobs)
+
+    ## Workers are waited for in a thread, the scenes are referenced from the main thread
+    thread = threading.Thread(target=build)
+    thread.daemon = True
+    thread.start()
+    printLine("Parallel build started, the materials will be referenced when all the workers are done.")
+
+
 def onlineGuide(*args):
     webbrowser.open(REPOSITORY_WIKI)
 
@@ -1135,19 +2379,72 @@ def showUpdateNotifier(new_version):
     my.showWindow( window )
 
 
-def main():
-    
+def checkUpdate():
+    '''
+    This function looks for a newer version on the online guide, in a worker thread,
+    and shows the update notifier from the main thread.
+    '''
+
     try:
-        response = urlopen(REPOSITORY_WIKI)
+        response = urlopen(REPOSITORY_WIKI, timeout=UPDATE_TIMEOUT)
         parser = RepositoryParser()
         parser.feed(response.read().decode('utf-8'))
 
         if float(parser.version) > float(VERSION):
-            showUpdateNotifier(parser.version)
+            maya.utils.executeDeferred(showUpdateNotifier, parser.version)
     except:
         pass
 
-    MatCreatorWindow()
+
+def main():
+    global window_instance, update_checked
+
+    ## The online version is checked once per session, without waiting for the answer
+    if not update_checked:
+        update_checked = True
+        thread = threading.Thread(target=checkUpdate)
+        thread.daemon = True
+        thread.start()
+
+    if window_instance is not None and window_instance.exists():
+        window_instance.show()
+    else:
+        window_instance = MatCreatorWindow()
+
+
+def benchmarkLaunch(runs=10):
+    '''
+    This function times the shelf button with the window built from scratch (cold start)
+    and with the hidden window shown again (warm start), and prints the times in ms.
+    Only the times measured in an interactive Maya session are meaningful.
+    '''
+
+    global window_instance
+
+    if my.about(batch=True):
+        my.warning("Launch benchmark: Maya is running without its UI, the times don't reflect a real launch.")
+
+    if my.window(WINDOW, query=True, exists=True):
+        my.deleteUI(WINDOW)
+    window_instance = None
+
+    start = time.time()
+    main()
+    cold = (time.time() - start) * 1000.0
+    window_instance.closeWindow()
+
+    warm = []
+    for index in range(runs):
+        start = time.time()
+        main()
+        warm.append((time.time() - start) * 1000.0)
+        window_instance.closeWindow()
+
+    line = "Launch benchmark: cold start %.1f ms, warm start %.1f ms average, %.1f ms worst over %s runs." % (
+        cold, sum(warm) / len(warm), max(warm), runs)
+    printLine(line)
+
+    return cold, warm
 
 
 if __name__ == '__main__':
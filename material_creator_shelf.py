@@ -1,10 +1,4 @@
-import platform
 import MaterialCreator.material_creator as mc
 
-if platform.python_version().startswith('2'):  
-    reload(mc)
-elif platform.python_version().startswith('3'):
-    import importlib
-    importlib.reload(mc)
-    
+## The window is kept hidden between clicks, so the module is not reloaded
 mc.main()
\ No newline at end of file
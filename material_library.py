@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Material Library
+-----------------------------------------------------------------------
+Builds each material once into its own Maya ASCII file and keeps a
+manifest of the library, with the texture files every material was
+built from. Scenes then reference or import the library files instead
+of building the shading networks again. A material is rebuilt only
+when its textures, render engine or options change.
+-----------------------------------------------------------------------
+'''
+
+import json
+import os
+import re
+import time
+import maya.cmds as my
+
+from . import material_creator
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+LIBRARY_MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+## Longest wait for the manifest lock, held only while the manifest is written
+LOCK_TIMEOUT = 60.0
+LOCK_POLL_TIME = 0.05
+
+DEFAULT_OPTIONS = {"ai_image": False,
+                   "shared_placement": False,
+                   "analyze": False,
+                   "bake": False,
+                   "tier": None}
+
+
+def getMaterialName(folder):
+    return re.sub(r'\W', "_", os.path.basename(os.path.normpath(folder)))
+
+
+def getTextureFolders(root):
+    '''
+    This function returns the subfolders of root, or root itself if it has none.
+    '''
+
+    folders = sorted(os.path.join(root, f) for f in os.listdir(root) if os.path.isdir(os.path.join(root, f)))
+    if len(folders) == 0:
+        folders = [root]
+    return folders
+
+
+def getSourceStamps(texture_set):
+    '''
+    This function returns the size and modification time of every texture file of a texture set.
+    '''
+
+    stamps = {}
+    for tmap in texture_set.set:
+        for path in tmap.set:
+            stamps[path.replace("\\", "/")] = [os.path.getsize(path), round(os.path.getmtime(path), 3)]
+
+    return stamps
+
+
+def loadManifest(library):
+    path = os.path.join(library, LIBRARY_MANIFEST)
+    if not os.path.isfile(path):
+        return {"version": MANIFEST_VERSION, "materials": {}}
+
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    ## Materials built by a different version of the manifest are rebuilt
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "materials": {}}
+
+    return manifest
+
+
+def saveManifest(library, manifest):
+    path = os.path.join(library, LIBRARY_MANIFEST)
+    temp = path + ".tmp"
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+class ManifestLock():
+    '''
+    Lock serializing the manifest updates of the processes building into the same library.
+    The lock file is locked with flock, or msvcrt on Windows, and is never removed: the system
+    releases the lock of a process that dies, so no lock is left stale.
+    '''
+
+    def __init__(self, library, timeout=LOCK_TIMEOUT):
+        self.path = os.path.join(library, LIBRARY_MANIFEST + ".lock")
+        self.timeout = timeout
+        self.fd = None
+
+    def tryLock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        end = time.time() + self.timeout
+        while not self.tryLock():
+            if time.time() > end:
+                os.close(self.fd)
+                self.fd = None
+                raise RuntimeError("Cannot lock %s, another process holds it." % self.path)
+            time.sleep(LOCK_POLL_TIME)
+        return self
+
+    def __exit__(self, *args):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+def isUpToDate(library, entry, engine, maps, options, stamps):
+    if entry is None or not os.path.isfile(os.path.join(library, entry["file"])):
+        return False
+
+    return entry["engine"] == engine and entry["maps"] == maps and entry["options"] == options and entry["sources"] == stamps
+
+
+def buildNetwork(name, directory, texture_set, engine, maps, options):
+    '''
+    This function creates the material in the current scene without using the window
+    and returns the list of the Mat instances created.
+    '''
+
+    kwargs = {"full_name": name, "maps": maps, "analyze": options["analyze"], "bake": options["bake"]}
+
+    if engine == material_creator.ARNOLD:
+        graph = material_creator.TextureGraph(name, shared_placement=options["shared_placement"])
+        return [material_creator.ArnoldMat(name=name, directory=directory, textureset=texture_set, graph=graph, ai_image=options["ai_image"], **kwargs)]
+    elif engine == material_creator.VRAY:
+        return [material_creator.VrayMat(name=name, directory=directory, textureset=texture_set, **kwargs)]
+    elif engine == material_creator.OCTANE:
+        return [material_creator.OctaneMat(name=name, directory=directory, textureset=texture_set, **kwargs)]
+    elif engine == material_creator.ARNOLD_VRAY:
+        return material_creator.createMultiEngineMaterial(name=name, directory=directory, textureset=texture_set,
+                                                          shared_placement=options["shared_placement"], **kwargs)
+
+    raise ValueError("Unknown render engine %s" % engine)
+
+
+def exportNetwork(path, build):
+    '''
+    This function calls build, exports all the nodes it creates to path as Maya ASCII
+    and deletes them from the current scene.
+    '''
+
+    selection = my.ls(selection=True)
+    before = set(my.ls())
+
+    build()
+
+    created = [node for node in my.ls() if node not in before]
+    try:
+        my.select(created, noExpand=True, replace=True)
+        my.file(path, force=True, exportSelected=True, type='mayaAscii', preserveReferences=False, shader=True)
+    finally:
+        my.delete(created)
+        if selection:
+            my.select(selection, replace=True)
+        else:
+            my.select(clear=True)
+
+
+def ensureMaterial(library, name, directory, engine=material_creator.ARNOLD, maps=None, **options):
+    '''
+    This function builds the material of a texture folder into the library, unless the
+    library file is up to date with the textures. maps is the list of the map fields to
+    use, all the maps found by default. Returns the library file path and whether it was built,
+    or None if the folder has no textures.
+    '''
+
+    texture_set = material_creator.TextureSet(None)
+    texture_set.loadTextures(directory)
+
+    if not any(tmap.exists() for tmap in texture_set.set):
+        return None, False
+
+    merged_options = dict(DEFAULT_OPTIONS)
+    merged_options.update(options)
+    texture_set.selectTier(merged_options["tier"])
+
+    if maps is None:
+        maps = [tmap.field for tmap in texture_set.set if tmap.exists()]
+    maps = sorted(maps)
+
+    stamps = getSourceStamps(texture_set)
+    manifest = loadManifest(library)
+    entry = manifest["materials"].get(name)
+    path = os.path.join(library, name + ".ma")
+
+    if isUpToDate(library, entry, engine, maps, merged_options, stamps):
+        return path, False
+
+    exportNetwork(path, lambda: buildNetwork(name, directory, texture_set, engine, maps, merged_options))
+
+    ## The manifest is read again under the lock, so that other builds writing to the library are kept
+    with ManifestLock(library):
+        manifest = loadManifest(library)
+        manifest["materials"][name] = {"file": os.path.basename(path),
+                                       "directory": directory.replace("\\", "/"),
+                                       "engine": engine,
+                                       "maps": maps,
+                                       "options": merged_options,
+                                       "sources": stamps}
+        saveManifest(library, manifest)
+
+    return path, True
+
+
+def buildLibrary(library, root, engine=material_creator.ARNOLD, **options):
+    '''
+    This function builds a library material for each subfolder of root containing textures,
+    named after the folder, or a single material if root has no subfolders.
+    Returns the list of library file paths.
+    '''
+
+    if not os.path.isdir(library):
+        os.makedirs(library)
+
+    paths = []
+    built = 0
+    ## The networks are deleted once exported, so the scene is left as it was and nothing needs undoing
+    with material_creator.UndoChunk("Build Material Library", record=False):
+        for folder in getTextureFolders(root):
+            name = getMaterialName(folder)
+            try:
+                path, was_built = ensureMaterial(library, name, folder, engine=engine, **options)
+            except Exception as e:
+                my.warning("Cannot build library material %s: %s" % (name, e))
+                continue
+            if path is None:
+                continue
+            paths.append(path)
+            built += was_built
+
+    line = "Material library: %s materials built, %s up to date in %s." % (built, len(paths) - built, library.replace("\\", "/"))
+    material_creator.printLine(line)
+
+    return paths
+
+
+def loadMaterial(library, name, reference=True, namespace=None):
+    '''
+    This function references (or imports) a library material into the scene,
+    in a namespace named after the material. Returns its shading groups.
+    '''
+
+    entry = loadManifest(library)["materials"].get(name)
+    path = os.path.join(library, entry["file"] if entry is not None else name + ".ma")
+
+    if not os.path.isfile(path):
+        my.warning("Cannot find library material %s in %s." % (name, library.replace("\\", "/")))
+        return []
+
+    if namespace is None:
+        namespace = name
+
+    if reference:
+        nodes = my.file(path, reference=True, namespace=namespace, returnNewNodes=True)
+    else:
+        nodes = my.file(path, i=True, namespace=namespace, returnNewNodes=True)
+
+    return my.ls(nodes or [], type='shadingEngine') or []
@@ -0,0 +1,960 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Scene Tools
+-----------------------------------------------------------------------
+Tools working on the texture nodes of the materials already in the scene.
+-----------------------------------------------------------------------
+'''
+
+import csv
+import hashlib
+import json
+import os
+import platform
+import re
+import threading
+import maya.cmds as my
+import maya.utils
+from multiprocessing.pool import ThreadPool
+
+from . import material_creator
+from . import texture_bake
+from . import texture_cache
+from . import texture_info
+from . import texture_reduce
+
+
+TEXTURE_NODE_TYPES = ['file', 'aiImage', 'octaneImageTexture', 'octaneImageTilesTexture']
+
+## Map type of the file nodes created by Mat, found from the node name
+MAP_NODE_NAMES = {"baseColor": "color",
+                  "baseColorAO": "color",
+                  "normal": "normal",
+                  "bump": "bump",
+                  "roughness": "roughness",
+                  "glossiness": "glossiness",
+                  "glossinessBaked": "roughness",
+                  "metalness": "metal",
+                  "displacement": "displacement",
+                  "ao": "ao",
+                  "specular": "specular",
+                  "opacity": "opacity",
+                  "emissive": "emissive"}
+MAP_NODE_REGEX = re.compile(r'_(%s)File\d*$' % "|".join(MAP_NODE_NAMES))
+
+DATA_MAPS = ["roughness", "glossiness", "metal", "ao", "specular", "opacity"]
+MAX_RESOLUTION = 8192
+MAX_DATA_RESOLUTION = 4096
+
+AUDIT_THREADS = 16
+DIGEST_SIZE = 65536
+## Whole file digests of the previous audits, by path with the size and modification time they match
+DIGEST_CACHE_FILE = "file_digests.json"
+
+MISSING = "missing"
+DUPLICATE = "duplicate"
+OVER_RESOLUTION = "over_resolution"
+
+## Original paths of the texture attributes pointing to the local cache
+ORIGINAL_PATHS_ATTRIBUTE = "materialCreatorOriginalPaths"
+## Path of each resolution tier of the texture attributes, relative to the folder of the current path
+TIERS_ATTRIBUTE = "materialCreatorTiers"
+CACHE_ENVIRONMENT = "MATERIALCREATOR_TEXTURE_CACHE"
+
+## Shading groups never merged or deleted
+DEFAULT_SHADING_GROUPS = ["initialShadingGroup", "initialParticleSE"]
+## String attributes compared along with the scalar ones and the texture paths
+FINGERPRINT_STRING_ATTRIBUTES = ["colorSpace"]
+FINGERPRINT_PRECISION = 6
+
+CSV_COLUMNS = ["node", "node_type", "map_type", "materials", "udim_set", "path", "format", "width", "height",
+               "channels", "bit_depth", "memory", "mipmapped_memory", "flags"]
+
+
+def getJsonAttribute(node, attribute):
+    if not my.attributeQuery(attribute, node=node, exists=True):
+        return {}
+    return json.loads(my.getAttr(node + "." + attribute) or "{}")
+
+
+def setJsonAttribute(node, attribute, value):
+    '''
+    This function stores a dictionary as JSON in a string attribute of a node,
+    adding the attribute if needed and deleting it if the dictionary is empty.
+    '''
+
+    exists = my.attributeQuery(attribute, node=node, exists=True)
+
+    if len(value) == 0:
+        if exists:
+            my.deleteAttr(node + "." + attribute)
+        return
+
+    if not exists:
+        my.addAttr(node, longName=attribute, dataType='string')
+    my.setAttr(node + "." + attribute, json.dumps(value, sort_keys=True), type='string')
+
+
+def getTextureNodes():
+    return my.ls(type=TEXTURE_NODE_TYPES) or []
+
+
+def getMapType(node):
+    match = MAP_NODE_REGEX.search(node)
+    if match is None:
+        return "unknown"
+    return MAP_NODE_NAMES[match.group(1)]
+
+
+def getTexturePlugs(node):
+    '''
+    This function returns the attributes of a texture node holding a file path.
+    '''
+
+    node_type = my.nodeType(node)
+
+    if node_type == 'file':
+        return [node + '.fileTextureName']
+    elif node_type == 'aiImage':
+        return [node + '.filename']
+    elif node_type == 'octaneImageTexture':
+        return [node + '.File']
+    elif node_type == 'octaneImageTilesTexture':
+        indices = my.getAttr(node + '.explicitUvTiles', multiIndices=True) or []
+        return [node + '.explicitUvTiles[%s].explicitUvTileName' % index for index in indices]
+
+    return []
+
+
+def getUdimSet(node, plug, path=None):
+    '''
+    This function returns the path of a texture attribute, with <UDIM> in place of
+    the tile number if the node reads more than one tile.
+    '''
+
+    if path is None:
+        path = my.getAttr(plug) or ""
+
+    if my.nodeType(node) == 'file' and my.getAttr(node + '.uvTilingMode') != 0:
+        return texture_info.getUdimPattern(path)
+    elif my.nodeType(node) == 'octaneImageTilesTexture':
+        return texture_info.getUdimPattern(path)
+
+    return path
+
+
+def getTextureFiles(node, plug, path=None, frames=True):
+    '''
+    This function returns the UDIM set of a texture attribute and the files it reads, one per tile,
+    and one per frame for image sequences unless frames is False.
+    If path is given, it is used in place of the attribute value.
+    '''
+
+    udim_set = getUdimSet(node, plug, path)
+
+    pattern = udim_set
+    if frames and my.nodeType(node) == 'file' and my.getAttr(node + '.useFrameExtension'):
+        pattern = texture_info.getFramePattern(udim_set)[0] or udim_set
+
+    if my.nodeType(node) == 'octaneImageTilesTexture':
+        files = [path or my.getAttr(plug)]
+    else:
+        files = texture_info.expandUdimPattern(pattern) or [udim_set]
+
+    return udim_set, [f for f in files if f]
+
+
+def getMaterials(node):
+    '''
+    This function returns the materials downstream of a texture node.
+    '''
+
+    materials = []
+    for sg in my.ls(my.listHistory(node, future=True) or [], type='shadingEngine') or []:
+        for material in my.listConnections(sg + '.surfaceShader', source=True, destination=False) or []:
+            if material not in materials:
+                materials.append(material)
+
+    return materials
+
+
+## AUDIT #################################################
+
+
+def probeTexture(path):
+    if not os.path.isfile(path):
+        return path, None, None
+
+    info = texture_info.readTextureInfo(path)
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read(DIGEST_SIZE)).hexdigest()
+
+    return path, info, "%s_%s" % (os.path.getsize(path), digest)
+
+
+def getFileDigest(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DIGEST_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def getDigestCachePath():
+    return os.path.join(my.internalVar(userAppDir=True), "MaterialCreator", DIGEST_CACHE_FILE)
+
+
+def loadDigestCache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def saveDigestCache(path, cache):
+    folder = os.path.dirname(path)
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp = path + ".tmp"
+        with open(temp, 'w') as f:
+            json.dump(cache, f)
+        if os.path.isfile(path):
+            os.remove(path)
+        os.rename(temp, path)
+    except (IOError, OSError):
+        pass
+
+
+def findDuplicateFiles(digests, pool, cache=None):
+    '''
+    This function returns the groups of identical files among those with the same quick
+    digest (size and first bytes), confirming them with a digest of the whole files.
+    cache, if given, holds the whole file digests by path as [size, mtime, digest]: only
+    the files missing from it or changed since are read, and it is updated with them.
+    '''
+
+    if cache is None:
+        cache = {}
+
+    candidates = sorted(p for group in digests.values() if len(group) > 1 for p in group)
+    stamps = {}
+    for path in candidates:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stamps[path] = [stat.st_size, stat.st_mtime]
+    candidates = [p for p in candidates if p in stamps]
+
+    missing = [p for p in candidates if p not in cache or cache[p][:2] != stamps[p]]
+    for path, digest in zip(missing, pool.map(getFileDigest, missing)):
+        cache[path] = stamps[path] + [digest]
+
+    full_digests = {}
+    for path in candidates:
+        full_digests.setdefault(cache[path][2], []).append(path)
+
+    return sorted(sorted(group) for group in full_digests.values() if len(group) > 1)
+
+
+def isOverResolution(info, map_type):
+    if map_type in DATA_MAPS:
+        return info.getResolution() > MAX_DATA_RESOLUTION
+    return info.getResolution() > MAX_RESOLUTION
+
+
+def addMemory(totals, key, info):
+    entry = totals.setdefault(key, {"memory": 0, "mipmapped_memory": 0, "files": 0})
+    entry["memory"] += info.getMemory()
+    entry["mipmapped_memory"] += info.getMipmappedMemory()
+    entry["files"] += 1
+
+
+def auditTextures(threads=AUDIT_THREADS):
+    '''
+    This function walks all the texture nodes in the scene and returns a report
+    of the memory their files need at render time, per material, per map type
+    and per UDIM set, with the missing, duplicate and over-resolution files.
+    Headers are read in a thread pool, Maya is only queried from the calling thread.
+    '''
+
+    entries = []
+    for node in getTextureNodes():
+        map_type = getMapType(node)
+        materials = getMaterials(node)
+        for plug in getTexturePlugs(node):
+            ## Only the current frame of an image sequence is in memory at render time
+            udim_set, files = getTextureFiles(node, plug, frames=False)
+            for path in files:
+                entries.append({"node": node, "node_type": my.nodeType(node), "map_type": map_type,
+                                "materials": materials, "udim_set": udim_set, "path": path})
+
+    paths = sorted(set(e["path"] for e in entries))
+    infos = {}
+    digests = {}
+    missing = set()
+    pool = ThreadPool(threads)
+    try:
+        for path, info, digest in pool.map(probeTexture, paths):
+            infos[path] = info
+            if digest is None:
+                missing.add(path)
+            else:
+                digests.setdefault(digest, []).append(path)
+
+        ## Files with the same size and first bytes are only candidates, e.g. EXR files with identical headers.
+        ## Their whole digests are kept between audits, so unchanged files are read once
+        cache_path = getDigestCachePath()
+        cache = loadDigestCache(cache_path)
+        duplicates = findDuplicateFiles(digests, pool, cache)
+        saveDigestCache(cache_path, cache)
+    finally:
+        pool.close()
+        pool.join()
+
+    duplicate_paths = set(p for group in duplicates for p in group)
+
+    report = {"textures": [], "materials": {}, "map_types": {}, "udim_sets": {},
+              "missing": sorted(missing), "duplicates": duplicates, "over_resolution": [],
+              "memory": 0, "mipmapped_memory": 0}
+
+    for entry in entries:
+        path = entry["path"]
+        info = infos.get(path)
+        flags = []
+
+        if path in missing:
+            flags.append(MISSING)
+        if path in duplicate_paths:
+            flags.append(DUPLICATE)
+
+        if info is not None:
+            entry.update(info.asDict())
+            entry["memory"] = info.getMemory()
+            entry["mipmapped_memory"] = info.getMipmappedMemory()
+
+            if isOverResolution(info, entry["map_type"]):
+                flags.append(OVER_RESOLUTION)
+                if path not in report["over_resolution"]:
+                    report["over_resolution"].append(path)
+
+            for material in entry["materials"] or ["unassigned"]:
+                addMemory(report["materials"], material, info)
+            addMemory(report["map_types"], entry["map_type"], info)
+            addMemory(report["udim_sets"], entry["udim_set"], info)
+
+        entry["flags"] = flags
+        report["textures"].append(entry)
+
+    ## Files read by more than one node are loaded only once
+    for path in paths:
+        if infos.get(path) is not None:
+            report["memory"] += infos[path].getMemory()
+            report["mipmapped_memory"] += infos[path].getMipmappedMemory()
+
+    return report
+
+
+def openCSV(path):
+    if platform.python_version().startswith('2'):
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
+def writeAuditReport(report, path):
+    '''
+    This function writes the audit report as JSON, or as CSV with one row per
+    texture file if path ends with .csv.
+    '''
+
+    if path.lower().endswith(".csv"):
+        with openCSV(path) as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            for entry in report["textures"]:
+                row = []
+                for column in CSV_COLUMNS:
+                    value = entry.get(column, "")
+                    if isinstance(value, list):
+                        value = ";".join(value)
+                    row.append(value)
+                writer.writerow(row)
+    else:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def formatMemory(size):
+    return "%.1f MB" % (size / 1048576.0)
+
+
+def auditScene(path, budget=None):
+    '''
+    This function writes the audit report of the scene textures to path and prints a summary.
+    If a budget in bytes is given, a warning is shown when the mipmapped memory exceeds it.
+    '''
+
+    report = auditTextures()
+    writeAuditReport(report, path)
+
+    line = "Texture audit: %s files, %s uncompressed, %s mipmapped, %s missing, %s duplicate groups, %s over resolution. Report saved to %s" % (
+        len(set(e["path"] for e in report["textures"])), formatMemory(report["memory"]), formatMemory(report["mipmapped_memory"]),
+        len(report["missing"]), len(report["duplicates"]), len(report["over_resolution"]), path.replace("\\", "/"))
+    material_creator.printLine(line)
+
+    if budget is not None and report["mipmapped_memory"] > budget:
+        my.warning("Texture memory %s exceeds the budget of %s." % (formatMemory(report["mipmapped_memory"]), formatMemory(budget)))
+
+    return report
+
+
+## REPATH ################################################
+
+
+def repathTextures(root, rules=None, nodes=None):
+    '''
+    This function points the texture nodes to the files found under root.
+    The new root is scanned once, then all the texture attributes are read,
+    resolved and only the changed ones are set. Returns the number of
+    remapped attributes and the list of the unresolved paths.
+    '''
+
+    index = texture_info.buildFileIndex(root)
+
+    if nodes is None:
+        nodes = getTextureNodes()
+
+    remapped = 0
+    unresolved = []
+    for node in nodes:
+        for plug in getTexturePlugs(node):
+            path = my.getAttr(plug)
+            if not path:
+                continue
+
+            new_path = texture_info.resolvePath(path, index, rules)
+            if new_path is None:
+                unresolved.append(path)
+            elif new_path != texture_info.normalizePath(path):
+                my.setAttr(plug, new_path, type='string')
+                remapped += 1
+
+    return remapped, unresolved
+
+
+def repathScene(root, rules=None):
+    '''
+    This function repaths all the scene textures to root and prints a summary.
+    '''
+
+    remapped, unresolved = repathTextures(root, rules)
+
+    line = "Texture repath: %s paths remapped to %s, %s unresolved." % (remapped, texture_info.normalizePath(root), len(unresolved))
+    material_creator.printLine(line)
+
+    for path in unresolved:
+        my.warning("Cannot find texture %s under %s." % (texture_info.normalizePath(path), texture_info.normalizePath(root)))
+
+    return remapped, unresolved
+
+
+## LOCAL CACHE ###########################################
+
+
+def getCacheDirectory():
+    return os.environ.get(CACHE_ENVIRONMENT) or os.path.join(my.internalVar(userAppDir=True), "MaterialCreator", "texture_cache")
+
+
+def getOriginalPaths(node):
+    return getJsonAttribute(node, ORIGINAL_PATHS_ATTRIBUTE)
+
+
+def setOriginalPaths(node, paths):
+    '''
+    This function stores the original path of each texture attribute of a node
+    in the scene, so that paths can be restored after the scene is reopened.
+    '''
+
+    setJsonAttribute(node, ORIGINAL_PATHS_ATTRIBUTE, paths)
+
+
+def getCacheEntries(nodes=None):
+    '''
+    This function returns (node, plug, source path, source files) for every texture attribute.
+    Attributes already pointing to the cache are listed with their original path.
+    '''
+
+    if nodes is None:
+        nodes = getTextureNodes()
+
+    entries = []
+    for node in nodes:
+        originals = getOriginalPaths(node)
+        for plug in getTexturePlugs(node):
+            source = originals.get(plug) or my.getAttr(plug)
+            if not source:
+                continue
+            files = getTextureFiles(node, plug, source)[1]
+            entries.append((node, plug, source, files))
+
+    return entries
+
+
+def applyLocalPaths(entries, copies):
+    '''
+    This function points the texture attributes to the local copies of their files.
+    Attributes with a file that could not be copied keep their path.
+    Returns the number of attributes changed and the list of the files not copied.
+    '''
+
+    changed = 0
+    failed = []
+    for node, plug, source, files in entries:
+        if not my.objExists(node):
+            continue
+
+        missing = [f for f in files if copies.get(f) is None]
+        if len(files) == 0 or len(missing) > 0:
+            failed.extend(missing)
+            continue
+
+        ## All the tiles of a path are copied to the same folder, so a <UDIM> pattern still matches
+        local = texture_info.normalizePath(os.path.join(os.path.dirname(copies[files[0]]), os.path.basename(source)))
+        if local == texture_info.normalizePath(my.getAttr(plug) or ""):
+            continue
+
+        originals = getOriginalPaths(node)
+        originals.setdefault(plug, source)
+        setOriginalPaths(node, originals)
+        my.setAttr(plug, local, type='string')
+        changed += 1
+
+    return changed, sorted(set(failed))
+
+
+class TextureCacheJob(threading.Thread):
+    '''
+    Copies the texture files to the local cache in a worker thread, then points the
+    texture attributes to the copies from the main thread with executeDeferred.
+    '''
+
+    def __init__(self, cache, entries):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.cache = cache
+        self.entries = entries
+
+    def run(self):
+        copies = self.cache.copyFiles([f for entry in self.entries for f in entry[3]])
+        maya.utils.executeDeferred(finishCache, self.cache, self.entries, copies)
+
+
+def finishCache(cache, entries, copies):
+    changed, failed = applyLocalPaths(entries, copies)
+
+    line = "Texture cache: %s files cached, %s paths pointed to %s, %s cache size." % (
+        len([c for c in copies.values() if c is not None]), changed, texture_info.normalizePath(cache.directory), formatMemory(cache.getSize()))
+    material_creator.printLine(line)
+
+    for path in failed:
+        my.warning("Cannot copy texture %s to the local cache." % texture_info.normalizePath(path))
+
+
+def cacheSceneTextures(directory=None, max_size=texture_cache.CACHE_SIZE, nodes=None):
+    '''
+    This function copies the scene textures to a local cache and points the texture
+    nodes to the copies. Files are copied in the background when Maya has a UI.
+    '''
+
+    cache = texture_cache.TextureCache(directory or getCacheDirectory(), max_size=max_size)
+    entries = getCacheEntries(nodes)
+
+    if my.about(batch=True):
+        copies = cache.copyFiles([f for entry in entries for f in entry[3]])
+        finishCache(cache, entries, copies)
+        return
+
+    TextureCacheJob(cache, entries).start()
+    material_creator.printLine("Copying %s texture files to the local cache." % len(set(f for entry in entries for f in entry[3])))
+
+
+def restoreSceneTextures(nodes=None):
+    '''
+    This function points the texture nodes back to the original paths of the cached textures.
+    '''
+
+    if nodes is None:
+        nodes = getTextureNodes()
+
+    restored = 0
+    for node in nodes:
+        originals = getOriginalPaths(node)
+        for plug, path in originals.items():
+            if my.objExists(plug):
+                my.setAttr(plug, path, type='string')
+                restored += 1
+        setOriginalPaths(node, {})
+
+    material_creator.printLine("Texture cache: %s paths restored." % restored)
+
+    return restored
+
+
+## DATA MAP REDUCTION ####################################
+
+
+def reduceDataMaps(nodes=None):
+    '''
+    This function rewrites the grayscale data maps stored with more channels or a higher
+    bit depth than needed as single channel files and points the texture nodes to them.
+    Returns the number of rewritten files, the texture memory and the disk space saved.
+    '''
+
+    if nodes is None:
+        nodes = getTextureNodes()
+
+    entries = []
+    for node in nodes:
+        bits = texture_reduce.MAP_BIT_DEPTH.get(getMapType(node), -1)
+        if bits == -1:
+            continue
+        for plug in getTexturePlugs(node):
+            files = getTextureFiles(node, plug)[1]
+            if len(files) > 0:
+                entries.append((node, plug, bits, files))
+
+    reducible = texture_reduce.findReducible([(f, bits) for node, plug, bits, files in entries for f in files])
+
+    ## The tiles of a texture are either all reduced or all kept
+    entries = [entry for entry in entries if all((f, entry[2]) in reducible for f in entry[3])]
+    ## A file used with two bit depths is reduced once for each
+    jobs = dict(((f, bits), (f, bits, texture_reduce.getReducedPath(f, bits))) for node, plug, bits, files in entries for f in files)
+    texture_reduce.reduceFiles(list(jobs.values()))
+
+    changed = 0
+    for node, plug, bits, files in entries:
+        path = my.getAttr(plug)
+        if texture_info.UDIM_TOKEN in path:
+            new_path = texture_info.getUdimPattern(texture_reduce.getReducedPath(files[0], bits))
+        else:
+            new_path = texture_reduce.getReducedPath(path, bits)
+        my.setAttr(plug, texture_info.normalizePath(new_path), type='string')
+        ## A single channel file has no alpha: the materials reading outAlpha need its luminance
+        if my.nodeType(node) == 'file' and my.listConnections(node + '.outAlpha', source=False, destination=True):
+            my.setAttr(node + '.alphaIsLuminance', True)
+        changed += 1
+
+    memory = 0
+    disk = 0
+    for source, bits, target in jobs.values():
+        saved = texture_reduce.getSavedBytes(source, target)
+        memory += saved[0]
+        disk += saved[1]
+
+    line = "Data map reduction: %s files rewritten, %s paths changed, %s of texture memory and %s on disk saved." % (
+        len(jobs), changed, formatMemory(memory), formatMemory(disk))
+    material_creator.printLine(line)
+
+    return len(jobs), memory, disk
+
+
+## RESOLUTION TIERS ######################################
+
+
+def setTierPaths(node, tiers):
+    '''
+    This function stores on a node the path of each resolution tier of its texture
+    attributes, as a dictionary from attribute to a dictionary from tier to path.
+    Paths are stored relative to the folder of the current path, so that they follow
+    the textures when the scene is repathed.
+    '''
+
+    relative = {}
+    for plug, paths in tiers.items():
+        folder = os.path.dirname(my.getAttr(plug) or "")
+        relative[plug] = {}
+        for tier, path in paths.items():
+            try:
+                relative[plug][tier] = os.path.relpath(path, folder).replace("\\", "/")
+            except ValueError:
+                ## Tier on another drive
+                relative[plug][tier] = path
+
+    setJsonAttribute(node, TIERS_ATTRIBUTE, relative)
+
+
+def getStoredTiers(path, tiers):
+    '''
+    This function resolves the stored tiers of a texture attribute against the folder of its
+    current path. Returns the tiers whose files exist and the list of the missing ones.
+    '''
+
+    folder = os.path.dirname(path)
+    found = {}
+    missing = []
+    for tier, tier_path in tiers.items():
+        ## Absolute paths, stored by older versions, are kept as they are
+        tier_path = os.path.normpath(os.path.join(folder, tier_path)).replace("\\", "/")
+        files = texture_info.expandUdimPattern(tier_path)
+        if len(files) > 0 and all(os.path.isfile(f) for f in files):
+            found[tier] = tier_path
+        else:
+            missing.append(tier)
+
+    return found, missing
+
+
+def getTokenTiers(path):
+    '''
+    This function returns the existing files of each resolution tier of a path whose
+    file name has a tier token, replacing the token with the other tiers.
+    '''
+
+    if texture_info.getTier(path) is None:
+        return {}
+
+    tiers = {}
+    for tier in texture_info.TIERS:
+        tier_path = texture_info.replaceTier(path, tier)
+        files = texture_info.expandUdimPattern(tier_path)
+        if len(files) > 0 and all(os.path.isfile(f) for f in files):
+            tiers[tier] = tier_path
+
+    return tiers
+
+
+def isBakedPath(path):
+    return os.path.basename(os.path.dirname(texture_info.normalizePath(path))) == texture_bake.BAKE_FOLDER
+
+
+def switchResolutionTier(tier=None, nodes=None):
+    '''
+    This function points the texture nodes to the files of a resolution tier, or of the
+    closest lower tier available, or of the highest tier if tier is None. The tiers of
+    each node are those stored when its material was created or, for other nodes,
+    the files whose name only differs by the tier token. Attributes pointing to a local
+    cache copy or to a reduced or baked file are skipped, since their tiers are source files.
+    Stored tiers whose files are missing are left out with a warning.
+    '''
+
+    if nodes is None:
+        nodes = getTextureNodes()
+
+    changed = 0
+    skipped = 0
+    for node in nodes:
+        stored = getJsonAttribute(node, TIERS_ATTRIBUTE)
+        originals = getOriginalPaths(node)
+        for plug in getTexturePlugs(node):
+            path = my.getAttr(plug)
+            if not path:
+                continue
+            if plug in originals or isBakedPath(path):
+                skipped += 1
+                continue
+
+            if plug in stored:
+                tiers, missing = getStoredTiers(path, stored[plug])
+                if len(missing) > 0:
+                    my.warning("%s: files of tier %s not found next to %s." % (plug, ", ".join(sorted(missing)), path))
+            else:
+                tiers = getTokenTiers(path)
+            if len(tiers) == 0:
+                continue
+
+            new_path = tiers[texture_info.selectTier(tiers.keys(), tier)]
+            if texture_info.normalizePath(new_path) != texture_info.normalizePath(path):
+                my.setAttr(plug, new_path, type='string')
+                changed += 1
+
+    line = "Resolution tier %s: %s texture paths changed, %s cached, reduced or baked paths skipped." % (tier or "highest", changed, skipped)
+    material_creator.printLine(line)
+
+    return changed
+
+
+## CONSOLIDATION #########################################
+
+
+def getAttributeValues(node, connected):
+    '''
+    This function returns the sorted (attribute, value) pairs of the settable scalar attributes
+    of a node, the texture paths and the string attributes compared, skipping the connected
+    attributes and their children, whose values come from upstream.
+    '''
+
+    skipped = set(connected)
+    for attribute in connected:
+        try:
+            skipped.update(my.attributeQuery(attribute.split(".")[-1], node=node, listChildren=True) or [])
+        except (RuntimeError, ValueError):
+            pass
+
+    values = []
+    for attribute in my.listAttr(node, scalar=True, settable=True, multi=True) or []:
+        if attribute in skipped:
+            continue
+        try:
+            value = my.getAttr(node + "." + attribute)
+        except (RuntimeError, ValueError):
+            continue
+        if isinstance(value, float):
+            value = round(value, FINGERPRINT_PRECISION)
+        values.append((attribute, value))
+
+    for plug in getTexturePlugs(node):
+        values.append((plug.split(".", 1)[1], texture_info.normalizePath(my.getAttr(plug) or "")))
+    for attribute in FINGERPRINT_STRING_ATTRIBUTES:
+        if attribute not in skipped and my.attributeQuery(attribute, node=node, exists=True):
+            values.append((attribute, my.getAttr(node + "." + attribute)))
+
+    return sorted(values, key=repr)
+
+
+def fingerprintNode(node, networks, shared):
+    '''
+    This function returns the fingerprint of a node and of its upstream network: its type,
+    its attribute values and the fingerprints of the nodes connected to its inputs. Node
+    names are left out, so identical networks built under different names match.
+    networks is a dictionary from node to (fingerprint, network nodes) filled as nodes are
+    visited, so that each node is read once whatever the number of networks using it.
+    Nodes in shared are fingerprinted by name and left out of the network.
+    '''
+
+    if node in networks:
+        if networks[node] is None:
+            ## Cycle in the network
+            return "cycle_" + my.nodeType(node), set()
+        return networks[node]
+    networks[node] = None
+
+    is_sg = my.nodeType(node) == 'shadingEngine'
+    inputs = []
+    connected = []
+    nodes = set([node])
+    pairs = my.listConnections(node, source=True, destination=False, connections=True, plugs=True, skipConversionNodes=False) or []
+    for destination, source in zip(pairs[::2], pairs[1::2]):
+        source_node, source_attribute = source.split(".", 1)
+        attribute = destination.split(".", 1)[1]
+
+        ## Objects connect to the shading groups as set members
+        if is_sg and len(my.ls(source_node, dag=True) or []) > 0:
+            continue
+
+        connected.append(attribute)
+        if source_node in shared or len(my.ls(source_node, dag=True) or []) > 0:
+            inputs.append((attribute, source_node, source_attribute))
+            continue
+
+        fingerprint, upstream = fingerprintNode(source_node, networks, shared)
+        inputs.append((attribute, fingerprint, source_attribute))
+        nodes.update(upstream)
+
+    values = [] if is_sg else getAttributeValues(node, connected)
+    data = repr((my.nodeType(node), values, sorted(inputs)))
+    networks[node] = (hashlib.sha1(data.encode('utf-8')).hexdigest(), nodes)
+
+    return networks[node]
+
+
+def findDuplicateMaterials():
+    '''
+    This function fingerprints the shading networks of the scene in one traversal and returns
+    the groups of identical MaterialCreator shading groups, the first one of each group being
+    the oldest, and a dictionary from every shading group to the nodes of its network.
+    '''
+
+    shared = set(my.ls(defaultNodes=True) or []) | set(my.ls(referencedNodes=True) or [])
+    networks = {}
+    groups = {}
+    sg_nodes = {}
+
+    for sg in my.ls(type='shadingEngine') or []:
+        if sg in DEFAULT_SHADING_GROUPS or sg in shared:
+            continue
+
+        fingerprint, nodes = fingerprintNode(sg, networks, shared)
+        sg_nodes[sg] = nodes
+
+        ## Only the networks with file nodes created by MaterialCreator are merged
+        if any(MAP_NODE_REGEX.search(node) for node in nodes):
+            groups.setdefault(fingerprint, []).append(sg)
+
+    return [sgs for sgs in groups.values() if len(sgs) > 1], sg_nodes
+
+
+def findUsedNodes(nodes, removed):
+    '''
+    This function returns the nodes among nodes that are still used outside them, e.g. a file
+    node driving a light or a shader used by a layered shader, with the nodes upstream of them.
+    Connections from the removed shading groups and message connections are not uses.
+    '''
+
+    used = set()
+    for node in nodes:
+        if node in removed:
+            continue
+        pairs = my.listConnections(node, source=False, destination=True, connections=True, plugs=True, skipConversionNodes=True) or []
+        for source, destination in zip(pairs[::2], pairs[1::2]):
+            if source.split(".", 1)[1] == "message":
+                continue
+            if destination.split(".", 1)[0] not in nodes:
+                used.add(node)
+                break
+
+    upstream = set()
+    for node in used:
+        upstream.update(n for n in my.listHistory(node) or [] if n in nodes)
+
+    return used | upstream
+
+
+def consolidateMaterials():
+    '''
+    This function merges the identical MaterialCreator materials of the scene: the members
+    of each group are assigned to its oldest shading group, in one sets call per group,
+    and the networks no longer used by any shading group are deleted, except the nodes
+    still connected elsewhere. Returns the number of merged shading groups and of deleted nodes.
+    '''
+
+    duplicates, sg_nodes = findDuplicateMaterials()
+
+    removed = []
+    for sgs in duplicates:
+        canonical = sgs[0]
+        members = []
+        for sg in sgs[1:]:
+            members.extend(my.sets(sg, query=True) or [])
+        if len(members) > 0:
+            my.sets(members, edit=True, forceElement=canonical)
+        removed.extend(sgs[1:])
+
+    ## Nodes shared with a kept network stay
+    kept = set()
+    for sg, nodes in sg_nodes.items():
+        if sg not in removed:
+            kept.update(nodes)
+
+    deleted = set()
+    for sg in removed:
+        deleted.update(node for node in sg_nodes[sg] if node not in kept)
+        deleted.update(my.listConnections(sg, type='materialInfo') or [])
+
+    used = findUsedNodes(deleted, set(removed))
+    if len(used) > 0:
+        my.warning("%s nodes of the duplicate materials are still connected to other nodes and are kept." % len(used))
+
+    deleted = [node for node in deleted if node not in used and my.objExists(node)]
+    if len(deleted) > 0:
+        my.delete(deleted)
+
+    line = "Material consolidation: %s duplicate materials merged into %s, %s nodes deleted." % (
+        len(removed), len(duplicates), len(deleted))
+    material_creator.printLine(line)
+
+    return len(removed), len(deleted)
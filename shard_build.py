@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Shard Build
+-----------------------------------------------------------------------
+Splits the texture folders of a library into shards and builds them in
+parallel, one mayapy worker process per shard. Each worker builds the
+materials of its shard and saves them to a partial scene; the partial
+scenes are then referenced or imported into one scene, each in its own
+namespace so that node names never conflict.
+Failed shards are run again, up to a number of retries.
+-----------------------------------------------------------------------
+'''
+
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import maya.cmds as my
+
+from . import material_creator
+from . import material_library
+from . import texture_analysis
+
+
+RETRIES = 2
+POLL_TIME = 0.2
+
+ENGINE_PLUGINS = {material_creator.ARNOLD: ["mtoa"],
+                  material_creator.VRAY: ["vrayformaya"],
+                  material_creator.OCTANE: ["OctanePlugin"],
+                  material_creator.ARNOLD_VRAY: ["mtoa", "vrayformaya"]}
+
+
+def getMayapyExecutable():
+    '''
+    This function returns the mayapy executable of the running Maya, or None if it can't be found.
+    '''
+
+    executable = texture_analysis.getPythonExecutable()
+    if executable is not None:
+        return executable
+
+    if os.path.basename(sys.executable).lower().startswith("mayapy"):
+        return sys.executable
+
+    name = "mayapy.exe" if sys.platform.startswith("win") else "mayapy"
+    candidate = os.path.join(os.environ.get("MAYA_LOCATION", ""), "bin", name)
+    if os.path.isfile(candidate):
+        return candidate
+
+    return None
+
+
+class Shard():
+
+    def __init__(self, index, folders, output):
+        self.index = index
+        self.folders = folders
+        self.name = "shard_%02d" % index
+        self.spec_path = os.path.join(output, self.name + ".json")
+        self.scene_path = os.path.join(output, self.name + ".ma")
+        self.result_path = os.path.join(output, self.name + "_result.json")
+        self.log_path = os.path.join(output, self.name + ".log")
+
+        self.process = None
+        self.log = None
+        self.attempts = 0
+        self.start_time = None
+        self.time = 0.0
+        self.result = None
+
+    def start(self, executable):
+        if os.path.isfile(self.result_path):
+            os.remove(self.result_path)
+
+        ## The package is run as a module, so its parent folder has to be on the path
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(package_dir)] + [p for p in [env.get("PYTHONPATH")] if p])
+
+        self.attempts += 1
+        self.log = open(self.log_path, 'a')
+        self.start_time = time.time()
+        self.process = subprocess.Popen([executable, "-m", __name__, self.spec_path],
+                                        stdout=self.log, stderr=subprocess.STDOUT, env=env)
+
+    def poll(self):
+        '''
+        This function returns True once the worker process has exited.
+        '''
+
+        if self.process is None or self.process.poll() is None:
+            return False
+
+        self.time += time.time() - self.start_time
+        self.log.close()
+        self.log = None
+
+        if self.process.returncode == 0 and os.path.isfile(self.result_path):
+            with open(self.result_path, 'r') as f:
+                self.result = json.load(f)
+        self.process = None
+
+        return True
+
+    def succeeded(self):
+        return self.result is not None
+
+
+def splitFolders(folders, count):
+    ## Round robin keeps shards balanced when folder sizes follow their names
+    return [folders[index::count] for index in range(count) if len(folders[index::count]) > 0]
+
+
+def buildShards(root, output, shards=None, engine=material_creator.ARNOLD, retries=RETRIES, **options):
+    '''
+    This function builds the materials of the subfolders of root in parallel mayapy workers,
+    one per shard, saving the partial scenes to output. Returns the list of Shard objects.
+    Runs without Maya commands, so it can be called from a thread.
+    '''
+
+    executable = getMayapyExecutable()
+    if executable is None:
+        raise RuntimeError("Cannot find the mayapy executable.")
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    folders = material_library.getTextureFolders(root)
+    count = shards or multiprocessing.cpu_count()
+    merged_options = dict(material_library.DEFAULT_OPTIONS)
+    merged_options.update(options)
+
+    jobs = [Shard(index, shard_folders, output) for index, shard_folders in enumerate(splitFolders(folders, count))]
+    for shard in jobs:
+        with open(shard.spec_path, 'w') as f:
+            json.dump({"folders": shard.folders, "engine": engine, "options": merged_options,
+                       "scene": shard.scene_path, "result": shard.result_path}, f, indent=2)
+        shard.start(executable)
+
+    running = list(jobs)
+    while len(running) > 0:
+        time.sleep(POLL_TIME)
+        for shard in list(running):
+            if not shard.poll():
+                continue
+            if shard.succeeded() or shard.attempts > retries:
+                running.remove(shard)
+            else:
+                shard.start(executable)
+
+    return jobs
+
+
+def getSummary(jobs):
+    '''
+    This function returns the lines of the per-shard timing summary.
+    '''
+
+    lines = []
+    for shard in jobs:
+        if shard.succeeded():
+            lines.append("%s: %s materials built, %s failed in %.1f s (%s attempts, %.1f s building)." % (
+                shard.name, len(shard.result["built"]), len(shard.result["failed"]), shard.time, shard.attempts, shard.result["time"]))
+        else:
+            lines.append("%s: failed after %s attempts in %.1f s, see %s." % (shard.name, shard.attempts, shard.time, shard.log_path.replace("\\", "/")))
+
+    return lines
+
+
+def assembleShards(jobs, reference=True):
+    '''
+    This function references (or imports) the partial scenes of the built shards into the
+    current scene, each in a namespace named after the shard, and prints the summary.
+    '''
+
+    for line in getSummary(jobs):
+        material_creator.printLine(line + "\n")
+
+    for shard in jobs:
+        if not shard.succeeded():
+            my.warning("%s was not built, its materials are missing." % shard.name)
+            continue
+        for folder, error in shard.result["failed"]:
+            my.warning("Cannot build material for %s: %s" % (folder.replace("\\", "/"), error))
+
+        if reference:
+            my.file(shard.scene_path, reference=True, namespace=shard.name)
+        else:
+            my.file(shard.scene_path, i=True, namespace=shard.name)
+
+
+## WORKER ################################################
+
+
+def runWorker(spec_path):
+    '''
+    This function builds the materials of a shard in a standalone Maya session,
+    saves them to the shard scene and writes the result file.
+    '''
+
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+    ## Nothing is ever undone in a worker
+    my.undoInfo(state=False)
+
+    with open(spec_path, 'r') as f:
+        spec = json.load(f)
+
+    for plugin in ENGINE_PLUGINS.get(spec["engine"], []):
+        my.loadPlugin(plugin, quiet=True)
+
+    my.file(new=True, force=True)
+
+    start = time.time()
+    result = {"built": [], "failed": []}
+    for folder in spec["folders"]:
+        texture_set = material_creator.TextureSet(None)
+        texture_set.loadTextures(folder, verbose=False)
+        texture_set.selectTier(spec["options"]["tier"])
+        maps = [tmap.field for tmap in texture_set.set if tmap.exists()]
+        if len(maps) == 0:
+            continue
+
+        name = material_library.getMaterialName(folder)
+        try:
+            material_library.buildNetwork(name, folder, texture_set, spec["engine"], maps, spec["options"])
+            result["built"].append(name)
+        except Exception as e:
+            result["failed"].append([folder, str(e)])
+
+    my.file(rename=spec["scene"])
+    my.file(save=True, type='mayaAscii', force=True)
+    result["time"] = time.time() - start
+
+    ## The result file is written last, so it exists only if the scene was saved
+    with open(spec["result"] + ".tmp", 'w') as f:
+        json.dump(result, f, indent=2)
+    os.rename(spec["result"] + ".tmp", spec["result"])
+
+
+if __name__ == "__main__":
+    runWorker(sys.argv[1])
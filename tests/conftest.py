@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+## The modules tested here don't need Maya and are imported from the package folder directly
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import ingest_service
+
+
+class SleepingWorker():
+    ## Stands in for a mayapy that never exits, e.g. waiting for a licence
+
+    def getCommand(self, spec_path):
+        return [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+def makeDrop(hot_folder, name, files):
+    folder = os.path.join(hot_folder, name)
+    os.makedirs(folder)
+    for f in files + [ingest_service.READY_MARKER]:
+        open(os.path.join(folder, f), 'wb').close()
+
+
+def runService(tmpdir, worker, **kwargs):
+    hot_folder = str(tmpdir.join("hot"))
+    library = str(tmpdir.join("library"))
+    makeDrop(hot_folder, "rock", ["rock_color.png", "rock_roughness.png"])
+    makeDrop(hot_folder, "notes", ["readme.txt"])
+    makeDrop(hot_folder, "broken", ["broken_color.png", ingest_service.STAND_IN_FAIL])
+
+    service = ingest_service.IngestService(hot_folder, library, worker, workers=2, retries=1, poll_time=0.1,
+                                           retry_delay=0.0, **kwargs)
+    service.run(duration=60, until_idle=True)
+    return service, library
+
+
+def test_stand_in_drops(tmpdir):
+    service, library = runService(tmpdir, ingest_service.StandInWorker())
+    jobs = service.queue.jobs
+
+    assert jobs["rock"]["state"] == ingest_service.DONE
+    assert jobs["notes"]["state"] == ingest_service.EMPTY
+    assert jobs["broken"]["state"] == ingest_service.FAILED
+    assert jobs["broken"]["attempts"] == 2
+
+    with open(os.path.join(library, "rock.ma"), 'r') as f:
+        lines = f.read().splitlines()
+    assert lines[1:] == ["// rock_color.png", "// rock_roughness.png"]
+    assert not os.path.isfile(os.path.join(library, "broken.ma"))
+
+    ## The queue is kept on disk
+    queue = ingest_service.IngestQueue(os.path.join(service.state_dir, ingest_service.QUEUE_FILE))
+    assert queue.getCounts()[ingest_service.DONE] == 1
+
+
+def test_hung_worker_times_out(tmpdir):
+    service, library = runService(tmpdir, SleepingWorker(), job_timeout=0.5)
+    jobs = service.queue.jobs
+
+    assert all(job["state"] == ingest_service.FAILED for job in jobs.values())
+    assert all(job["attempts"] == 2 for job in jobs.values())
+    assert jobs["rock"]["error"].startswith("timed out after")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+
+import texture_info
+
+
+def touch(path):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'wb').close()
+
+
+def test_resolve_path_by_name(tmpdir):
+    root = str(tmpdir)
+    touch(os.path.join(root, "assets", "rock", "rock_color.png"))
+    touch(os.path.join(root, "assets", "wood", "wood_color.png"))
+
+    index = texture_info.buildFileIndex(root)
+    resolved = texture_info.resolvePath("//old_server/textures/rock/Rock_Color.png", index)
+
+    assert resolved == texture_info.normalizePath(os.path.join(root, "assets", "rock", "rock_color.png"))
+    assert texture_info.resolvePath("//old_server/textures/rock/missing.png", index) is None
+
+
+def test_resolve_path_prefers_matching_folders(tmpdir):
+    root = str(tmpdir)
+    touch(os.path.join(root, "a", "rock", "color.png"))
+    touch(os.path.join(root, "b", "wood", "color.png"))
+
+    index = texture_info.buildFileIndex(root)
+
+    assert texture_info.resolvePath("D:\\textures\\wood\\color.png", index).endswith("/b/wood/color.png")
+
+
+def test_resolve_udim_pattern(tmpdir):
+    root = str(tmpdir)
+    touch(os.path.join(root, "rock_color.1001.exr"))
+    touch(os.path.join(root, "rock_color.1002.exr"))
+
+    index = texture_info.buildFileIndex(root)
+
+    assert texture_info.resolvePath("/old/rock_color.<UDIM>.exr", index) == texture_info.normalizePath(os.path.join(root, "rock_color.<UDIM>.exr"))
+
+
+def test_frame_numbers():
+    assert texture_info.getFrameNumber("wood_color.0024.exr") == 24
+    assert texture_info.getFrameNumber("wood_color.1001.0024.exr") == 24
+    assert texture_info.getUdimNumber("wood_color.1001.0024.exr") == "1001"
+
+
+def test_udim_is_not_a_frame():
+    assert texture_info.getFrameNumber("wood_color.1001.exr") is None
+    assert texture_info.getUdimNumber("wood_color.1001.exr") == "1001"
+
+
+def test_variants_are_not_frames():
+    for file_name in ["rock_color_01.png", "rock_color_02.png", "wood_color_2048.png", "wood_color_4096.png"]:
+        assert texture_info.getFrameMatch(file_name) is None
+        assert texture_info.getFramePattern(file_name) == (None, 0)
+
+
+def test_frame_pattern():
+    pattern, padding = texture_info.getFramePattern("/tex/wood_color.1001.0024.exr")
+
+    assert pattern == os.path.join("/tex", "wood_color.1001.<f>.exr")
+    assert padding == 4
+
+
+def test_file_sequence_ranges():
+    sequence = texture_info.FileSequence("wood_color.<f>.exr", 4)
+    for frame in [5, 3, 1, 2, 4, 10, 12, 11, 20]:
+        sequence.add(frame)
+
+    assert sequence.ranges == [[1, 5], [10, 12], [20, 20]]
+    assert sequence.getFrameCount() == 9
+    assert sequence.getFirstFrame() == 1
+    assert sequence.getLastFrame() == 20
+    assert sequence.formatRanges() == "1-5, 10-12, 20"
+    assert list(sequence.getFrames()) == [1, 2, 3, 4, 5, 10, 11, 12, 20]
+    assert sequence.getPath(11) == "wood_color.0011.exr"
+
+
+def test_file_sequence_duplicate_frames():
+    sequence = texture_info.FileSequence("wood_color.<f>.exr", 4)
+    sequence.add(1, "wood_color.0001.exr")
+    sequence.add(1)
+    sequence.add(0, "wood_color.0000.exr")
+
+    assert sequence.ranges == [[0, 1]]
+    assert sequence.path == "wood_color.0000.exr"
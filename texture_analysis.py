@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Texture Analysis
+-----------------------------------------------------------------------
+Reads a strided subsample of the texture files with NumPy and computes
+statistics used to set up the shading networks.
+Uncompressed TIFF and Targa files are memory-mapped, other formats are
+read with OpenImageIO or Pillow when available, decoding a reduced
+resolution where the format allows it.
+-----------------------------------------------------------------------
+'''
+
+import multiprocessing
+import os
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import OpenImageIO as oiio
+except ImportError:
+    oiio = None
+
+from . import texture_info
+
+
+SAMPLE_SIZE = 512
+
+OPENGL = "OpenGL"
+DIRECTX = "DirectX"
+
+## Minimum correlation needed to tell the normal map convention
+NORMAL_CONFIDENCE = 0.1
+
+## Classification works on a small decimated grid
+CLASSIFY_SIZE = 64
+CLASSIFY_FIELDS = ["color", "normal", "roughness", "displacement", "ao"]
+CLASSIFY_THREADS = 8
+
+## Pools shared by all the callers, so that their workers are started once per session
+process_pool = None
+thread_pool = None
+pool_lock = threading.Lock()
+
+
+def isAvailable():
+    return np is not None
+
+
+def getStep(width, height, size):
+    return max(1, max(width, height) // size)
+
+
+def normalize(pixels):
+    if pixels.dtype.kind == 'u':
+        return pixels.astype(np.float32) / np.iinfo(pixels.dtype).max
+    return pixels.astype(np.float32)
+
+
+def readMapped(path, layout, size):
+    height, width, channels = layout["shape"]
+    data = np.memmap(path, dtype=layout["dtype"], mode='r', offset=layout["offset"], shape=layout["shape"])
+
+    step = getStep(width, height, size)
+    pixels = data[::step, ::step, layout["order"]]
+    if layout["bottom_up"]:
+        pixels = pixels[::-1]
+
+    return normalize(np.ascontiguousarray(pixels))
+
+
+def readTiles(image_input, spec, step):
+    '''
+    This function reads every step-th tile of a tiled image in both directions and joins them,
+    so that only a fraction of the tiles is decoded. Tiles keep their full resolution.
+    '''
+
+    rows = []
+    for y in range(spec.y, spec.y + spec.height, spec.tile_height * step):
+        tiles = []
+        for x in range(spec.x, spec.x + spec.width, spec.tile_width * step):
+            tile = image_input.read_tile(x, y, spec.z, oiio.FLOAT)
+            if tile is None:
+                return None
+            tile = tile.reshape(spec.tile_height, spec.tile_width, -1)
+            ## Tiles on the right and bottom edges extend past the image
+            tiles.append(tile[:spec.y + spec.height - y, :spec.x + spec.width - x])
+        rows.append(np.concatenate(tiles, axis=1))
+
+    return np.concatenate(rows, axis=0)
+
+
+def readOIIO(path, size):
+    image_input = oiio.ImageInput.open(path)
+    if image_input is None:
+        return None
+
+    try:
+        ## Use the smallest mip level still larger than the sample
+        level = 0
+        spec = image_input.spec()
+        while image_input.seek_subimage(0, level + 1):
+            next_spec = image_input.spec()
+            if max(next_spec.width, next_spec.height) < size:
+                break
+            level += 1
+            spec = next_spec
+        image_input.seek_subimage(0, level)
+
+        step = getStep(spec.width, spec.height, size)
+        if spec.tile_width > 0 and step > 1:
+            ## Tiled files without a small enough mip level
+            pixels = readTiles(image_input, spec, step)
+        elif step > 1:
+            ## Scanline files are read one sampled row at a time
+            rows = [image_input.read_scanline(y, 0, oiio.FLOAT)[::step] for y in range(spec.y, spec.y + spec.height, step)]
+            pixels = np.array(rows)
+        else:
+            pixels = image_input.read_image(oiio.FLOAT)
+            if pixels is not None:
+                pixels = pixels[::step, ::step]
+    finally:
+        image_input.close()
+
+    if pixels is None:
+        return None
+
+    return pixels.reshape(pixels.shape[0], pixels.shape[1], -1).astype(np.float32)
+
+
+def readPIL(path, size):
+    image = Image.open(path)
+    ## For JPEG files draft selects a DCT scale, so the full image is never decoded
+    image.draft(image.mode, (size, size))
+
+    if image.mode in ('P', 'LA', 'PA', 'CMYK', 'YCbCr', '1'):
+        image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+
+    step = getStep(image.size[0], image.size[1], size)
+    if step > 1 and hasattr(image, "reduce") and image.mode in ('L', 'RGB', 'RGBA', 'I', 'F'):
+        image = image.reduce(step)
+        step = 1
+
+    pixels = np.asarray(image)[::step, ::step]
+    if image.mode.startswith('I'):
+        ## 16 bit images are loaded as 32 bit integers
+        pixels = pixels.astype(np.float32) / 65535.0
+    else:
+        pixels = normalize(pixels)
+
+    return pixels.reshape(pixels.shape[0], pixels.shape[1], -1)
+
+
+def readSample(path, size=SAMPLE_SIZE):
+    '''
+    This function returns a float32 array (rows, columns, channels) sampling the
+    texture with a stride, so that its longest side is about size pixels.
+    Integer data is normalized to 0-1. Returns None if the file can't be read.
+    '''
+
+    if np is None:
+        return None
+
+    try:
+        layout = texture_info.getRawLayout(path)
+        if layout is not None:
+            return readMapped(path, layout, size)
+        if oiio is not None:
+            pixels = readOIIO(path, size)
+            if pixels is not None:
+                return pixels
+        if Image is not None:
+            return readPIL(path, size)
+    except Exception:
+        pass
+
+    return None
+
+
+def isFloatData(path):
+    info = texture_info.readTextureInfo(path)
+    if info is None:
+        return False
+    ## 32 bit TIFF files hold floats in practice
+    return info.format in ("exr", "hdr") or (info.format == "tiff" and info.bit_depth == 32)
+
+
+def analyzeDisplacement(paths, size=SAMPLE_SIZE):
+    '''
+    This function returns the minimum, maximum and mid-level value of a displacement map,
+    taking all the UDIM tiles into account, or None if no tile can be read.
+    The mid-level depends on the data type only, never on the content of the map:
+    0 for float data, which is signed, 0.5 for integer data.
+    '''
+
+    minimum = None
+    maximum = None
+    floats = False
+    for path in paths:
+        pixels = readSample(path, size)
+        if pixels is None:
+            continue
+        values = pixels[:, :, 0]
+        floats = floats or isFloatData(path)
+        minimum = float(values.min()) if minimum is None else min(minimum, float(values.min()))
+        maximum = float(values.max()) if maximum is None else max(maximum, float(values.max()))
+
+    if minimum is None:
+        return None
+
+    return {"min": minimum, "max": maximum, "mid": 0.0 if floats else 0.5}
+
+
+def detectNormalConvention(path, size=SAMPLE_SIZE):
+    '''
+    This function tells whether a tangent space normal map uses the OpenGL (Y+)
+    or DirectX (Y-) convention, returning the convention and a confidence in 0-1.
+    The convention is None when it can't be told.
+
+    A normal map made from a height field has zero curl: the vertical derivative of
+    the red channel matches the horizontal derivative of the green channel, with the
+    opposite sign for OpenGL maps (image rows go down) and the same sign for DirectX maps.
+    '''
+
+    pixels = readSample(path, size)
+    if pixels is None or pixels.shape[2] < 2 or min(pixels.shape[:2]) < 3:
+        return None, 0.0
+
+    nx = pixels[:, :, 0] * 2.0 - 1.0
+    ny = pixels[:, :, 1] * 2.0 - 1.0
+
+    dx_dy = (nx[1:, :-1] - nx[:-1, :-1]).ravel()
+    dy_dx = (ny[:-1, 1:] - ny[:-1, :-1]).ravel()
+
+    norm = np.sqrt(np.dot(dx_dy, dx_dy) * np.dot(dy_dx, dy_dx))
+    if norm == 0.0:
+        return None, 0.0
+
+    correlation = float(np.dot(dx_dy, dy_dx) / norm)
+    if abs(correlation) < NORMAL_CONFIDENCE:
+        return None, abs(correlation)
+
+    if correlation < 0.0:
+        return OPENGL, -correlation
+    return DIRECTX, correlation
+
+
+def getFeatures(pixels):
+    '''
+    This function returns the statistics used to classify a texture:
+    channel count, whether channels are identical, mean saturation, mean length
+    of the decoded normal vectors, mean/deviation of the values, fraction of
+    bright pixels and smoothness (mean pixel difference relative to deviation).
+    '''
+
+    channels = pixels.shape[2]
+    rgb = pixels[:, :, :3] if channels >= 3 else np.repeat(pixels[:, :, :1], 3, axis=2)
+
+    maximum = rgb.max(axis=2)
+    minimum = rgb.min(axis=2)
+    saturation = np.where(maximum > 0.0, (maximum - minimum) / np.maximum(maximum, 1e-6), 0.0)
+
+    normals = rgb * 2.0 - 1.0
+    lengths = np.sqrt((normals * normals).sum(axis=2))
+
+    values = rgb.mean(axis=2)
+    deviation = float(values.std())
+    gradient = float(np.abs(np.diff(values, axis=1)).mean()) if values.shape[1] > 1 else 0.0
+
+    return {"channels": channels,
+            "grayscale": bool(float((maximum - minimum).mean()) < 0.02),
+            "saturation": float(saturation.mean()),
+            "normal_length": float(lengths.mean()),
+            "mean": [float(m) for m in rgb.reshape(-1, 3).mean(axis=0)],
+            "value": float(values.mean()),
+            "deviation": deviation,
+            "bright": float((values > 0.8).mean()),
+            "roughness": gradient / deviation if deviation > 0.0 else 0.0}
+
+
+def clamp(value):
+    return min(1.0, max(0.0, value))
+
+
+def scoreFeatures(features):
+    '''
+    This function returns a score in 0-1 for each map type a texture could be.
+    '''
+
+    red, green, blue = features["mean"]
+    gray = 1.0 if features["grayscale"] else 0.0
+
+    normal = (1.0 - gray) * clamp(1.0 - abs(features["normal_length"] - 1.0) * 4.0) \
+        * clamp((blue - 0.5) * 4.0) * clamp(1.0 - (abs(red - 0.5) + abs(green - 0.5)) * 4.0)
+    color = (1.0 - gray) * clamp(features["saturation"] * 5.0) * (1.0 - normal)
+
+    ## Occlusion is mostly white, height maps are smooth, roughness maps are noisy
+    ao = gray * clamp((features["value"] - 0.55) * 3.0) * clamp(features["bright"] * 2.0)
+    displacement = gray * clamp(1.0 - features["roughness"] * 2.0) * (1.0 - ao)
+    roughness = gray * clamp(0.5 + features["roughness"]) * (1.0 - ao) * (1.0 - displacement * 0.5)
+
+    return {"color": color, "normal": normal, "roughness": roughness, "displacement": displacement, "ao": ao}
+
+
+def classifyFile(path):
+    '''
+    This function suggests a map type for a texture from its content.
+    Returns the path, the suggested field and a confidence in 0-1,
+    or a None field if the file can't be read.
+    '''
+
+    pixels = readSample(path, CLASSIFY_SIZE)
+    if pixels is None:
+        return path, None, 0.0
+
+    scores = scoreFeatures(getFeatures(pixels))
+    field = max(CLASSIFY_FIELDS, key=lambda f: scores[f])
+    total = sum(scores.values())
+    if total == 0.0:
+        return path, None, 0.0
+
+    ## The confidence is high when one score is both high and clearly ahead of the others
+    return path, field, scores[field] * scores[field] / total
+
+
+def getPythonExecutable():
+    '''
+    This function returns the mayapy executable when running inside the Maya GUI, since
+    worker processes would otherwise be started with the Maya executable itself.
+    '''
+
+    executable = os.path.basename(sys.executable).lower()
+    if not executable.startswith("maya") or executable.startswith("mayapy"):
+        return None
+
+    name = "mayapy.exe" if sys.platform.startswith("win") else "mayapy"
+    directory = os.path.dirname(sys.executable)
+    ## On macOS mayapy is in Maya.app/Contents/bin, next to the MacOS folder
+    for candidate in [os.path.join(directory, name), os.path.join(directory, os.pardir, "bin", name)]:
+        if os.path.isfile(candidate):
+            return os.path.normpath(candidate)
+
+    return None
+
+
+def createProcessPool(processes=None):
+    '''
+    This function returns a process pool started with the spawn method, so that the Maya
+    process is never forked, or a thread pool if processes can't be started that way.
+    '''
+
+    if not hasattr(multiprocessing, "get_context"):
+        return ThreadPool(processes)
+
+    from multiprocessing import spawn
+
+    context = multiprocessing.get_context("spawn")
+    executable = getPythonExecutable()
+    ## set_executable changes the interpreter of every spawn pool of the session, so the previous one
+    ## is restored once the workers are started. Workers started later to replace a dead one use it.
+    previous = spawn.get_executable()
+    if executable is not None:
+        context.set_executable(executable)
+
+    try:
+        return context.Pool(processes)
+    except (OSError, ValueError, ImportError, AssertionError):
+        return ThreadPool(processes)
+    finally:
+        spawn.set_executable(previous)
+
+
+def getProcessPool(processes=None):
+    '''
+    This function returns the process pool of the session, creating it with the given number
+    of processes at the first call. Must be called from the main thread.
+    '''
+
+    global process_pool
+    with pool_lock:
+        if process_pool is None:
+            process_pool = createProcessPool(processes)
+    return process_pool
+
+
+def getThreadPool():
+    global thread_pool
+    with pool_lock:
+        if thread_pool is None:
+            thread_pool = ThreadPool(CLASSIFY_THREADS)
+    return thread_pool
+
+
+def classifyFiles(paths):
+    '''
+    This function classifies the textures from their content in the thread pool of the session,
+    which can be used from the scan threads. Returns a list of (path, field, confidence),
+    skipping files that can't be read.
+    '''
+
+    if np is None or len(paths) == 0:
+        return []
+
+    results = getThreadPool().map(classifyFile, paths)
+
+    return [result for result in results if result[1] is not None]
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Texture Bake
+-----------------------------------------------------------------------
+Bakes into new texture files the operations the shading networks would
+otherwise evaluate at every shading sample: glossiness inversion and
+base color multiplied by ambient occlusion.
+Baked files are written to a folder beside their sources, one per UDIM
+tile, and are rebuilt only when a source is newer than them.
+Needs NumPy, and OpenImageIO or Pillow to read and write the files.
+-----------------------------------------------------------------------
+'''
+
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import OpenImageIO as oiio
+except ImportError:
+    oiio = None
+
+from . import texture_analysis
+from . import texture_info
+
+
+## A subfolder keeps baked files out of the texture folder scan
+BAKE_FOLDER = "baked"
+INVERTED_SUFFIX = "_inverted"
+AO_SUFFIX = "_ao"
+
+
+def isAvailable():
+    return np is not None and (oiio is not None or Image is not None)
+
+
+def getBakedPath(path, suffix):
+    '''
+    This function returns the path of the baked version of a file in the bake folder,
+    adding suffix before the UDIM and frame numbers so that tiles and frames still match
+    a <UDIM> or <f> pattern.
+    '''
+
+    directory, file_name = os.path.split(path)
+    matches = [m for m in [texture_info.getUdimMatch(file_name), texture_info.getFrameMatch(file_name)] if m is not None]
+    if len(matches) > 0:
+        position = min(m.start() for m in matches)
+        ## Keep the separator before the number
+        while position > 0 and file_name[position - 1] in "._-":
+            position -= 1
+    else:
+        position = file_name.rindex(".") if "." in file_name else len(file_name)
+
+    return os.path.join(directory, BAKE_FOLDER, file_name[:position] + suffix + file_name[position:])
+
+
+def isUpToDate(target, sources):
+    if not os.path.isfile(target):
+        return False
+    return os.path.getmtime(target) >= max(os.path.getmtime(s) for s in sources)
+
+
+def readImage(path):
+    '''
+    This function returns the pixels of a file as a float32 array (rows, columns, channels)
+    normalized to 0-1, together with the data type the file is stored with.
+    '''
+
+    if oiio is not None:
+        image_input = oiio.ImageInput.open(path)
+        if image_input is not None:
+            try:
+                spec = image_input.spec()
+                pixels = image_input.read_image(oiio.FLOAT)
+            finally:
+                image_input.close()
+            return pixels.reshape(spec.height, spec.width, spec.nchannels), spec.format
+
+    image = Image.open(path)
+    if image.mode in ('P', 'LA', 'PA', 'CMYK', 'YCbCr', '1'):
+        image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+
+    pixels = np.asarray(image)
+    if image.mode.startswith('I'):
+        return (pixels.astype(np.float32) / 65535.0).reshape(pixels.shape[0], pixels.shape[1], -1), 'uint16'
+
+    return texture_analysis.normalize(pixels).reshape(pixels.shape[0], pixels.shape[1], -1), str(pixels.dtype)
+
+
+def writeImage(path, pixels, data_type):
+    '''
+    This function writes a float32 array normalized to 0-1 with the given data type.
+    Files are written to a temporary name first, so a failed bake leaves no partial file.
+    '''
+
+    temp = path + ".tmp" + os.path.splitext(path)[1]
+
+    if oiio is not None:
+        spec = oiio.ImageSpec(pixels.shape[1], pixels.shape[0], pixels.shape[2], data_type)
+        output = oiio.ImageOutput.create(temp)
+        if output is None or not output.open(temp, spec):
+            raise IOError("Cannot write %s" % path)
+        output.write_image(pixels)
+        output.close()
+    else:
+        if data_type == 'uint16' and pixels.shape[2] == 1:
+            image = Image.fromarray((np.clip(pixels[:, :, 0], 0.0, 1.0) * 65535.0 + 0.5).astype(np.uint16))
+        else:
+            ## Pillow writes 8 bit color files only
+            data = (np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+            image = Image.fromarray(data[:, :, 0] if data.shape[2] == 1 else data)
+        image.save(temp, format=Image.registered_extensions().get(os.path.splitext(path)[1].lower()))
+
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+def bakeInverted(job):
+    '''
+    This function writes 1 - source to target. Alpha is left unchanged.
+    '''
+
+    source, target = job
+    pixels, data_type = readImage(source)
+    channels = min(pixels.shape[2], 3)
+    pixels[:, :, :channels] = 1.0 - pixels[:, :, :channels]
+    writeImage(target, pixels, data_type)
+
+    return target
+
+
+def bakeMultiplied(job):
+    '''
+    This function writes color * ao to target. Multiplying the sRGB encoded values
+    matches the product of the linear values, apart from the linear toe of sRGB.
+    The occlusion map is resampled to the color resolution if needed.
+    '''
+
+    color, ao, target = job
+    color_pixels, data_type = readImage(color)
+    ao_pixels = readImage(ao)[0]
+
+    if ao_pixels.shape[:2] != color_pixels.shape[:2]:
+        rows = np.arange(color_pixels.shape[0]) * ao_pixels.shape[0] // color_pixels.shape[0]
+        columns = np.arange(color_pixels.shape[1]) * ao_pixels.shape[1] // color_pixels.shape[1]
+        ao_pixels = ao_pixels[rows][:, columns]
+
+    channels = min(color_pixels.shape[2], 3)
+    color_pixels[:, :, :channels] *= ao_pixels[:, :, :1] if ao_pixels.shape[2] < 3 else ao_pixels[:, :, :channels]
+    writeImage(target, color_pixels, data_type)
+
+    return target
+
+
+def runJobs(function, jobs, processes=None, get_sources=None):
+    '''
+    This function runs the jobs whose target is missing or older than its sources in the
+    process pool of the session and returns the targets of all the jobs. The target is the last
+    item of a job, get_sources returns the source paths of a job (all the other items by default).
+    '''
+
+    if get_sources is None:
+        get_sources = lambda job: job[:-1]
+
+    pending = [job for job in jobs if not isUpToDate(job[-1], get_sources(job))]
+
+    if len(pending) > 0:
+        for directory in set(os.path.dirname(job[-1]) for job in pending):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        texture_analysis.getProcessPool(processes).map(function, pending)
+
+    return [job[-1] for job in jobs]
+
+
+def bakeGlossinessToRoughness(paths, processes=None):
+    '''
+    This function bakes the inversion of each glossiness tile and returns the baked paths.
+    '''
+
+    return runJobs(bakeInverted, [(path, getBakedPath(path, INVERTED_SUFFIX)) for path in paths], processes)
+
+
+def bakeColorAO(color_paths, ao_paths, processes=None):
+    '''
+    This function bakes each base color tile multiplied by the occlusion tile with the
+    same UDIM number (or by the only occlusion file) and returns the baked paths.
+    '''
+
+    ao_tiles = dict((texture_info.getUdimNumber(path), path) for path in ao_paths)
+
+    jobs = []
+    for path in color_paths:
+        ao = ao_tiles.get(texture_info.getUdimNumber(path), ao_paths[0])
+        jobs.append((path, ao, getBakedPath(path, AO_SUFFIX)))
+
+    return runJobs(bakeMultiplied, jobs, processes)
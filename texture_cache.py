@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Texture Cache
+-----------------------------------------------------------------------
+Keeps local copies of texture files, so that renders read them from a
+local disk instead of the network. Each source folder gets its own
+cache folder and file names are kept, so UDIM patterns still match
+the local copies. A copy is valid while its size and modification time
+match the source; the least recently used copies are evicted when the
+cache grows over its size limit.
+-----------------------------------------------------------------------
+'''
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+CACHE_SIZE = 50 * 1024 * 1024 * 1024
+THREADS = 8
+
+
+def evictFiles(directory, max_size, keep=None):
+    '''
+    This function removes the least recently accessed files under directory until they fit
+    max_size. Files in keep and temporary files are never removed. Returns the size left.
+    '''
+
+    keep = set(os.path.normpath(path) for path in keep or [])
+
+    entries = []
+    total = 0
+    for folder, dirs, files in os.walk(directory):
+        for f in files:
+            full_path = os.path.join(folder, f)
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if os.path.normpath(full_path) not in keep and not f.endswith(".tmp"):
+                entries.append((stat.st_atime, stat.st_size, full_path))
+
+    entries.sort()
+    for accessed, size, full_path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(full_path)
+            total -= size
+        except OSError:
+            pass
+
+    return total
+
+
+class TextureCache():
+
+    def __init__(self, directory, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def getLocalFolder(self, path):
+        source_dir = os.path.dirname(os.path.abspath(path)).replace("\\", "/").lower()
+        key = hashlib.sha1(source_dir.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, key)
+
+    def getLocalPath(self, path):
+        return os.path.join(self.getLocalFolder(path), os.path.basename(path))
+
+    def isValid(self, path, local):
+        try:
+            source = os.stat(path)
+            copy = os.stat(local)
+        except OSError:
+            return False
+
+        ## Copies keep the modification time of their source
+        return source.st_size == copy.st_size and int(source.st_mtime) == int(copy.st_mtime)
+
+    def isCached(self, path):
+        return self.isValid(path, self.getLocalPath(path))
+
+    def touch(self, local):
+        ## The access time is used to find the least recently used copies,
+        ## the modification time is kept to validate them
+        os.utime(local, (time.time(), os.stat(local).st_mtime))
+
+    def copy(self, path):
+        '''
+        This function returns the local copy of a texture, copying it if it is missing
+        or out of date. Returns None if the source can't be copied.
+        '''
+
+        local = self.getLocalPath(path)
+
+        if self.isValid(path, local):
+            self.touch(local)
+            return local
+
+        folder = os.path.dirname(local)
+        temp = local + ".%s.tmp" % threading.current_thread().ident
+        try:
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    ## Another thread created it
+                    if not os.path.isdir(folder):
+                        raise
+            shutil.copy2(path, temp)
+            if os.path.isfile(local):
+                os.remove(local)
+            os.rename(temp, local)
+            self.touch(local)
+        except (IOError, OSError):
+            if os.path.isfile(temp):
+                os.remove(temp)
+            return None
+
+        return local
+
+    def copyFiles(self, paths, threads=THREADS):
+        '''
+        This function copies the files in a thread pool, then evicts old copies
+        keeping the new ones. Returns a dictionary from source to local path,
+        None for the files that can't be copied.
+        '''
+
+        paths = sorted(set(paths))
+        pool = ThreadPool(threads)
+        try:
+            copies = pool.map(self.copy, paths)
+        finally:
+            pool.close()
+            pool.join()
+
+        result = dict(zip(paths, copies))
+        self.evict(keep=set(local for local in copies if local is not None))
+
+        return result
+
+    def getSize(self):
+        total = 0
+        for directory, dirs, files in os.walk(self.directory):
+            for f in files:
+                try:
+                    total += os.path.getsize(os.path.join(directory, f))
+                except OSError:
+                    pass
+        return total
+
+    def evict(self, keep=None):
+        '''
+        This function removes the least recently used copies until the cache fits its
+        size limit. Files in keep are never removed.
+        '''
+
+        with self.lock:
+            evictFiles(self.directory, self.max_size, keep)
+
+    def clear(self):
+        with self.lock:
+            for f in os.listdir(self.directory):
+                shutil.rmtree(os.path.join(self.directory, f), ignore_errors=True)
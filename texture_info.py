@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Texture Info
+-----------------------------------------------------------------------
+Reads width, height, channels and bit depth of texture files from
+their headers only, without decoding any pixel.
+Supported formats: PNG, JPEG, TIFF/TX, OpenEXR, Targa, Radiance HDR.
+Also parses the UDIM, frame and resolution tokens of texture file names
+and indexes folders by file name. Maya is not used.
+-----------------------------------------------------------------------
+'''
+
+import bisect
+import os
+import re
+import struct
+
+
+UDIM_TOKEN = "<UDIM>"
+UDIM_PATTERN = r'(?<!\d)1\d{3}(?!\d)'
+
+## Frame numbers come last, between dots right before the extension, like name.1001.0024.exr.
+## Numbers after an underscore, like name_01.png or name_2048.png, are variants, not frames
+FRAME_TOKEN = "<f>"
+FRAME_PATTERN = r'(?<=\.)(\d+)(?=\.[^.]+$)'
+
+## Resolution tokens like 2K or 4k, not part of a longer word
+TIER_PATTERN = r'(?i)(?<![a-z0-9])(\d{1,2})k(?![a-z0-9])'
+TIERS = ["1K", "2K", "4K", "8K", "16K"]
+
+## Extensions of the files that can be read as textures
+TEXTURE_EXTENSIONS = ["png", "jpg", "jpeg", "tif", "tiff", "exr", "tga", "hdr", "bmp"]
+
+HEADER_SIZE = 65536
+
+## TIFF field types: struct code and size
+TIFF_TYPES = {1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+EXR_PIXEL_SIZE = {0: 4, 1: 2, 2: 4}
+
+
+class TextureInfo():
+
+    def __init__(self, path, file_format, width, height, channels, bit_depth, mip_levels=1, tiled=False):
+        self.path = path
+        self.format = file_format
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bit_depth = bit_depth
+        self.mip_levels = mip_levels
+        self.tiled = tiled
+
+    def getMemory(self):
+        return self.width * self.height * self.channels * self.bit_depth // 8
+
+    def getMipmappedMemory(self):
+        ## A full mip chain adds one third to the base level
+        return self.getMemory() * 4 // 3
+
+    def getResolution(self):
+        return max(self.width, self.height)
+
+    def asDict(self):
+        return {"path": self.path,
+                "format": self.format,
+                "width": self.width,
+                "height": self.height,
+                "channels": self.channels,
+                "bit_depth": self.bit_depth,
+                "mip_levels": self.mip_levels,
+                "tiled": self.tiled}
+
+
+def readTextureInfo(path):
+    '''
+    This function returns a TextureInfo for the given file,
+    or None if the file is missing or its format is not supported.
+    '''
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except (IOError, OSError):
+        return None
+
+    try:
+        if header.startswith(b'\x89PNG'):
+            return readPNG(path, header)
+        elif header.startswith(b'\xff\xd8'):
+            return readJPEG(path)
+        elif header[:4] in (b'II*\x00', b'MM\x00*'):
+            return readTIFF(path)
+        elif header.startswith(b'\x76\x2f\x31\x01'):
+            return readEXR(path, header)
+        elif header.startswith(b'#?'):
+            return readHDR(path, header)
+        elif path.lower().endswith(".tga"):
+            return readTGA(path, header)
+    except (struct.error, IndexError, ValueError):
+        pass
+
+    return None
+
+
+def readPNG(path, header):
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', header[16:26])
+    channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}[color_type]
+    ## Palette images are expanded to 8 bit RGB when loaded
+    if color_type == 3:
+        bit_depth = 8
+
+    return TextureInfo(path, "png", width, height, channels, bit_depth)
+
+
+def readJPEG(path):
+    with open(path, 'rb') as f:
+        f.read(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0:1] != b'\xff':
+                return None
+            code = ord(marker[1:2])
+            length = struct.unpack('>H', f.read(2))[0]
+            ## Start of frame markers, excluding DHT, JPG and DAC
+            if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+                precision, height, width, channels = struct.unpack('>BHHB', f.read(6))
+                return TextureInfo(path, "jpeg", width, height, channels, precision)
+            f.seek(length - 2, 1)
+
+
+def readTIFFDirectories(path, max_values=65536):
+    '''
+    This function returns the tags of each directory of a TIFF file,
+    as a dictionary from tag number to the tuple of its values.
+    '''
+
+    with open(path, 'rb') as f:
+        endian = '<' if f.read(2) == b'II' else '>'
+        f.read(2)
+        offset = struct.unpack(endian + 'I', f.read(4))[0]
+
+        directories = []
+        while offset and len(directories) < 64:
+            f.seek(offset)
+            count = struct.unpack(endian + 'H', f.read(2))[0]
+            entries = [struct.unpack(endian + 'HHI4s', f.read(12)) for index in range(count)]
+            offset = struct.unpack(endian + 'I', f.read(4))[0]
+
+            tags = {"endian": endian}
+            for tag, tag_type, tag_count, value in entries:
+                if tag_type not in TIFF_TYPES or tag_count > max_values:
+                    continue
+                code, size = TIFF_TYPES[tag_type]
+                ## Values not fitting in four bytes are stored at an offset
+                if tag_count * size > 4:
+                    f.seek(struct.unpack(endian + 'I', value)[0])
+                    value = f.read(tag_count * size)
+                tags[tag] = struct.unpack(endian + code * tag_count, value[:tag_count * size])
+            directories.append(tags)
+
+    return directories
+
+
+def readTIFF(path):
+    directories = readTIFFDirectories(path)
+    tags = directories[0]
+
+    width = tags[256][0]
+    height = tags[257][0]
+    channels = tags.get(277, (1,))[0]
+    bit_depth = tags.get(258, (8,))[0]
+
+    ## Each following directory of a .tx file is a mip level
+    return TextureInfo(path, "tiff", width, height, channels, bit_depth, mip_levels=len(directories), tiled=322 in tags)
+
+
+def readEXR(path, header):
+    position = 8
+    attributes = {}
+    while header[position:position + 1] != b'\x00':
+        end = header.index(b'\x00', position)
+        name = header[position:end].decode('ascii')
+        end_type = header.index(b'\x00', end + 1)
+        size = struct.unpack('<i', header[end_type + 1:end_type + 5])[0]
+        attributes[name] = header[end_type + 5:end_type + 5 + size]
+        position = end_type + 5 + size
+
+    channels = 0
+    pixel_size = 2
+    chlist = attributes["channels"]
+    index = 0
+    while chlist[index:index + 1] != b'\x00':
+        index = chlist.index(b'\x00', index) + 1
+        pixel_type = struct.unpack('<i', chlist[index:index + 4])[0]
+        pixel_size = max(pixel_size, EXR_PIXEL_SIZE.get(pixel_type, 2))
+        channels += 1
+        index += 16
+
+    xmin, ymin, xmax, ymax = struct.unpack('<iiii', attributes["dataWindow"])
+    width = xmax - xmin + 1
+    height = ymax - ymin + 1
+
+    tiled = "tiles" in attributes
+    mip_levels = 1
+    if tiled and ord(attributes["tiles"][8:9]) & 0x0f != 0:
+        mip_levels = len(bin(max(width, height))) - 2
+
+    return TextureInfo(path, "exr", width, height, channels, pixel_size * 8, mip_levels=mip_levels, tiled=tiled)
+
+
+def readHDR(path, header):
+    match = re.search(br'\n[-+]Y (\d+) [-+]X (\d+)\n', header)
+    if match is None:
+        return None
+    ## RGBE pixels are expanded to 32 bit float when loaded
+    return TextureInfo(path, "hdr", int(match.group(2)), int(match.group(1)), 3, 32)
+
+
+def readTGA(path, header):
+    width, height, bits = struct.unpack('<HHB', header[12:17])
+    channels = max(1, bits // 8)
+    return TextureInfo(path, "tga", width, height, channels, 8)
+
+
+def getFrameMatch(file_name):
+    '''
+    This function returns the match of the frame number in a file name, or None.
+    A number like 1001 alone before the extension is a UDIM tile, not a frame.
+    '''
+
+    match = re.search(FRAME_PATTERN, file_name)
+    if match is None:
+        return None
+
+    udims = [m for m in re.finditer(UDIM_PATTERN, file_name) if m.start() < match.start()]
+    if len(udims) == 0 and re.match(UDIM_PATTERN + '$', match.group(1)):
+        return None
+
+    return match
+
+
+def getUdimMatch(file_name):
+    frame = getFrameMatch(file_name)
+    matches = [m for m in re.finditer(UDIM_PATTERN, file_name) if frame is None or m.start() != frame.start()]
+    if len(matches) == 0:
+        return None
+    return matches[-1]
+
+
+def getUdimPattern(path):
+    '''
+    This function replaces the UDIM number in the file name of path with <UDIM>.
+    '''
+
+    head_tail = os.path.split(path)
+    match = getUdimMatch(head_tail[1])
+    if match is None:
+        return path
+
+    return os.path.join(head_tail[0], head_tail[1][:match.start()] + UDIM_TOKEN + head_tail[1][match.end():])
+
+
+def getUdimNumber(path):
+    match = getUdimMatch(os.path.basename(path))
+    if match is None:
+        return None
+    return match.group(0)
+
+
+def getTier(path):
+    '''
+    This function returns the resolution tier in the file name of path, like 2K, or None.
+    '''
+
+    matches = re.findall(TIER_PATTERN, os.path.basename(path))
+    if len(matches) == 0:
+        return None
+    return "%sK" % int(matches[-1])
+
+
+def getTierFromHeader(path):
+    info = readTextureInfo(path)
+    if info is None:
+        return None
+    return "%sK" % max(1, int(round(info.getResolution() / 1024.0)))
+
+
+def getTierSize(tier):
+    if tier is None:
+        return 0
+    return int(tier[:-1])
+
+
+def selectTier(tiers, tier=None):
+    '''
+    This function returns the tier to use among the available tiers: the largest
+    not above tier, the smallest if all are above it, the largest if tier is None.
+    '''
+
+    tiers = sorted(tiers, key=getTierSize)
+    if tier is None:
+        return tiers[-1]
+
+    lower = [t for t in tiers if getTierSize(t) <= getTierSize(tier)]
+    if len(lower) == 0:
+        return tiers[0]
+    return lower[-1]
+
+
+def replaceTier(path, tier):
+    '''
+    This function replaces the resolution tier in the file name of path.
+    '''
+
+    directory, file_name = os.path.split(path)
+    matches = list(re.finditer(TIER_PATTERN, file_name))
+    if len(matches) == 0:
+        return path
+
+    match = matches[-1]
+    ## Keep the case of the K
+    suffix = file_name[match.end() - 1]
+    return os.path.join(directory, file_name[:match.start()] + tier[:-1] + suffix + file_name[match.end():])
+
+
+def expandUdimPattern(pattern):
+    '''
+    This function returns the sorted list of existing files matching a path containing <UDIM>
+    and/or <f>.
+    '''
+
+    if UDIM_TOKEN not in pattern and FRAME_TOKEN not in pattern:
+        return [pattern]
+
+    directory, file_name = os.path.split(pattern)
+    regex = re.compile(re.escape(file_name).replace(re.escape(UDIM_TOKEN), r'1\d{3}').replace(re.escape(FRAME_TOKEN), r'\d+') + '$')
+
+    try:
+        files = os.listdir(directory or os.curdir)
+    except OSError:
+        return []
+
+    return sorted(os.path.join(directory, f) for f in files if regex.match(f))
+
+
+def getFrameNumber(path):
+    match = getFrameMatch(os.path.basename(path))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def getFramePattern(path):
+    '''
+    This function replaces the frame number in the file name of path with <f>.
+    Returns the pattern and the padding of the frame number, or None if there is no frame.
+    '''
+
+    directory, file_name = os.path.split(path)
+    match = getFrameMatch(file_name)
+    if match is None:
+        return None, 0
+
+    return os.path.join(directory, file_name[:match.start()] + FRAME_TOKEN + file_name[match.end():]), len(match.group(1))
+
+
+class FileSequence():
+    '''
+    Frames of an animated texture, stored as a pattern with <f> and the sorted ranges
+    of the frame numbers found, so that its size doesn't depend on the number of frames.
+    '''
+
+    def __init__(self, pattern, padding):
+        self.pattern = pattern
+        self.padding = padding
+        ## [first, last] frames of each run of consecutive frames
+        self.ranges = []
+        self.path = None
+
+    def add(self, frame, path=None):
+        ## Files are usually listed in order, so most frames extend the last range
+        index = bisect.bisect_right(self.ranges, [frame, float('inf')])
+        if index > 0 and self.ranges[index - 1][1] >= frame:
+            return
+
+        if index == 0 and path is not None:
+            self.path = path
+
+        before = index > 0 and self.ranges[index - 1][1] == frame - 1
+        after = index < len(self.ranges) and self.ranges[index][0] == frame + 1
+        if before and after:
+            self.ranges[index - 1][1] = self.ranges.pop(index)[1]
+        elif before:
+            self.ranges[index - 1][1] = frame
+        elif after:
+            self.ranges[index][0] = frame
+        else:
+            self.ranges.insert(index, [frame, frame])
+
+    def getFrameCount(self):
+        return sum(last - first + 1 for first, last in self.ranges)
+
+    def getFirstFrame(self):
+        return self.ranges[0][0]
+
+    def getLastFrame(self):
+        return self.ranges[-1][1]
+
+    def getPath(self, frame):
+        return self.pattern.replace(FRAME_TOKEN, "%0*d" % (self.padding, frame))
+
+    def getFrames(self):
+        for first, last in self.ranges:
+            for frame in range(first, last + 1):
+                yield frame
+
+    def formatRanges(self):
+        return ", ".join(str(first) if first == last else "%s-%s" % (first, last) for first, last in self.ranges)
+
+    def __str__(self):
+        return "%s [%s]" % (self.pattern, self.formatRanges())
+
+
+def normalizePath(path):
+    return path.replace("\\", "/")
+
+
+def buildFileIndex(root):
+    '''
+    This function scans root once and returns a dictionary from lower case file name
+    to the list of paths with that name. UDIM tiles are indexed also by their <UDIM> pattern.
+    '''
+
+    index = {}
+    for directory, dirs, files in os.walk(root):
+        for f in files:
+            if f.startswith("."):
+                continue
+            path = normalizePath(os.path.join(directory, f))
+            index.setdefault(f.lower(), []).append(path)
+
+            pattern = getUdimPattern(f)
+            if pattern != f:
+                candidates = index.setdefault(pattern.lower(), [])
+                pattern_path = normalizePath(os.path.join(directory, pattern))
+                if pattern_path not in candidates:
+                    candidates.append(pattern_path)
+
+    return index
+
+
+def getMatchingLength(path, candidate):
+    '''
+    This function returns how many trailing folders two paths have in common.
+    '''
+
+    parts = path.lower().split("/")[:-1]
+    candidate_parts = candidate.lower().split("/")[:-1]
+    length = 0
+    while length < min(len(parts), len(candidate_parts)) and parts[-1 - length] == candidate_parts[-1 - length]:
+        length += 1
+
+    return length
+
+
+def resolvePath(path, index, rules=None):
+    '''
+    This function returns the new path of a texture, or None if it can't be resolved.
+    Prefix rules, a list of (old prefix, new prefix) pairs, are applied first and their
+    result is kept if it is in the index. Otherwise the file name is looked up in the index,
+    preferring the candidate with the most trailing folders in common with the old path.
+    '''
+
+    path = normalizePath(path)
+    candidates = index.get(path.split("/")[-1].lower(), [])
+
+    for old_prefix, new_prefix in rules or []:
+        old_prefix = normalizePath(old_prefix)
+        if path.lower().startswith(old_prefix.lower()):
+            new_path = normalizePath(new_prefix) + path[len(old_prefix):]
+            if new_path in candidates:
+                return new_path
+
+    if len(candidates) == 0:
+        return None
+
+    return max(candidates, key=lambda candidate: getMatchingLength(path, candidate))
+
+
+def getRawLayout(path):
+    '''
+    This function returns the layout of the pixels of an uncompressed TIFF or Targa file,
+    so that they can be memory-mapped: byte offset, numpy dtype string, shape, channel order
+    and whether rows are stored bottom up. Returns None for any other file.
+    '''
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(18)
+
+        if header[:4] in (b'II*\x00', b'MM\x00*'):
+            return getTIFFLayout(path)
+        elif path.lower().endswith(".tga"):
+            return getTGALayout(path, header)
+    except (IOError, OSError, struct.error, IndexError, KeyError):
+        pass
+
+    return None
+
+
+def getTIFFLayout(path):
+    tags = readTIFFDirectories(path)[0]
+
+    ## Only uncompressed, interleaved, single image strips can be mapped
+    if tags.get(259, (1,))[0] != 1 or tags.get(284, (1,))[0] != 1 or 322 in tags:
+        return None
+
+    width = tags[256][0]
+    height = tags[257][0]
+    channels = tags.get(277, (1,))[0]
+    bit_depth = tags.get(258, (8,))[0]
+    sample_format = tags.get(339, (1,))[0]
+
+    offsets = tags[273]
+    counts = tags[279]
+    for index in range(1, len(offsets)):
+        if offsets[index] != offsets[index - 1] + counts[index - 1]:
+            return None
+
+    kind = 'f' if sample_format == 3 else 'u'
+    dtype = tags["endian"] + kind + str(bit_depth // 8)
+
+    return {"offset": offsets[0], "dtype": dtype, "shape": (height, width, channels),
+            "order": list(range(channels)), "bottom_up": False}
+
+
+def getTGALayout(path, header):
+    id_length, colormap_type, image_type = struct.unpack('<BBB', header[:3])
+    colormap_length, colormap_bits = struct.unpack('<HB', header[5:8])
+    width, height, bits, descriptor = struct.unpack('<HHBB', header[12:18])
+
+    ## Only uncompressed true color and grayscale images can be mapped
+    if image_type not in (2, 3):
+        return None
+
+    channels = bits // 8
+    offset = 18 + id_length + colormap_length * colormap_bits // 8
+
+    ## Targa stores BGR(A), bottom row first unless bit 5 of the descriptor is set
+    order = [2, 1, 0, 3][:channels] if channels >= 3 else list(range(channels))
+
+    return {"offset": offset, "dtype": 'u1', "shape": (height, width, channels),
+            "order": order, "bottom_up": not descriptor & 0x20}
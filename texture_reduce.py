@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Texture Reduce
+-----------------------------------------------------------------------
+Rewrites grayscale data maps stored with three or four identical
+channels as single channel files, at the bit depth their map type
+needs. Materials read these maps through outAlpha with alphaIsLuminance,
+so the extra channels only cost memory and I/O.
+Reduced files are written to the bake folder beside their sources.
+-----------------------------------------------------------------------
+'''
+
+import os
+from multiprocessing.pool import ThreadPool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import texture_analysis
+from . import texture_bake
+from . import texture_info
+
+
+REDUCED_SUFFIX = "_gray"
+GRAY_TOLERANCE = 1.0 / 255.0
+CHECK_THREADS = 16
+
+## Bit depth of the reduced files per map type, None keeps the depth of the source
+MAP_BIT_DEPTH = {"roughness": 8,
+                 "glossiness": 8,
+                 "metal": 8,
+                 "ao": 8,
+                 "specular": 8,
+                 "opacity": 8,
+                 "displacement": None}
+
+
+def isAvailable():
+    return texture_bake.isAvailable()
+
+
+def isGrayscale(path):
+    '''
+    This function tells whether the color channels of a texture are identical,
+    comparing them on a strided sample of its rows.
+    '''
+
+    pixels = texture_analysis.readSample(path)
+    if pixels is None or pixels.shape[2] < 3:
+        return False
+
+    rgb = pixels[:, :, :3]
+    return float(np.abs(rgb - rgb[:, :, :1]).max()) <= GRAY_TOLERANCE
+
+
+def canWrite(info, bits):
+    '''
+    This function tells whether a file can be reduced to the given bit depth (None keeps its depth)
+    with the image libraries available.
+    '''
+
+    if texture_bake.oiio is not None:
+        return True
+    if info.format in ("exr", "hdr"):
+        return False
+
+    ## Without OpenImageIO only 8 and 16 bit integer files can be written, and Pillow
+    ## loads files of more than one channel as 8 bit, whatever their depth
+    target_bits = info.bit_depth if bits is None else min(bits, info.bit_depth)
+    if target_bits > 8 and info.channels > 1:
+        return False
+    return target_bits <= 16
+
+
+def isReducible(item):
+    '''
+    This function tells whether a file, given as (path, bits), would get smaller as a single
+    channel file with the given bit depth.
+    '''
+
+    path, bits = item
+    info = texture_info.readTextureInfo(path)
+    if info is None or not canWrite(info, bits):
+        return False
+
+    if info.channels >= 3:
+        return isGrayscale(path)
+    if info.channels == 2:
+        ## Luminance and alpha, the alpha channel is not used
+        return True
+
+    return bits is not None and info.bit_depth > bits
+
+
+def findReducible(items, threads=CHECK_THREADS):
+    '''
+    This function checks the (path, bits) items in a thread pool and returns the set of the reducible ones.
+    '''
+
+    items = sorted(set(items))
+    pool = ThreadPool(threads)
+    try:
+        results = pool.map(isReducible, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    return set(item for item, reducible in zip(items, results) if reducible)
+
+
+def getReducedPath(path, bits=None):
+    '''
+    This function returns the path of the reduced file of a source at a bit depth, None keeping
+    the depth of the source. The depth is in the name, so a source used as 8 and 16 bit data
+    gets a file for each.
+    '''
+
+    suffix = REDUCED_SUFFIX if bits is None else "%s%s" % (REDUCED_SUFFIX, bits)
+    return texture_bake.getBakedPath(path, suffix)
+
+
+def reduceFile(job):
+    '''
+    This function writes the first channel of source to target with the given bit depth.
+    '''
+
+    source, bits, target = job
+    pixels, data_type = texture_bake.readImage(source)
+    texture_bake.writeImage(target, np.ascontiguousarray(pixels[:, :, :1]), 'uint8' if bits == 8 else data_type)
+
+    return target
+
+
+def reduceFiles(jobs, processes=None):
+    '''
+    This function runs the (source, bits, target) jobs whose target is out of date in a
+    process pool and returns the targets.
+    '''
+
+    return texture_bake.runJobs(reduceFile, jobs, processes, get_sources=lambda job: job[:1])
+
+
+def getSavedBytes(source, target):
+    '''
+    This function returns the texture memory and the disk space saved by a reduced file.
+    '''
+
+    source_info = texture_info.readTextureInfo(source)
+    target_info = texture_info.readTextureInfo(target)
+    if source_info is None or target_info is None:
+        return 0, 0
+
+    return source_info.getMemory() - target_info.getMemory(), os.path.getsize(source) - os.path.getsize(target)
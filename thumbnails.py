@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------
+Material Creator - Thumbnails
+-----------------------------------------------------------------------
+Generates small previews of the texture files and keeps them in an
+on-disk cache keyed by file path, size and modification time, evicting
+the least recently used previews when the cache grows over its size limit.
+Only a reduced resolution of each texture is decoded: JPEG files are
+decoded with DCT scaling by Pillow, EXR/TIFF/TX files are read from
+their smallest usable mip level by OpenImageIO, sampling every n-th
+row or tile of files without one. Both are optional:
+without them no preview is generated.
+-----------------------------------------------------------------------
+'''
+
+import hashlib
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from . import texture_analysis
+from . import texture_cache
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import OpenImageIO as oiio
+except ImportError:
+    oiio = None
+
+
+CACHE_SIZE = 256 * 1024 * 1024
+## The cache is evicted below its limit, so that its folder is listed once per many previews
+EVICT_RATIO = 0.9
+THREADS = 4
+
+OIIO_FORMATS = ["exr", "tif", "tiff", "tx", "hdr"]
+
+
+def getCacheKey(path, size):
+    '''
+    This function returns a key depending on the path, file size and modification time
+    of a texture, so that an edited texture gets a new preview.
+    '''
+
+    stat = os.stat(path)
+    key = "%s_%s_%s_%s" % (os.path.abspath(path).replace("\\", "/"), stat.st_size, stat.st_mtime, size)
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def readWithPIL(path, size):
+    image = Image.open(path)
+    ## For JPEG files draft selects a DCT scale, so the full image is never decoded
+    image.draft('RGB', (size, size))
+    if image.mode.startswith('I'):
+        ## 16 bit images are scaled to 8 bit
+        image = image.point(lambda value: value * (1.0 / 256)).convert('L')
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGB')
+    image.thumbnail((size, size))
+    return image
+
+
+def readWithOIIO(path, size):
+    ## Files without a small mip level are sampled by row or tile, so the memory used
+    ## depends on the thumbnail size and not on the texture size
+    pixels = texture_analysis.readOIIO(path, size)
+    if pixels is None:
+        return None
+
+    pixels = pixels[:, :, :3]
+
+    ## Linear data is displayed with a 2.2 gamma
+    if texture_analysis.isFloatData(path):
+        pixels = pixels.clip(0.0, 1.0) ** (1.0 / 2.2)
+
+    pixels = (pixels.clip(0.0, 1.0) * 255.0).astype('uint8')
+    if pixels.shape[2] == 1:
+        pixels = pixels[:, :, 0]
+
+    return pixels
+
+
+class ThumbnailCache():
+
+    def __init__(self, directory, size, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.size = size
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        ## Size of the cache folder, listed at the first eviction
+        self.total = None
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def getThumbnail(self, path):
+        '''
+        This function returns the path of the preview of a texture,
+        generating it if it is not in the cache yet. Returns None if
+        the texture can't be read.
+        '''
+
+        try:
+            key = getCacheKey(path, self.size)
+        except (IOError, OSError):
+            return None
+
+        thumbnail = os.path.join(self.directory, key + ".png")
+
+        if os.path.isfile(thumbnail):
+            ## The access time is used to find the least recently used previews
+            os.utime(thumbnail, None)
+            return thumbnail
+
+        if not self.generate(path, thumbnail):
+            return None
+
+        self.addSize(os.path.getsize(thumbnail))
+        return thumbnail
+
+    def generate(self, path, thumbnail):
+        extension = path.split(".")[-1].lower()
+        temp = thumbnail + ".%s.tmp" % threading.current_thread().ident
+
+        try:
+            if oiio is not None and (extension in OIIO_FORMATS or Image is None):
+                pixels = readWithOIIO(path, self.size)
+                if pixels is None:
+                    return False
+                if Image is not None:
+                    Image.fromarray(pixels).save(temp, 'PNG')
+                else:
+                    channels = 1 if len(pixels.shape) == 2 else pixels.shape[2]
+                    output = oiio.ImageOutput.create(temp + ".png")
+                    output.open(temp + ".png", oiio.ImageSpec(pixels.shape[1], pixels.shape[0], channels, oiio.UINT8))
+                    output.write_image(pixels)
+                    output.close()
+                    os.rename(temp + ".png", temp)
+            elif Image is not None:
+                readWithPIL(path, self.size).save(temp, 'PNG')
+            else:
+                return False
+
+            ## Other threads never see a partially written preview
+            if os.path.isfile(thumbnail):
+                os.remove(temp)
+            else:
+                os.rename(temp, thumbnail)
+        except Exception:
+            if os.path.isfile(temp):
+                os.remove(temp)
+            return False
+
+        return True
+
+    def addSize(self, size):
+        '''
+        This function counts a new preview in the cache size and evicts the least recently
+        used previews only when the cache grows over its limit.
+        '''
+
+        with self.lock:
+            if self.total is not None and self.total + size <= self.max_size:
+                self.total += size
+                return
+            self.total = texture_cache.evictFiles(self.directory, int(self.max_size * EVICT_RATIO))
+
+
+class ThumbnailLoader():
+    '''
+    Generates previews in a thread pool. The callback receives the texture
+    path and the preview path (None if it can't be generated) and is called
+    from a pool thread: the caller has to move it to the main thread.
+    '''
+
+    def __init__(self, cache, threads=THREADS):
+        self.cache = cache
+        self.threads = threads
+        self.pool = None
+
+    def request(self, path, callback):
+        if self.pool is None:
+            self.pool = ThreadPool(self.threads)
+        self.pool.apply_async(self.cache.getThumbnail, (path,), callback=lambda thumbnail: callback(path, thumbnail))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None